@@ -0,0 +1,74 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Нормализация адресов клиник, общая для геокодера (parsing/geocoder.py) и бота (geo.py): геокодер
+# сохраняет координаты по нормализованному адресу в api_addresses.csv, бот по нему же их находит,
+# поэтому реализация одна. Регрессия - parsing/test_geocoder.py на корпусе normalize_corpus.csv
+
+# Сокращения заменяются только целыми словами: "п." в "корп." или "дом" в "домодедовская" не трогаются.
+# Все правила собраны в одно регулярное выражение и применяются за один проход
+_ADDRESS_WORDS = {
+    'ул.': 'улица',
+    'пер.': 'переулок', 'пер': 'переулок', 'пер-к': 'переулок',
+    'пр.': 'проезд', 'пр-д': 'проезд', 'пр': 'проезд',
+    'проспект': 'пр-т', 'просп.': 'пр-т',
+    'бульвар': 'бул', 'бул.': 'бул',
+    'ш.': 'шоссе',
+    'пл.': 'площадь',
+    'наб.': 'набережная',
+    'дом': 'д.',
+    'к.': 'корпус', 'корп.': 'корпус',
+    'строение': 'стр', 'стр.': 'стр',
+    'пос.': 'поселок', 'п.': 'поселок',
+    'город': 'г.', 'г.': 'г.', 'г': 'г.',
+}
+
+
+def _alternation(words):
+    # Длинные варианты раньше коротких: "пер-к" и "пер." раньше "пер"
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+# Слово начинается не после буквы, цифры, точки, дефиса или косой черты ("д. 7г", "в/г" - не город).
+# Сокращение с точкой может быть слито со следующим словом ("ул.ленина"), тогда между ними
+# вставляется пробел; без точки - должно заканчиваться само
+_ADDRESS_TOKENS = re.compile(
+    r'(?<![\w./-])(?:(?P<dotted>{})(?P<glued>(?=[^\W\d_]))?|(?P<word>{})(?![\w-]))'.format(
+        _alternation(word for word in _ADDRESS_WORDS if word.endswith('.')),
+        _alternation(word for word in _ADDRESS_WORDS if not word.endswith('.')),
+    )
+)
+_ADDRESS_TAIL = re.compile(r'\b(офис|помещение|этаж|вход|каб\.?|комн\.?)\b.*')
+_ADDRESS_BRACKETS = re.compile(r'\(.*?\)')
+_ADDRESS_SPACES = re.compile(r'\s+')
+_ADDRESS_COUNTRY = re.compile(r'^россия\b[\s,]*')
+_ADDRESS_TRAILING = re.compile(r'(?:[\s;,]|\bд\.|\bстр\b\.?)+$')
+
+
+def _replace_address_word(match):
+    if match.group('word') is not None:
+        return _ADDRESS_WORDS[match.group('word')]
+    replacement = _ADDRESS_WORDS[match.group('dotted')]
+    return replacement + ' ' if match.group('glued') is not None else replacement
+
+
+def normalize_address(address):
+    if address is None or (not isinstance(address, str) and pd.isna(address)):
+        return ''
+
+    address = _ADDRESS_TOKENS.sub(_replace_address_word, str(address).lower())
+    address = _ADDRESS_BRACKETS.sub('', address)
+    address = _ADDRESS_TAIL.sub('', address)
+    address = _ADDRESS_SPACES.sub(' ', address).strip()
+    address = _ADDRESS_COUNTRY.sub('', address)
+    return _ADDRESS_TRAILING.sub('', address)
+
+
+def normalize_addresses(addresses):
+    # Колонка адресов целиком: каждый уникальный адрес нормализуется один раз, пропуски -> ''
+    addresses = pd.Series(addresses)
+    codes, unique_addresses = pd.factorize(addresses)
+    normalized = np.array([normalize_address(address) for address in unique_addresses] + [''], dtype=object)
+    return pd.Series(normalized[codes], index=addresses.index, name='address_norm')
@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# Нагрузочный прогон обработчиков бота на синтетических данных со схемой data.csv.
+# Каждый масштаб считается в отдельном процессе, чтобы пиковый RSS относился только к нему:
+#
+#   python benchmark.py --scales 40k,400k,4M --output benchmark_results.jsonl
+
+SCALES = {'40k': 40_000, '400k': 400_000, '4M': 4_000_000}
+
+SURNAME_ROOTS = [
+    'Иван', 'Петр', 'Сидор', 'Смирн', 'Кузнец', 'Попов', 'Васильев', 'Соколов', 'Михайлов', 'Новиков',
+    'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров', 'Павлов', 'Козлов', 'Степанов',
+    'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьев', 'Борисов', 'Яковлев',
+    'Григорьев', 'Романов', 'Воробьев', 'Сергеев', 'Кузьмин', 'Фролов', 'Александров', 'Дмитриев', 'Королев', 'Гусев',
+    'Киселев', 'Ильин', 'Максимов', 'Поляков', 'Сорокин', 'Виноградов', 'Ковалев', 'Белов', 'Медведев', 'Антонов',
+    'Тарасов', 'Жуков', 'Баранов', 'Филиппов', 'Комаров', 'Давыдов', 'Беляев', 'Герасимов', 'Богданов', 'Осипов',
+    'Ёлкин', 'Сидоренко', 'Шевченко', 'Бондаренко', 'Коваленко', 'Ткаченко', 'Кравченко', 'Олейник', 'Мельник', 'Гаврилов',
+]
+SURNAME_SUFFIXES = ['', 'ский', 'цев', 'ин', 'ов', 'ец']
+FIRST_NAMES = [
+    'Александр', 'Алексей', 'Андрей', 'Анна', 'Антон', 'Артём', 'Валентина', 'Виктор', 'Владимир', 'Галина',
+    'Дарья', 'Денис', 'Дмитрий', 'Евгений', 'Екатерина', 'Елена', 'Иван', 'Ирина', 'Кирилл', 'Ксения',
+    'Максим', 'Марина', 'Мария', 'Михаил', 'Наталья', 'Никита', 'Николай', 'Ольга', 'Павел', 'Пётр',
+    'Роман', 'Светлана', 'Сергей', 'Татьяна', 'Юлия', 'Юрий',
+]
+PATRONYMICS = [
+    'Александрович', 'Алексеевич', 'Андреевич', 'Викторович', 'Владимирович', 'Дмитриевич', 'Евгеньевич', 'Иванович',
+    'Михайлович', 'Николаевич', 'Олегович', 'Павлович', 'Петрович', 'Сергеевич', 'Юрьевич',
+    'Александровна', 'Алексеевна', 'Андреевна', 'Викторовна', 'Владимировна', 'Дмитриевна', 'Ивановна',
+    'Михайловна', 'Николаевна', 'Олеговна', 'Петровна', 'Сергеевна', 'Юрьевна',
+]
+SPECIALITIES = [
+    'терапевт', 'педиатр', 'кардиолог', 'детский кардиолог', 'невролог', 'детский невролог', 'акушер-гинеколог',
+    'гинеколог', 'эндокринолог', 'онколог', 'офтальмолог', 'оториноларинголог', 'уролог', 'хирург',
+    'травматолог-ортопед', 'дерматолог', 'гастроэнтеролог', 'пульмонолог', 'ревматолог', 'психотерапевт',
+    'психиатр', 'стоматолог', 'стоматолог-терапевт', 'стоматолог-хирург', 'ортодонт', 'маммолог', 'флеболог',
+    'аллерголог-иммунолог', 'нефролог', 'гематолог', 'врач узи', 'физиотерапевт', 'косметолог', 'трихолог',
+]
+METRO_STATIONS = [
+    'Новослободская', 'Менделеевская', 'Сокол', 'Аэропорт', 'Динамо', 'Белорусская', 'Маяковская', 'Тверская',
+    'Пушкинская', 'Чеховская', 'Арбатская', 'Смоленская', 'Киевская', 'Парк Культуры', 'Фрунзенская',
+    'Спортивная', 'Университет', 'Юго-Западная', 'Тёплый Стан', 'Беляево', 'Калужская', 'Новые Черёмушки',
+    'Профсоюзная', 'Академическая', 'Ленинский проспект', 'Шаболовская', 'Октябрьская', 'Добрынинская',
+    'Павелецкая', 'Таганская', 'Курская', 'Комсомольская', 'Красносельская', 'Сокольники', 'Преображенская площадь',
+    'Черкизовская', 'Бауманская', 'Электрозаводская', 'Семёновская', 'Партизанская', 'Измайловская',
+    'Первомайская', 'Щёлковская', 'ВДНХ', 'Алексеевская', 'Рижская', 'Проспект Мира', 'Сухаревская',
+    'Тургеневская', 'Китай-город', 'Третьяковская', 'Новокузнецкая', 'Марьино', 'Братиславская', 'Люблино',
+    'Медведково', 'Бабушкинская', 'Свиблово', 'Ботанический сад', 'Отрадное', 'Владыкино', 'Петровско-Разумовская',
+    'Беговая (МЦД-1)', 'Савёловская', 'Дмитровская', 'Тимирязевская', 'Речной вокзал', 'Водный стадион',
+]
+STREETS = [
+    'ул. Ленина', 'Ленинский просп.', 'ул. Тверская', 'Мичуринский просп.', 'ул. Профсоюзная', 'Каширское ш.',
+    'ул. Новослободская', 'Ленинградский просп.', 'просп. Мира', 'ул. Бауманская', 'Варшавское ш.', 'ул. Арбат',
+]
+
+COLUMNS = [
+    'name', 'experience', 'rating_sber', 'review_count_sber', 'price_sber', 'link_sber', 'clinics_count_sber',
+    'clinic_1_name_sber', 'clinic_1_address_sber', 'clinic_1_metro_sber',
+    'clinic_1_name_prod', 'clinic_1_address_prod', 'clinic_1_metro_prod',
+    'clinic_2_name_sber', 'clinic_2_address_sber', 'clinic_2_metro_sber',
+    'clinic_2_name_prod', 'clinic_2_address_prod', 'clinic_2_metro_prod',
+    'clinic_3_name_sber', 'clinic_3_address_sber', 'clinic_3_metro_sber',
+    'clinic_3_name_prod', 'clinic_3_address_prod', 'clinic_3_metro_prod',
+    'link_prod', 'price_prod', 'rating_prod', 'review_count_prod', 'clinics_count_prod',
+    'speciality', 'is_kids', 'is_adults', 'rating', 'price',
+]
+
+
+def parse_scale(scale):
+    if scale in SCALES:
+        return SCALES[scale]
+    return int(float(scale.lower().replace('k', 'e3').replace('m', 'e6')))
+
+
+def _pick(rng, pool, size):
+    return np.asarray(pool, dtype=object)[rng.integers(0, len(pool), size)]
+
+
+def generate_dataset(rows, seed=0):
+    # Векторная генерация: 4 млн строк собираются за десятки секунд, а не часы
+    rng = np.random.default_rng(seed)
+    surnames = [root + suffix for root in SURNAME_ROOTS for suffix in SURNAME_SUFFIXES]
+    numbers = pd.Series(np.arange(rows)).astype(str)
+
+    df = pd.DataFrame(index=np.arange(rows))
+    df['name'] = (
+        pd.Series(_pick(rng, surnames, rows)) + ' '
+        + pd.Series(_pick(rng, FIRST_NAMES, rows)) + ' '
+        + pd.Series(_pick(rng, PATRONYMICS, rows))
+    )
+    df['experience'] = rng.integers(0, 45, rows)
+
+    # Комбинации специальностей берём из ограниченного набора, как и в реальных данных
+    combos = []
+    for _ in range(4000):
+        chosen = rng.choice(len(SPECIALITIES), rng.integers(1, 4), replace=False)
+        combos.append(str([SPECIALITIES[index] for index in chosen]))
+    speciality = _pick(rng, combos, rows)
+
+    # Клиники общие для многих врачей: название, адрес и метро согласованы между собой
+    clinic_count = max(rows // 20, 50)
+    clinic_names = pd.Series(np.arange(clinic_count)).astype(str).radd('Клиника №').to_numpy(dtype=object)
+    clinic_addresses = (
+        'г. Москва, ' + pd.Series(_pick(rng, STREETS, clinic_count)) + ', д. '
+        + pd.Series(rng.integers(1, 150, clinic_count)).astype(str)
+    ).to_numpy(dtype=object)
+    clinic_metro = _pick(rng, METRO_STATIONS, clinic_count)
+    clinic_metro[rng.random(clinic_count) < 0.05] = np.nan
+
+    for source in ('sber', 'prod'):
+        present = rng.random(rows) < 0.85
+        rating = np.round(rng.uniform(2.5 if source == 'sber' else 0.0, 5.0, rows), 1)
+        price = rng.integers(10, 80, rows) * 100.0
+        df[f'rating_{source}'] = np.where(present, rating, np.nan)
+        df[f'price_{source}'] = np.where(present & (rng.random(rows) < 0.95), price, np.nan)
+        df[f'review_count_{source}'] = np.where(present, rng.integers(0, 300, rows), 0)
+        clinics = np.where(present, rng.integers(1, 4, rows), 0)
+        df[f'clinics_count_{source}'] = clinics
+        for slot in (1, 2, 3):
+            clinic = rng.integers(0, clinic_count, rows)
+            has_clinic = clinics >= slot
+            df[f'clinic_{slot}_name_{source}'] = np.where(has_clinic, clinic_names[clinic], np.nan)
+            df[f'clinic_{slot}_address_{source}'] = np.where(has_clinic, clinic_addresses[clinic], np.nan)
+            df[f'clinic_{slot}_metro_{source}'] = np.where(has_clinic, clinic_metro[clinic], np.nan)
+
+    df['link_sber'] = ('https://docdoc.ru/doctor/' + numbers).where(df['rating_sber'].notna())
+    df['link_prod'] = ('https://prodoctorov.ru/moskva/vrach/' + numbers).where(df['rating_prod'].notna())
+    df['speciality'] = speciality
+    df['is_kids'] = rng.random(rows) < 0.3
+    df['is_adults'] = rng.random(rows) < 0.9
+    df['rating'] = np.round(df[['rating_sber', 'rating_prod']].mean(axis=1), 2)
+    df['price'] = df[['price_sber', 'price_prod']].mean(axis=1)
+    return df[COLUMNS]
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class FakeBot:
+    id = 1
+
+
+class FakePhotoSize:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class FakeMessage:
+    # Ответы не уходят в Telegram, а складываются в replies
+    def __init__(self, user_id, text=None):
+        self.text = text
+        self.from_user = FakeUser(user_id)
+        self.replies = []
+
+    def get_bot(self):
+        return FakeBot()
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs.get('reply_markup')))
+        return self
+
+    async def reply_photo(self, photo, caption=None, **kwargs):
+        self.replies.append((caption, kwargs.get('reply_markup')))
+        sent = FakeMessage(self.from_user.id)
+        sent.photo = [FakePhotoSize('benchmark-photo')]
+        return sent
+
+
+class FakeCallbackQuery:
+    def __init__(self, user_id, data):
+        self.data = data
+        self.from_user = FakeUser(user_id)
+        self.message = FakeMessage(user_id)
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class FakeUpdate:
+    def __init__(self, message=None, callback_query=None):
+        self.message = message
+        self.callback_query = callback_query
+
+
+def _percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'calls': len(latencies),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+    }
+
+
+def _queries(df, rng, count):
+    names = df['name'].to_numpy()[rng.integers(0, len(df), count)]
+    surnames = [name.split()[0] for name in names]
+    # Опечатка: меняем местами две соседние буквы фамилии
+    typos = []
+    for name in names:
+        position = int(rng.integers(1, max(len(name.split()[0]) - 1, 2)))
+        typos.append(name[:position - 1] + name[position] + name[position - 1] + name[position + 1:])
+    specialities = [f'{speciality}, ' for speciality in _pick(rng, SPECIALITIES, count)]
+    with_metro = [
+        f'{speciality}, {station}'
+        for speciality, station in zip(_pick(rng, SPECIALITIES, count), _pick(rng, METRO_STATIONS, count))
+    ]
+    return {
+        'name_exact': list(names),
+        'name_partial': surnames,
+        'name_similar': typos,
+        'speciality': specialities,
+        'speciality_metro': with_metro,
+    }
+
+
+async def _measure(calls):
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def run_handlers(bot, iterations, concurrency, seed=0):
+    rng = np.random.default_rng(seed)
+    snapshot = bot.bot_data.snapshot
+    queries = _queries(snapshot.df, rng, iterations)
+    results = {}
+
+    for search_type, texts in queries.items():
+        calls = [
+            lambda text=text, user_id=user_id: bot.handle_message(FakeUpdate(FakeMessage(user_id, text)), None)
+            for user_id, text in enumerate(texts, start=1)
+        ]
+        results[search_type] = _percentiles(await _measure(calls))
+
+    # Листание и карточки - по сессиям, которые оставил поиск по специальности
+    user_ids = list(range(1, iterations + 1))
+    for user_id, text in zip(user_ids, queries['speciality']):
+        await bot.handle_message(FakeUpdate(FakeMessage(user_id, text)), None)
+
+    async def page(user_id):
+        session = bot.bot_data.get_user_session(user_id)
+        total_pages = max((len(session) + 4) // 5, 1) if session is not None else 1
+        query = FakeCallbackQuery(user_id, f'page_{int(rng.integers(0, total_pages))}')
+        await bot.button_handler(FakeUpdate(callback_query=query), None)
+
+    async def show_page(user_id):
+        await bot.show_results_page(FakeUpdate(FakeMessage(user_id)), None, user_id, int(rng.integers(0, 50)))
+
+    async def detail(user_id):
+        session = bot.bot_data.get_user_session(user_id)
+        if session is None or not len(session):
+            return
+        index = int(session.row_ids[int(rng.integers(0, len(session)))])
+        query = FakeCallbackQuery(user_id, f'detail_{index}')
+        await bot.button_handler(FakeUpdate(callback_query=query), None)
+
+    results['page_callback'] = _percentiles(await _measure([lambda u=u: page(u) for u in user_ids]))
+    results['show_results_page'] = _percentiles(await _measure([lambda u=u: show_page(u) for u in user_ids]))
+    results['detail'] = _percentiles(await _measure([lambda u=u: detail(u) for u in user_ids]))
+
+    row_ids = rng.integers(0, len(snapshot.df), iterations)
+    latencies = []
+    for index in row_ids:
+        started = time.perf_counter()
+        bot.render_detailed_result(snapshot, int(index))
+        latencies.append(time.perf_counter() - started)
+    results['format_detailed_result'] = _percentiles(latencies)
+
+    # Пропускная способность: много пользователей одновременно, смесь запросов
+    mixed = [text for texts in queries.values() for text in texts]
+    rng.shuffle(mixed)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def user_request(user_id, text):
+        async with slots:
+            await bot.handle_message(FakeUpdate(FakeMessage(user_id, text)), None)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        user_request(1_000_000 + user_id, text) for user_id, text in enumerate(mixed)
+    ))
+    elapsed = time.perf_counter() - started
+    results['throughput'] = {
+        'requests': len(mixed),
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(mixed) / elapsed, 1),
+        'rejected': bot.search_executor.rejected,
+    }
+    return results
+
+
+def peak_rss_mb():
+    # На Linux ru_maxrss в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_scale(rows, iterations, concurrency, work_dir, seed=0, query_cache=0):
+    data_file = os.path.join(work_dir, f'doctors_{rows}.csv')
+    snapshot_dir = os.path.join(work_dir, f'snapshot_{rows}')
+
+    started = time.perf_counter()
+    if not os.path.exists(data_file):
+        generate_dataset(rows, seed).to_csv(data_file, index=False)
+    generated = time.perf_counter() - started
+
+    # bot.py создаёт DataSearchBot при импорте, поэтому окружение задаём до него.
+    # Общий кэш запросов по умолчанию выключен: специальностей мало, и с ним сценарии поиска
+    # мерили бы попадания в кэш, а не сам поиск
+    os.environ.update({
+        'DATA_FILE': data_file,
+        'SNAPSHOT_DIR': snapshot_dir,
+        'DATA_RELOAD_INTERVAL': '0',
+        'PHOTO_CACHE': '',
+        'QUERY_CACHE_SIZE': str(query_cache),
+    })
+    started = time.perf_counter()
+    import bot
+    loaded = time.perf_counter() - started
+    bot.search_executor.start()
+
+    try:
+        results = asyncio.run(run_handlers(bot, iterations, concurrency, seed))
+    finally:
+        bot.search_executor.shutdown()
+
+    return {
+        'rows': rows,
+        'executor': bot.search_executor.kind,
+        'query_cache': query_cache,
+        'generate_s': round(generated, 2),
+        'load_s': round(loaded, 2),
+        'handlers': results,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    cache = f", кэш запросов {report['query_cache']}" if report.get('query_cache') else ""
+    print(f"\n{report['rows']} строк ({report['executor']}{cache}): генерация {report['generate_s']} с, "
+          f"загрузка {report['load_s']} с, пиковый RSS {report['peak_rss_mb']} МБ")
+    print(f"{'сценарий':<24}{'вызовов':>9}{'p50, мс':>11}{'p99, мс':>11}")
+    for name, stats in report['handlers'].items():
+        if name == 'throughput':
+            continue
+        print(f"{name:<24}{stats['calls']:>9}{stats['p50_ms']:>11.3f}{stats['p99_ms']:>11.3f}")
+    throughput = report['handlers']['throughput']
+    print(f"Пропускная способность: {throughput['requests_per_s']} запросов/с "
+          f"({throughput['requests']} запросов, {throughput['concurrency']} одновременно, "
+          f"отклонено {throughput['rejected']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк обработчиков бота на синтетических данных')
+    parser.add_argument('--scales', default='40k', help='через запятую: 40k,400k,4M или число строк')
+    parser.add_argument('--iterations', type=int, default=300, help='вызовов на каждый сценарий')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'doctors_benchmark'))
+    parser.add_argument('--output', help='дописать результаты в файл JSON Lines для сравнения между версиями')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--query-cache', type=int, default=0,
+                        help='размер общего кэша запросов (QUERY_CACHE_SIZE); 0 - мерить поиск без кэша')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    if args.single:
+        report = run_scale(
+            parse_scale(args.scales), args.iterations, args.concurrency, args.work_dir, args.seed, args.query_cache
+        )
+        print(json.dumps(report, ensure_ascii=False))
+        return
+
+    revision = _git_revision()
+    for scale in args.scales.split(','):
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', '--scales', scale.strip(),
+             '--iterations', str(args.iterations), '--concurrency', str(args.concurrency),
+             '--work-dir', args.work_dir, '--seed', str(args.seed), '--query-cache', str(args.query_cache)],
+            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if completed.returncode != 0:
+            print(f"Масштаб {scale}: ошибка\n{completed.stderr}")
+            continue
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        report.update({'scale': scale.strip(), 'revision': revision, 'timestamp': time.time()})
+        print_report(report)
+        if args.output:
+            with open(args.output, 'a', encoding='utf-8') as output:
+                output.write(json.dumps(report, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,104 +1,131 @@
 import os
+import time
 import pandas as pd
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent, KeyboardButton,
+    ReplyKeyboardMarkup, ReplyKeyboardRemove
+)
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, InlineQueryHandler, filters
+)
 from dotenv import load_dotenv
 import numpy as np
 
+from executor import UserBusy, create_executor
+from geo import MAX_RADIUS_KM
+from metrics import REGISTRY, SIZE_BUCKETS, TimedRequest, log_metrics_periodically, metrics_route, serve_metrics, timed_handler
+from photos import create_photo_cache
+from query_cache import create_query_cache
+from rendering import RESULTS_PER_PAGE, render_detailed_result, render_results_page, render_suggestions
+from search import (
+    NEARBY_RADIUS_KM, RANKED_AHEAD, find_by_name, find_by_reviews, find_by_speciality_and_metro, find_nearby,
+    name_query_key, rank_results, speciality_query_key, suggest_metro
+)
+from sessions import create_session_store
+from snapshot import Snapshot, SnapshotWatcher, load_or_build_snapshot
+from webhook import run_webhook
+
 load_dotenv()
 
 class DataSearchBot:
-    def __init__(self, data_file='data.csv'):
+    def __init__(self, data_file='data.csv', snapshot_dir=None):
         self.data_file = data_file
-        self.df = self.load_data()
-        self.user_searches = {}
+        self.snapshot_dir = snapshot_dir
+        self.snapshot = self.load_data()
+        self.sessions = create_session_store()
+        self.query_cache = create_query_cache()
+        self.query_cache.clear(self.snapshot.version)
 
     def load_data(self):
         try:
-            df = pd.read_csv(self.data_file)
-            if 'name' in df.columns:
-                df['name_lower'] = df['name'].str.lower().str.strip()
-            return df
+            return load_or_build_snapshot(self.data_file, self.snapshot_dir)
         except FileNotFoundError:
             print(f"Файл {self.data_file} не найден!")
-            return pd.DataFrame()
         except Exception as e:
             print(f"Ошибка при загрузке данных: {e}")
-            return pd.DataFrame()
-
-    def search_by_name(self, name):
-        if self.df.empty:
-            return None, "empty_df"
+        return Snapshot.build(pd.DataFrame())
 
-        name_lower = name.lower().strip()
-        exact_match = self.df[self.df['name_lower'] == name_lower]
-
-        if not exact_match.empty:
-            return exact_match, "exact"
-
-        partial_match = self.df[self.df['name_lower'].str.contains(name_lower, na=False)]
-
-        if not partial_match.empty:
-            return partial_match.sort_values(by = ['rating', 'price'], ascending = [False, True]), "partial"
+    def reload_data(self):
+        try:
+            snapshot = load_or_build_snapshot(self.data_file, self.snapshot_dir)
+        except Exception as e:
+            print(f"Ошибка при обновлении данных, продолжаем работу на старых: {e}")
+            return False
+
+        if snapshot.version == self.snapshot.version:
+            return False
+        self.snapshot = snapshot
+        self.query_cache.clear(snapshot.version)
+        print(f"Данные обновлены: версия {snapshot.version}, {len(snapshot.df)} врачей")
+        return True
+
+    @property
+    def df(self):
+        return self.snapshot.df
+
+    @property
+    def all_ids(self):
+        return self.snapshot.all_ids
+
+    @property
+    def market_stats(self):
+        return self.snapshot.market_stats
+
+    def find_by_name(self, name, snapshot=None):
+        snapshot = snapshot or self.snapshot
+        key = name_query_key(name)
+        cached = self.query_cache.get(snapshot.version, key)
+        if cached is not None:
+            return cached
+        return self.query_cache.put(snapshot.version, key, *find_by_name(snapshot, name))
+
+    def find_by_speciality_and_metro(self, speciality, metro=None, snapshot=None):
+        snapshot = snapshot or self.snapshot
+        key = speciality_query_key(speciality, metro)
+        cached = self.query_cache.get(snapshot.version, key)
+        if cached is not None:
+            return cached
+        return self.query_cache.put(snapshot.version, key, find_by_speciality_and_metro(snapshot, speciality, metro))
 
-        return None, "not_found"
+    def search_by_name(self, name):
+        snapshot = self.snapshot
+        row_ids, search_type = self.find_by_name(name, snapshot)
+        if not len(row_ids):
+            return None, search_type
+        return snapshot.df.iloc[row_ids], search_type
 
     def search_by_speciality_and_metro(self, speciality, metro=None):
-        if self.df.empty:
+        snapshot = self.snapshot
+        row_ids = self.find_by_speciality_and_metro(speciality, metro, snapshot)
+        if not len(row_ids):
             return pd.DataFrame()
-
-        speciality_lower = speciality.lower().strip()
-        results = self.df.copy()
-
-        if 'speciality' in self.df.columns:
-            def search_in_specialities(speciality_field):
-                if pd.isna(speciality_field):
-                    return False
-                field_str = str(speciality_field).lower()
-                return speciality_lower in field_str
-
-            speciality_mask = results['speciality'].apply(search_in_specialities)
-            results = results[speciality_mask]
-
-        if results.empty:
-            return results
-
-        if metro and metro.strip():
-            metro_lower = metro.lower().strip()
-            metro_columns = [
-                'clinic_1_metro_sber', 'clinic_2_metro_sber', 'clinic_3_metro_sber',
-                'clinic_1_metro_prod', 'clinic_2_metro_prod', 'clinic_3_metro_prod'
-            ]
-
-            metro_mask = pd.Series([False] * len(results), index=results.index)
-
-            for col in metro_columns:
-                if col in results.columns:
-                    if not results[col].isna().all():
-                        col_mask = results[col].fillna('').astype(str).str.lower().str.contains(metro_lower, na=False)
-                        metro_mask = metro_mask | col_mask
-
-            if metro_mask.any():
-                results = results[metro_mask].sort_values(by = ['rating', 'price'], ascending = [False, True])
-            else:
-                return pd.DataFrame()
-
-        return results
-
-    def save_user_search(self, user_id, results):
-        self.user_searches[user_id] = {
-            'results': results,
-            'current_page': 0,
-            'timestamp': pd.Timestamp.now()
-        }
-
-    def get_user_results_page(self, user_id, page=0, results_per_page=5):
-        if user_id not in self.user_searches:
-            return None, None, None
-
-        user_data = self.user_searches[user_id]
-        results = user_data['results']
-        total_results = len(results)
+        return snapshot.df.iloc[row_ids]
+
+    def suggest_metro(self, metro):
+        return suggest_metro(self.snapshot, metro)
+
+    def save_user_search(self, user_id, results, version=None, ranked=None):
+        # ranked - сколько первых результатов уже упорядочено (None - все)
+        row_ids = results.index.to_numpy() if isinstance(results, pd.DataFrame) else results
+        self.sessions.save(user_id, row_ids, version or self.snapshot.version, ranked)
+
+    def get_user_session(self, user_id, snapshot=None):
+        # Номера строк в сессии относятся к снимку, на котором искали; после обновления данных они устаревают
+        snapshot = snapshot or self.snapshot
+        session = self.sessions.get(user_id)
+        if session is None or session.version != snapshot.version:
+            return None
+        return session
+
+    def session_contains(self, session, index, results_per_page=RESULTS_PER_PAGE):
+        # Обычно открывают карточку с текущей страницы - проверяем её срез до полного просмотра выдачи
+        start_idx = session.current_page * results_per_page
+        if np.any(session.row_ids[start_idx:start_idx + results_per_page] == index):
+            return True
+        return bool(np.any(session.row_ids == index))
+
+    def _page_bounds(self, session, page, results_per_page):
+        total_results = len(session)
         total_pages = (total_results + results_per_page - 1) // results_per_page
 
         if page >= total_pages:
@@ -107,14 +134,67 @@ class DataSearchBot:
             page = 0
 
         start_idx = page * results_per_page
-        end_idx = min(start_idx + results_per_page, total_results)
-
-        page_results = results.iloc[start_idx:end_idx]
-        user_data['current_page'] = page
-
-        return page_results, page, total_pages
-
-bot_data = DataSearchBot()
+        return page, total_pages, start_idx, min(start_idx + results_per_page, total_results)
+
+    def pending_ranking(self, user_id, page=0, results_per_page=RESULTS_PER_PAGE, snapshot=None):
+        # Что надо упорядочить перед показом страницы: (row_ids, ranked, upto) или None.
+        # На большой выдаче ("Показать всех") это частичная сортировка всех строк, поэтому её делают в пуле
+        session = self.get_user_session(user_id, snapshot)
+        if session is None:
+            return None
+        _, _, _, end_idx = self._page_bounds(session, page, results_per_page)
+        if end_idx <= session.ranked:
+            return None
+        # Упорядочиваем выдачу до конца этой страницы и ещё на страницу вперёд
+        return session.row_ids, session.ranked, min(end_idx + results_per_page, len(session))
+
+    def get_user_results_page(self, user_id, page=0, results_per_page=RESULTS_PER_PAGE, snapshot=None):
+        session = self.get_user_session(user_id, snapshot)
+        if session is None:
+            return None, None, None, 0
+
+        page, total_pages, start_idx, end_idx = self._page_bounds(session, page, results_per_page)
+        total_results = len(session)
+
+        row_ids = session.row_ids
+        pending = self.pending_ranking(user_id, page, results_per_page, snapshot)
+        if pending is not None:
+            row_ids, ranked, upto = pending
+            row_ids = rank_results(snapshot or self.snapshot, row_ids, ranked, upto)
+            self.sessions.set_ranking(user_id, row_ids, upto)
+
+        self.sessions.set_page(user_id, page)
+
+        return row_ids[start_idx:end_idx], page, total_pages, total_results
+
+bot_data = DataSearchBot(os.getenv('DATA_FILE', 'data.csv'), os.getenv('SNAPSHOT_DIR'))
+search_executor = create_executor(bot_data)
+photo_cache = create_photo_cache()
+
+REGISTRY.gauge('bot_sessions', lambda: len(bot_data.sessions))
+REGISTRY.counter('bot_session_evictions_total', lambda: bot_data.sessions.evictions)
+REGISTRY.gauge('bot_executor_in_flight', lambda: search_executor.in_flight)
+REGISTRY.gauge('bot_data_rows', lambda: len(bot_data.df))
+REGISTRY.counter('bot_photo_uploads_total', lambda: photo_cache.uploads)
+REGISTRY.gauge('bot_query_cache_size', lambda: len(bot_data.query_cache))
+REGISTRY.counter('bot_query_cache_hits_total', lambda: bot_data.query_cache.hits)
+REGISTRY.counter('bot_query_cache_misses_total', lambda: bot_data.query_cache.misses)
+REGISTRY.counter('bot_query_cache_evictions_total', lambda: bot_data.query_cache.evictions)
+REGISTRY.gauge('bot_query_cache_hit_rate', lambda: round(bot_data.query_cache.hit_rate, 4))
+
+BUSY_TEXT = "Предыдущий запрос ещё обрабатывается, подождите немного"
+
+
+async def cached_search(user_id, snapshot, key, job, *args):
+    # Популярные запросы отдаются из общего кэша без похода в пул; результат - массив только для чтения,
+    # который сессии всех пользователей хранят без копирования
+    cached = bot_data.query_cache.get(snapshot.version, key)
+    if cached is not None:
+        return cached
+    result = await search_executor.run(user_id, snapshot, job, *args)
+    if isinstance(result, tuple):
+        return bot_data.query_cache.put(snapshot.version, key, *result)
+    return bot_data.query_cache.put(snapshot.version, key, result)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome_text = """
@@ -138,6 +218,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /help - показать эту справку
 /search - поиск по ФИО врача
 /speciality - поиск по специальности и метро
+/nearby - врачи рядом с вами по геопозиции
+/reviews - поиск по тексту отзывов
+@имя_бота в любом чате - подсказки по ФИО, специальности и метро
     """
 
     keyboard = [
@@ -173,6 +256,154 @@ async def speciality_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """
     await update.message.reply_text(search_text)
 
+NEARBY_TEXT = """
+Поиск врачей рядом с вами
+
+Отправьте геопозицию кнопкой ниже или через скрепку.
+Специальность и радиус можно указать заранее: /nearby Терапевт, 2
+"""
+
+
+def parse_nearby_request(text):
+    speciality, _, radius = (text or '').partition(',')
+    try:
+        radius_km = float(radius.lower().replace('км', '').replace(',', '.').strip() or NEARBY_RADIUS_KM)
+    except ValueError:
+        radius_km = NEARBY_RADIUS_KM
+    # Больше MAX_RADIUS_KM индекс не ищет, поэтому и в ответах показываем урезанный радиус
+    return speciality.strip() or None, min(max(radius_km, 0.1), MAX_RADIUS_KM)
+
+
+async def nearby_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Геопозиция приходит отдельным сообщением, поэтому специальность и радиус ждут её в user_data
+    speciality, radius_km = parse_nearby_request(' '.join(context.args or []))
+    context.user_data['nearby'] = (speciality, radius_km)
+
+    location_keyboard = ReplyKeyboardMarkup(
+        [[KeyboardButton("Отправить геопозицию", request_location=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True,
+    )
+    speciality_text = f"Специальность: {speciality}, радиус {radius_km:g} км\n" if speciality else ""
+    if radius_km == MAX_RADIUS_KM:
+        speciality_text += f"Радиус поиска - не больше {MAX_RADIUS_KM:g} км\n"
+    await update.message.reply_text(speciality_text + NEARBY_TEXT, reply_markup=location_keyboard)
+
+REVIEWS_TEXT = """
+Поиск врачей по тексту отзывов
+
+Введите команду со специальностью и словами, которые должны встречаться в отзывах:
+/reviews Терапевт, внимательный
+
+Специальность можно не указывать: /reviews без боли
+"""
+
+
+def parse_reviews_request(text):
+    speciality, _, query = (text or '').partition(',')
+    if not query.strip():
+        return None, speciality.strip()
+    return speciality.strip() or None, query.strip()
+
+
+@timed_handler("reviews_command")
+async def reviews_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
+    speciality, query = parse_reviews_request(' '.join(context.args or []))
+    if not query:
+        await update.message.reply_text(REVIEWS_TEXT)
+        return
+
+    snapshot = bot_data.snapshot
+    try:
+        with REGISTRY.timer('bot_search_seconds', search_type="reviews"):
+            results = await search_executor.run(user_id, snapshot, find_by_reviews, speciality, query)
+    except UserBusy:
+        await update.message.reply_text(BUSY_TEXT)
+        return
+    if results is None:
+        await update.message.reply_text("Поиск по отзывам пока недоступен: индекс отзывов не собран")
+        return
+    REGISTRY.observe('bot_result_size', len(results), SIZE_BUCKETS, search_type="reviews")
+
+    speciality_text = f" по специальности '{speciality}'" if speciality else ""
+    if not len(results):
+        await update.message.reply_text(
+            f"Врачи{speciality_text} с отзывами по запросу '{query}' не найдены.\n\n"
+            "Попробуйте другие слова или уберите специальность."
+        )
+        return
+
+    bot_data.save_user_search(user_id, results, snapshot.version)
+    await update.message.reply_text(f"Врачи{speciality_text}, в отзывах о которых лучше всего подходит '{query}'")
+    await show_results_page(update, context, user_id, 0)
+
+# Одинаковые префиксы от разных пользователей Telegram отдаёт из своего кэша, не спрашивая бота
+INLINE_CACHE_SECONDS = 60
+
+
+@timed_handler("inline_query")
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Подсказки считаются прямо в обработчике, без пула: ответ - срез заранее посчитанного списка
+    # или короткий отрезок отсортированных ключей, а на каждое нажатие клавиши пул ответил бы "занят"
+    query = update.inline_query
+    with REGISTRY.timer('bot_search_seconds', search_type="typeahead"):
+        suggestions = render_suggestions(bot_data.snapshot, query.query)
+    await query.answer(
+        [
+            InlineQueryResultArticle(
+                id=result_id, title=title, description=description,
+                input_message_content=InputTextMessageContent(text),
+            )
+            for result_id, title, description, text in suggestions
+        ],
+        cache_time=INLINE_CACHE_SECONDS,
+    )
+
+@timed_handler("handle_location")
+async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    location = update.message.location
+    user_id = update.message.from_user.id
+    speciality, radius_km = context.user_data.get('nearby', (None, NEARBY_RADIUS_KM))
+
+    snapshot = bot_data.snapshot
+    if not len(snapshot.geo_index):
+        await update.message.reply_text(
+            "Поиск по геопозиции пока недоступен: нет координат клиник", reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    try:
+        with REGISTRY.timer('bot_search_seconds', search_type="nearby"):
+            results, distances = await search_executor.run(
+                user_id, snapshot, find_nearby, location.latitude, location.longitude, speciality, radius_km
+            )
+    except UserBusy:
+        await update.message.reply_text(BUSY_TEXT)
+        return
+    REGISTRY.observe('bot_result_size', len(results), SIZE_BUCKETS, search_type="nearby")
+
+    speciality_text = f" по специальности '{speciality}'" if speciality else ""
+    if not len(results):
+        hint_text = (
+            f"\n\nПопробуйте увеличить радиус: /nearby {speciality or 'Терапевт'}, {min(radius_km * 2, MAX_RADIUS_KM):g}"
+            if radius_km < MAX_RADIUS_KM else ""
+        )
+        await update.message.reply_text(
+            f"В радиусе {radius_km:g} км врачи{speciality_text} не найдены.{hint_text}",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        return
+
+    bot_data.save_user_search(user_id, results, snapshot.version)
+    await update.message.reply_text(
+        f"Врачи{speciality_text} в радиусе {radius_km:g} км, ближайший - в {distances.min():.1f} км.\n"
+        f"Сначала те, кто ближе, с рейтингом выше и ценой ниже средней",
+        reply_markup=ReplyKeyboardRemove()
+    )
+    await show_results_page(update, context, user_id, 0)
+
+@timed_handler("handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_message = update.message.text
     user_id = update.message.from_user.id
@@ -181,25 +412,50 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Пожалуйста, введите данные для поиска")
         return
 
+    snapshot = bot_data.snapshot
+
     if ',' in user_message:
         parts = user_message.split(',', 1)
         speciality = parts[0].strip()
         metro = parts[1].strip() if len(parts) > 1 else None
 
-        results = bot_data.search_by_speciality_and_metro(speciality, metro)
+        search_type = "speciality_metro" if metro else "speciality"
+        try:
+            with REGISTRY.timer('bot_search_seconds', search_type=search_type):
+                results = await cached_search(
+                    user_id, snapshot, speciality_query_key(speciality, metro),
+                    find_by_speciality_and_metro, speciality, metro
+                )
+            REGISTRY.observe('bot_result_size', len(results), SIZE_BUCKETS, search_type=search_type)
+            suggestion = None
+            if not len(results) and metro:
+                suggestion = await search_executor.run(user_id, snapshot, suggest_metro, metro)
+        except UserBusy:
+            await update.message.reply_text(BUSY_TEXT)
+            return
 
-        if results.empty:
+        if not len(results):
             metro_text = f" и метро '{metro}'" if metro else ""
+            hint_text = f"\n\nВозможно, вы имели в виду станцию '{suggestion}'?" if suggestion else ""
             await update.message.reply_text(
-                f"Врачи по специальности '{speciality}'{metro_text} не найдены.\n\nПопробуйте изменить запрос или уточнить специальность."
+                f"Врачи по специальности '{speciality}'{metro_text} не найдены.{hint_text}\n\nПопробуйте изменить запрос или уточнить специальность."
             )
             return
 
-        bot_data.save_user_search(user_id, results)
+        bot_data.save_user_search(user_id, results, snapshot.version, RANKED_AHEAD)
         await show_results_page(update, context, user_id, 0)
 
     else:
-        results, search_type = bot_data.search_by_name(user_message)
+        started = time.perf_counter()
+        try:
+            results, search_type = await cached_search(
+                user_id, snapshot, name_query_key(user_message), find_by_name, user_message
+            )
+        except UserBusy:
+            await update.message.reply_text(BUSY_TEXT)
+            return
+        REGISTRY.observe('bot_search_seconds', time.perf_counter() - started, search_type=search_type)
+        REGISTRY.observe('bot_result_size', len(results), SIZE_BUCKETS, search_type=search_type)
 
         if search_type == "not_found":
             keyboard = [
@@ -215,7 +471,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         if search_type == "exact":
-            result_text = format_detailed_result(results.iloc[0], bot_data.df)
+            try:
+                with REGISTRY.timer('bot_search_seconds', search_type="detail"):
+                    result_text = await search_executor.run(user_id, snapshot, render_detailed_result, int(results[0]))
+            except UserBusy:
+                await update.message.reply_text(BUSY_TEXT)
+                return
             keyboard = [
                 [InlineKeyboardButton("Поиск по ФИО", callback_data="start_search")],
                 [InlineKeyboardButton("Поиск по специальности", callback_data="speciality_search")],
@@ -225,12 +486,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             try:
                 photo_path = f"doctor_photo{np.random.randint(5)}.jpg"
-                with open(photo_path, 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=result_text,
-                        reply_markup=reply_markup
-                    )
+                await photo_cache.reply_photo(
+                    update.message,
+                    photo_path,
+                    caption=result_text,
+                    reply_markup=reply_markup
+                )
             except FileNotFoundError:
                 await update.message.reply_text(
                     result_text,
@@ -238,63 +499,39 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
 
         elif search_type == "partial":
-            bot_data.save_user_search(user_id, results)
+            bot_data.save_user_search(user_id, results, snapshot.version, RANKED_AHEAD)
+            await show_results_page(update, context, user_id, 0)
+
+        elif search_type == "similar":
+            bot_data.save_user_search(user_id, results, snapshot.version)
+            await update.message.reply_text("Точных совпадений нет. Возможно, вы искали:")
             await show_results_page(update, context, user_id, 0)
 
+@timed_handler("show_results_page")
 async def show_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, page: int):
-    results, current_page, total_pages = bot_data.get_user_results_page(user_id, page)
+    snapshot = bot_data.snapshot
+    message = update.callback_query.message if update.callback_query else update.message
+    pending = bot_data.pending_ranking(user_id, page, snapshot=snapshot)
+    if pending is not None:
+        try:
+            row_ids = await search_executor.run(user_id, snapshot, rank_results, *pending)
+        except UserBusy:
+            await message.reply_text(BUSY_TEXT)
+            return
+        bot_data.sessions.set_ranking(user_id, row_ids, pending[2])
+    page_ids, current_page, total_pages, total_results = bot_data.get_user_results_page(user_id, page, snapshot=snapshot)
 
-    if results is None or results.empty:
+    if page_ids is None or not len(page_ids):
         if update.callback_query:
             await update.callback_query.message.reply_text("Данные не найдены. Выполните повторный поиск")
         else:
             await update.message.reply_text("Данные не найдены. Выполните повторный поиск")
         return
 
-    message_text = f"Найдено совпадений: {len(bot_data.user_searches[user_id]['results'])}\n\n"
-
-    for i, (index, row) in enumerate(results.iterrows(), start=page * 5 + 1):
-        message_text += f"{i}. {row['name']}\n"
-
-        if 'speciality' in row and pd.notna(row['speciality']):
-            speciality_value = row['speciality']
-
-            if isinstance(speciality_value, (list, tuple)):
-                speciality_str = ', '.join(map(str, speciality_value))
-            elif isinstance(speciality_value, str) and (',' in speciality_value or ';' in speciality_value):
-                speciality_str = speciality_value.replace(';', ',').replace('|', ',')
-            else:
-                speciality_str = str(speciality_value)
-
-            message_text += f"Специальность: {speciality_str}\n"
-        else:
-            message_text += "Специальность: не указана\n"
-
-        if 'experience' in row and pd.notna(row['experience']):
-            message_text += f"Опыт работы: {row['experience']} лет\n"
-
-        if 'price' in row and pd.notna(row['price']):
-            message_text += f"Цена приёма: {row['price']} руб.\n"
-
-        if 'rating' in row and pd.notna(row['rating']):
-            message_text += f"Рейтинг: {row['rating']}/5.0\n"
-
-        metro = set()
-        metro_columns = ['clinic_1_metro_sber', 'clinic_2_metro_sber', 'clinic_3_metro_sber',
-                         'clinic_1_metro_prod', 'clinic_2_metro_prod', 'clinic_3_metro_prod']
-
-        for col in metro_columns:
-            if col in row and pd.notna(row[col]):
-                metro.add(str(row[col]))
-
-        if metro:
-            message_text += f"Метро: {', '.join(metro)}\n"
-        else:
-            message_text += "Метро: нет данных\n"
-
-        message_text += "\n"
-
-    message_text += f"Страница {current_page + 1} из {total_pages}"
+    # Карточки собраны заранее, страница - срез и склейка строк, поэтому рисуем её прямо в цикле событий
+    message_text, doctor_buttons = render_results_page(
+        snapshot, page_ids, current_page * RESULTS_PER_PAGE, current_page, total_pages, total_results
+    )
 
     keyboard = []
 
@@ -310,9 +547,9 @@ async def show_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if pagination_buttons:
         keyboard.append(pagination_buttons)
 
-    for i, (index, row) in enumerate(results.iterrows(), start=page * 5 + 1):
+    for i, index, surname in doctor_buttons:
         doctor_button = [InlineKeyboardButton(
-            f"Подробнее {i} - {row['name'].split()[0]}",
+            f"Подробнее {i} - {surname}",
             callback_data=f"detail_{index}"
         )]
         keyboard.append(doctor_button)
@@ -325,11 +562,9 @@ async def show_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE,
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if update.callback_query:
-        await update.callback_query.message.reply_text(message_text, reply_markup=reply_markup)
-    else:
-        await update.message.reply_text(message_text, reply_markup=reply_markup)
+    await message.reply_text(message_text, reply_markup=reply_markup)
 
+@timed_handler("button_handler")
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -345,10 +580,15 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /help - показать эту справку
 /search - поиск по ФИО врача
 /speciality - поиск по специальности и метро
+/nearby - врачи рядом с вами по геопозиции
+/reviews - поиск по тексту отзывов
+@имя_бота в любом чате - подсказки по ФИО, специальности и метро
 
 Как использовать:
 - Для поиска по ФИО: введите фамилию врача или полное ФИО
 - Для поиска по специальности: введите "специальность, метро"
+- Для поиска рядом: /nearby специальность, радиус в км - и отправьте геопозицию
+- Для поиска по отзывам: /reviews специальность, слова из отзывов
             """
             keyboard = [
                 [InlineKeyboardButton("Поиск по ФИО", callback_data="start_search")],
@@ -397,7 +637,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text(welcome_text, reply_markup=reply_markup)
 
         elif data == "show_all":
-            bot_data.save_user_search(user_id, bot_data.df)
+            snapshot = bot_data.snapshot
+            try:
+                # Первые страницы всей базы упорядочиваются частичной сортировкой - в пуле, не в цикле событий
+                row_ids = await search_executor.run(user_id, snapshot, rank_results, snapshot.all_ids)
+            except UserBusy:
+                await query.message.reply_text(BUSY_TEXT)
+                return
+            bot_data.save_user_search(user_id, row_ids, snapshot.version, RANKED_AHEAD)
             await query.message.reply_text("Показаны все врачи из базы данных:")
             await show_results_page(update, context, user_id, 0)
 
@@ -407,14 +654,16 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         elif data.startswith("detail_"):
             index = int(data.split("_")[1])
-            if user_id in bot_data.user_searches:
-                results = bot_data.user_searches[user_id]['results']
-                if index in results.index:
-                    result_text = format_detailed_result(results.loc[index], bot_data.df)
+            snapshot = bot_data.snapshot
+            session = bot_data.get_user_session(user_id, snapshot)
+            if session is not None:
+                if bot_data.session_contains(session, index):
+                    with REGISTRY.timer('bot_search_seconds', search_type="detail"):
+                        result_text = await search_executor.run(user_id, snapshot, render_detailed_result, index)
 
                     keyboard = [
                         [InlineKeyboardButton("К результатам",
-                                              callback_data=f"page_{bot_data.user_searches[user_id]['current_page']}")],
+                                              callback_data=f"page_{session.current_page}")],
                         [InlineKeyboardButton("Поиск по ФИО", callback_data="start_search")],
                         [InlineKeyboardButton("Поиск по специальности", callback_data="speciality_search")]
                     ]
@@ -422,12 +671,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                     try:
                         photo_path = f"doctor_photo{np.random.randint(5)}.jpg"
-                        with open(photo_path, 'rb') as photo:
-                            await query.message.reply_photo(
-                                photo=photo,
-                                caption=result_text,
-                                reply_markup=reply_markup
-                            )
+                        await photo_cache.reply_photo(
+                            query.message,
+                            photo_path,
+                            caption=result_text,
+                            reply_markup=reply_markup
+                        )
                     except FileNotFoundError:
                         await query.message.reply_text(
                             result_text,
@@ -436,159 +685,110 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif data == "current_page":
             pass
 
+    except UserBusy:
+        await query.message.reply_text(BUSY_TEXT)
     except Exception as e:
         print(f"Ошибка в button_handler: {e}")
         await query.message.reply_text("Произошла ошибка. Попробуйте снова.")
 
-def format_detailed_result(row, df):
-    result = "Подробная информация:\n\n"
-    result += f"ФИО: {row['name']}\n"
-
-    metro = set()
-    metro_columns = ['clinic_1_metro_sber', 'clinic_2_metro_sber', 'clinic_3_metro_sber',
-                     'clinic_1_metro_prod', 'clinic_2_metro_prod', 'clinic_3_metro_prod']
-
-    for col in metro_columns:
-        if col in row and pd.notna(row[col]):
-            metro.add(str(row[col]))
-
-    if metro:
-        result += f"Метро: {', '.join(metro)}\n"
-    else:
-        result += "Метро: Нет данных\n"
-
-    if 'speciality' in row and pd.notna(row['speciality']):
-        speciality_value = row['speciality']
-        if isinstance(speciality_value, (list, tuple)):
-            result += f"Специальность: {', '.join(map(str, speciality_value))}\n"
-        else:
-            result += f"Специальность: {str(speciality_value)}\n"
-    else:
-        result += "Специальность: Нет данных\n"
-
-    if 'experience' in row and pd.notna(row['experience']):
-        result += f"Опыт работы: {row['experience']} лет\n"
-    else:
-        result += "Опыт работы: Нет данных\n"
-
-    if 'rating' in row and pd.notna(row['rating']):
-        result += f"Взвешенный рейтинг: {row['rating']}/5.0 \n"
-
-    result += "\n"
-
-    result += "СберЗдоровье:\n"
-    price_s = row['price_sber'] if 'price_sber' in row and pd.notna(row['price_sber']) else "нет данных"
-    rating_s = row['rating_sber'] if 'rating_sber' in row and pd.notna(row['rating_sber']) else "нет данных"
-
-    if 'link_sber' in row and pd.notna(row['link_sber']):
-        result += f"Цена: {price_s}\n"
-        result += f"Рейтинг: {rating_s}\n"
-        result += f"Ссылка: {row['link_sber']}\n"
-    else:
-        result += f"Цена: {price_s}\n"
-        result += f"Рейтинг: {rating_s}\n"
-    result += "\n"
-
-    result += "ПроДокторов:\n"
-    price_p = row['price_prod'] if 'price_prod' in row and pd.notna(row['price_prod']) else "нет данных"
-    rating_p = row['rating_prod'] if 'rating_prod' in row and pd.notna(row['rating_prod']) else "нет данных"
-
-    if 'link_prod' in row and pd.notna(row['link_prod']):
-        result += f"Цена: {price_p}\n"
-        result += f"Рейтинг: {rating_p}\n"
-        result += f"Ссылка: {row['link_prod']}\n"
-    else:
-        result += f"Цена: {price_p}\n"
-        result += f"Рейтинг: {rating_p}\n"
-    result += "\n"
-
-    result += "Сравнение с рынком:\n"
-
-    current_specialities = set()
-    if 'speciality' in row and pd.notna(row['speciality']):
-        if isinstance(row['speciality'], (list, tuple)):
-            current_specialities = set(map(str, row['speciality']))
-        else:
-            current_specialities = {str(row['speciality'])}
-
-    market_doctors = df.copy()
-
-    if current_specialities:
-        def has_matching_speciality(doctor_row):
-            if 'speciality' not in doctor_row or pd.isna(doctor_row['speciality']):
-                return False
-            if isinstance(doctor_row['speciality'], (list, tuple)):
-                doctor_specialities = set(map(str, doctor_row['speciality']))
-            else:
-                doctor_specialities = {str(doctor_row['speciality'])}
-
-            return bool(current_specialities & doctor_specialities)
-
-        market_mask = market_doctors.apply(has_matching_speciality, axis=1)
-        market_doctors = market_doctors[market_mask]
-
-
-    if pd.notna(row['price']): price_current = row['price']
-    else: price_current = None
-    if pd.notna(market_doctors['price'].mean()): price_market = market_doctors['price'].mean()
-    else: price_market = None
-
-    if price_current and price_market and len(market_doctors) != 1:
-        if price_current > price_market:
-            result += f"💔 Цена выше рынка специалистов на {price_current - price_market:.1f} руб\n"
-        elif price_current < price_market:
-            result += f"💚 Цена ниже рынка специалистов на {price_market - price_current:.1f} руб\n"
-        else:
-            result += "Цена совпадает с средним значением по рынку специалистов\n"
-    else:
-        result += "Нет данных для сравнения цен\n"
-
-    if pd.notna(row['rating']): rating_current = row['rating']
-    else: rating_current = None
-    if pd.notna(market_doctors['rating'].mean()): rating_market = market_doctors['rating'].mean()
-    else: rating_market = None
-
-    if rating_current and rating_market and len(market_doctors) != 1:
-        if rating_current > rating_market:
-            result += f"💚 Рейтинг выше рынка специалистов на {rating_current - rating_market:.1f}\n"
-        elif rating_current < rating_market:
-            result += f"💔 Рейтинг ниже рынка специалистов на {rating_market - rating_current:.1f}\n"
-        else:
-            result += "Рейтинг совпадает со средним значением по рынку специалистов\n"
-    else:
-        result += "Нет данных для сравнения рейтингов\n"
-
-    if current_specialities and not market_doctors.empty and len(market_doctors) != 1:
-        result += f"\nСравнение с {len(market_doctors)} врачами аналогичных специальностей\n"
-
-    return result
-
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print(f"Ошибка: {context.error}")
     if update and update.message:
         await update.message.reply_text("Произошла ошибка. Попробуйте позже.")
 
-def main():
-    BOT_TOKEN = os.getenv('BOT_TOKEN')
-
-    if not BOT_TOKEN:
-        print("Ошибка: BOT_TOKEN не найден в переменных окружения!")
-        return
-
-
-    application = Application.builder().token(BOT_TOKEN).build()
+async def start_metrics(application: Application):
+    # В режиме polling метрики отдаются на METRICS_PORT, в webhook с одним процессом - по /metrics на порту webhook.
+    # С несколькими процессами у каждого свой реестр, а общий порт webhook отдал бы scrape случайному процессу,
+    # поэтому каждый отдаёт свои на METRICS_PORT + номер процесса
+    worker = dict(REGISTRY.constant_labels).get('worker')
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port and (os.getenv('BOT_MODE', 'polling') != 'webhook' or worker is not None):
+        application.bot_data['metrics_server'] = await serve_metrics(
+            os.getenv('METRICS_HOST', '127.0.0.1'), int(metrics_port) + int(worker or 0)
+        )
+
+    log_interval = float(os.getenv('METRICS_LOG_INTERVAL', 0))
+    if log_interval > 0:
+        application.create_task(log_metrics_periodically(log_interval))
+
+async def shutdown_executor(application: Application):
+    search_executor.shutdown()
+
+def build_application(token):
+    # Обновления обрабатываются параллельно, тяжёлая работа уходит в пул search_executor
+    concurrent_updates = int(os.getenv('CONCURRENT_UPDATES', search_executor.max_in_flight * 2))
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(concurrent_updates)
+        .request(TimedRequest())
+        .post_init(start_metrics)
+        .post_shutdown(shutdown_executor)
+    )
+    # Локальный стенд вместо api.telegram.org (см. webhook_replay.py)
+    api_url = os.getenv('TELEGRAM_API_URL')
+    if api_url:
+        builder = builder.base_url(api_url).base_file_url(api_url)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("search", search_command))
     application.add_handler(CommandHandler("speciality", speciality_command))
+    application.add_handler(CommandHandler("nearby", nearby_command))
+    application.add_handler(CommandHandler("reviews", reviews_command))
+    application.add_handler(InlineQueryHandler(inline_query))
+    application.add_handler(MessageHandler(filters.LOCATION, handle_location))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(CallbackQueryHandler(button_handler))
 
     application.add_error_handler(error_handler)
+    return application
+
+def start_worker(worker=None):
+    # Вызывается в каждом процессе бота: потоки через fork не наследуются.
+    # worker - номер процесса webhook, если их несколько: метка, по которой различаются их метрики
+    if worker is not None:
+        REGISTRY.set_constant_labels(worker=worker)
+    search_executor.start()
+
+    reload_interval = float(os.getenv('DATA_RELOAD_INTERVAL', 60))
+    if reload_interval > 0:
+        SnapshotWatcher(bot_data, reload_interval).start()
+
+def main():
+    BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+    if not BOT_TOKEN:
+        print("Ошибка: BOT_TOKEN не найден в переменных окружения!")
+        return
+
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        workers = int(os.getenv('WEBHOOK_WORKERS', 1))
+        if workers > 1 and not os.getenv('SESSION_DB'):
+            print("Внимание: без SESSION_DB у каждого процесса свои сессии, листание выдачи будет теряться")
+        if workers > 1 and not os.getenv('METRICS_PORT'):
+            print("Внимание: без METRICS_PORT метрики нескольких процессов не отдаются")
+
+        print("Бот запущен в режиме webhook...")
+        run_webhook(
+            lambda: build_application(BOT_TOKEN),
+            host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', 8443)),
+            url_path=os.getenv('WEBHOOK_PATH', '/webhook'),
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            webhook_url=os.getenv('WEBHOOK_URL'),
+            workers=workers,
+            before_worker=start_worker,
+            on_server=(lambda server: server.routes.update({'/metrics': metrics_route()})) if workers == 1 else None,
+        )
+        return
+
+    application = build_application(BOT_TOKEN)
+    start_worker()
 
     print("Бот запущен...")
     application.run_polling()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
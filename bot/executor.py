@@ -0,0 +1,146 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import REGISTRY
+from snapshot import load_or_build_snapshot, load_snapshot
+
+DEFAULT_KIND = 'thread'
+DEFAULT_PER_USER = 1
+DEFAULT_MAX_IN_FLIGHT = 32
+
+
+class UserBusy(Exception):
+    pass
+
+
+# Снимок данных внутри процесса пула: загружается один раз через mmap,
+# так что страницы файлов снимка общие для всех процессов
+_worker = {'data_file': None, 'snapshot_dir': None, 'snapshot': None}
+
+
+def _init_worker(data_file, snapshot_dir):
+    _worker['data_file'] = data_file
+    _worker['snapshot_dir'] = snapshot_dir
+
+
+def _worker_snapshot(version):
+    snapshot = _worker['snapshot']
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    snapshot = None
+    if _worker['snapshot_dir']:
+        try:
+            snapshot = load_snapshot(_worker['snapshot_dir'], version)
+        except FileNotFoundError:
+            pass
+    if snapshot is None:
+        snapshot = load_or_build_snapshot(_worker['data_file'], _worker['snapshot_dir'])
+    if snapshot.version != version:
+        # Номера строк из другой версии данных не совпадут с тем, что видит основной процесс
+        raise RuntimeError(f"Версия данных {version} недоступна в процессе пула")
+
+    _worker['snapshot'] = snapshot
+    return snapshot
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def _timed_call(job, snapshot, args):
+    started = time.perf_counter()
+    result = job(snapshot, *args)
+    return result, time.perf_counter() - started
+
+
+def _call_in_worker(version, job, args):
+    return _timed_call(job, _worker_snapshot(version), args)
+
+
+class SearchExecutor:
+    # Выполняет поиск и отрисовку вне цикла событий.
+    # Задача - функция вида job(snapshot, *args), для пула процессов она должна импортироваться из модуля.
+    # У пользователя не больше per_user запросов одновременно, всего в работе не больше max_in_flight
+    def __init__(self, bot, kind=DEFAULT_KIND, workers=None, per_user=DEFAULT_PER_USER,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.bot = bot
+        self.kind = kind
+        self.per_user = per_user
+        self.max_in_flight = max_in_flight
+        self.rejected = 0
+        self._user_in_flight = {}
+        self._slots = None
+
+        if kind == 'process':
+            # fork отдаёт процессам уже загруженный снимок без копирования; где его нет - spawn
+            method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._context = multiprocessing.get_context(method)
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(bot.data_file, bot.snapshot_dir),
+            )
+        elif kind == 'thread':
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+        else:
+            raise ValueError(f"Неизвестный тип пула: {kind}")
+
+    def start(self):
+        # Процессы нужно запустить до старта остальных потоков бота: fork копирует только вызывающий поток
+        if self.kind != 'process':
+            return
+        if self._context.get_start_method() == 'fork':
+            _worker['snapshot'] = self.bot.snapshot
+        self._pool.submit(_worker_ready).result()
+
+    @property
+    def in_flight(self):
+        return sum(self._user_in_flight.values())
+
+    async def run(self, user_id, snapshot, job, *args):
+        # Счётчики меняются только из цикла событий, блокировки не нужны
+        if self._user_in_flight.get(user_id, 0) >= self.per_user:
+            self.rejected += 1
+            REGISTRY.inc('bot_executor_rejected_total')
+            raise UserBusy(user_id)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        self._user_in_flight[user_id] = self._user_in_flight.get(user_id, 0) + 1
+        waiting = time.perf_counter()
+        try:
+            async with self._slots:
+                REGISTRY.observe('bot_executor_wait_seconds', time.perf_counter() - waiting)
+                loop = asyncio.get_running_loop()
+                if self.kind == 'process':
+                    result, elapsed = await loop.run_in_executor(
+                        self._pool, _call_in_worker, snapshot.version, job, args
+                    )
+                else:
+                    result, elapsed = await loop.run_in_executor(self._pool, _timed_call, job, snapshot, args)
+                REGISTRY.observe('bot_job_seconds', elapsed, job=job.__name__)
+                return result
+        finally:
+            self._user_in_flight[user_id] -= 1
+            if not self._user_in_flight[user_id]:
+                del self._user_in_flight[user_id]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_executor(bot):
+    workers = os.getenv('EXECUTOR_WORKERS')
+    return SearchExecutor(
+        bot,
+        kind=os.getenv('EXECUTOR', DEFAULT_KIND),
+        workers=int(workers) if workers else None,
+        per_user=int(os.getenv('EXECUTOR_PER_USER', DEFAULT_PER_USER)),
+        max_in_flight=int(os.getenv('EXECUTOR_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT)),
+    )
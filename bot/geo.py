@@ -0,0 +1,206 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from addresses import normalize_address
+from indexes import EMPTY_IDS
+
+DEFAULT_COORDINATES_FILE = '../parsing/api_yandex_geocoder/api_addresses.csv'
+
+ADDRESS_COLUMNS = [
+    f'clinic_{i}_address_{source}' for source in ('sber', 'prod') for i in (1, 2, 3)
+]
+
+EARTH_RADIUS_KM = 6371.0
+CELL_SIZE_KM = 1.0
+MAX_RADIUS_KM = 50.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Номер ячейки по широте и долготе упаковывается в одно число, сдвиг убирает отрицательные номера
+_CELL_SHIFT = 1 << 20
+
+
+def coordinates_file():
+    return os.getenv('GEO_ADDRESSES', DEFAULT_COORDINATES_FILE)
+
+
+def read_coordinates(path):
+    # Адрес -> (широта, долгота); ключи и по исходной строке, и по нормализованной.
+    # Без файла (или если вместо него указатель git lfs) поиск по геопозиции просто недоступен
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        addresses = pd.read_csv(path)
+    except Exception as e:
+        print(f"Не удалось прочитать координаты клиник {path}: {e}")
+        return {}
+    if not {'latitude', 'longitude'} <= set(addresses.columns):
+        print(f"В {path} нет колонок latitude и longitude, поиск по геопозиции отключён")
+        return {}
+
+    latitude = pd.to_numeric(addresses['latitude'], errors='coerce').to_numpy(dtype=float)
+    longitude = pd.to_numeric(addresses['longitude'], errors='coerce').to_numpy(dtype=float)
+    known = ~(np.isnan(latitude) | np.isnan(longitude))
+
+    coordinates = {}
+    for column in ('address_norm', 'address'):
+        if column not in addresses.columns:
+            continue
+        for address, lat, lon in zip(addresses[column][known], latitude[known], longitude[known]):
+            if isinstance(address, str) and address:
+                coordinates.setdefault(address, (lat, lon))
+    return coordinates
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _ranges(starts, ends):
+    # Склеенные диапазоны start:end без цикла по ним
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+class GeoIndex:
+    # Точки клиник на сетке из ячеек примерно CELL_SIZE_KM на CELL_SIZE_KM.
+    # Ячейки отсортированы, точки каждой ячейки лежат подряд (CSR), у каждой точки - строки врачей.
+    # Запрос смотрит только ячейки квадрата вокруг пользователя и считает расстояние до их точек
+    def __init__(self, latitude, longitude, row_offsets, row_ids, cell_keys, cell_offsets, cell_points, steps):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.row_offsets = row_offsets
+        self.row_ids = row_ids
+        self.cell_keys = cell_keys
+        self.cell_offsets = cell_offsets
+        self.cell_points = cell_points
+        # Шаг сетки в градусах широты и долготы
+        self.steps = steps
+
+    @classmethod
+    def build(cls, df, coordinates):
+        rows, points = [], []
+        if coordinates:
+            for column in ADDRESS_COLUMNS:
+                if column not in df.columns:
+                    continue
+                addresses = df[column]
+                present = addresses.notna().to_numpy()
+                codes, unique_addresses = pd.factorize(addresses[present])
+                # Нормализуем только уникальные адреса, их в разы меньше, чем строк
+                found = np.array([
+                    coordinates.get(address) or coordinates.get(normalize_address(address)) or (np.nan, np.nan)
+                    for address in unique_addresses
+                ], dtype=float).reshape(-1, 2)
+                column_points = found[codes]
+                located = ~np.isnan(column_points[:, 0])
+                rows.append(np.flatnonzero(present)[located])
+                points.append(column_points[located])
+
+        if not rows or not sum(len(r) for r in rows):
+            return cls.empty()
+
+        rows = np.concatenate(rows).astype(np.int32)
+        points = np.concatenate(points)
+
+        # Разные адреса одной клиники геокодер мог свести в одну точку
+        unique_points, point_ids = np.unique(np.round(points, 6), axis=0, return_inverse=True)
+        point_ids = point_ids.reshape(-1)
+        pairs = np.unique(np.stack([point_ids, rows], axis=1), axis=0)
+        row_offsets = np.zeros(len(unique_points) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(unique_points)), out=row_offsets[1:])
+
+        latitude = unique_points[:, 0].copy()
+        longitude = unique_points[:, 1].copy()
+        lat_step = CELL_SIZE_KM / KM_PER_DEGREE
+        lon_step = lat_step / max(math.cos(math.radians(float(np.median(latitude)))), 0.1)
+        steps = np.array([lat_step, lon_step])
+
+        keys = cls._cell_key(np.floor(latitude / lat_step), np.floor(longitude / lon_step))
+        order = np.argsort(keys, kind='stable')
+        cell_keys, counts = np.unique(keys[order], return_counts=True)
+        cell_offsets = np.zeros(len(cell_keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=cell_offsets[1:])
+
+        return cls(
+            latitude, longitude, row_offsets, pairs[:, 1].astype(np.int32),
+            cell_keys, cell_offsets, order.astype(np.int32), steps,
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty(0), np.empty(0), np.zeros(1, dtype=np.int64), EMPTY_IDS,
+            np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), EMPTY_IDS, np.ones(2),
+        )
+
+    @staticmethod
+    def _cell_key(lat_cells, lon_cells):
+        return (lat_cells.astype(np.int64) + _CELL_SHIFT) * (2 * _CELL_SHIFT) + lon_cells.astype(np.int64) + _CELL_SHIFT
+
+    _ARRAYS = ('latitude', 'longitude', 'row_offsets', 'row_ids', 'cell_keys', 'cell_offsets', 'cell_points', 'steps')
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self._ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        if not arrays:
+            return cls.empty()
+        return cls(*(arrays[name] for name in cls._ARRAYS))
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def points_within(self, latitude, longitude, radius_km):
+        if not len(self):
+            return EMPTY_IDS, np.empty(0)
+
+        lat_step, lon_step = float(self.steps[0]), float(self.steps[1])
+        # Шаг по долготе подобран по средней широте базы, а градус долготы короче к северу:
+        # полуширину окна по долготе считаем для широты запроса (для сферы - arcsin(sin(r / R) / cos(широты)))
+        lat_extent = radius_km / KM_PER_DEGREE
+        spread = math.sin(min(radius_km / EARTH_RADIUS_KM, math.pi / 2)) / max(math.cos(math.radians(latitude)), 1e-9)
+        lon_extent = math.degrees(math.asin(spread)) if spread < 1 else 180.0
+        lat_cells_count = math.ceil(lat_extent / lat_step)
+        lon_cells_count = min(math.ceil(lon_extent / lon_step), math.ceil(180.0 / lon_step))
+        lat_cell = math.floor(latitude / lat_step)
+        lon_cell = math.floor(longitude / lon_step)
+        lat_cells, lon_cells = np.meshgrid(
+            np.arange(lat_cell - lat_cells_count, lat_cell + lat_cells_count + 1),
+            np.arange(lon_cell - lon_cells_count, lon_cell + lon_cells_count + 1),
+            indexing='ij',
+        )
+        keys = self._cell_key(lat_cells.ravel(), lon_cells.ravel())
+
+        slots = np.searchsorted(self.cell_keys, keys)
+        found = slots < len(self.cell_keys)
+        found[found] = self.cell_keys[slots[found]] == keys[found]
+        slots = slots[found]
+        if not len(slots):
+            return EMPTY_IDS, np.empty(0)
+
+        points = self.cell_points[_ranges(self.cell_offsets[slots], self.cell_offsets[slots + 1])]
+        distances = haversine_km(latitude, longitude, self.latitude[points], self.longitude[points])
+        inside = distances <= radius_km
+        return points[inside], distances[inside]
+
+    def rows_within(self, latitude, longitude, radius_km):
+        # Строки врачей с расстоянием до ближайшей из их клиник в радиусе, по возрастанию номера строки
+        points, distances = self.points_within(latitude, longitude, min(radius_km, MAX_RADIUS_KM))
+        if not len(points):
+            return EMPTY_IDS, np.empty(0)
+
+        starts, ends = self.row_offsets[points], self.row_offsets[points + 1]
+        rows = self.row_ids[_ranges(starts, ends)]
+        row_distances = np.repeat(distances, ends - starts)
+
+        order = np.lexsort((row_distances, rows))
+        rows, row_distances = rows[order], row_distances[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        return rows[first], row_distances[first]
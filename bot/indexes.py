@@ -0,0 +1,664 @@
+import ast
+import difflib
+import re
+from bisect import bisect_left
+from collections import namedtuple
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+EMPTY_IDS = np.empty(0, dtype=np.int32)
+
+SIMILARITY_THRESHOLD = 0.5
+SIMILAR_LIMIT = 50
+# Опечатки: сколько правок допускается в слове запроса (до TYPO_LONG_WORD букв - одна, дальше - две)
+# и сколько кандидатов с наибольшим числом общих триграмм проверяется расстоянием
+TYPO_LONG_WORD = 8
+TYPO_CANDIDATES = 500
+
+MAX_RATING = 5.0
+# Сколько отзывов "весит" средний рейтинг: при малом числе отзывов рейтинг врача близок к среднему
+REVIEW_PRIOR = 20
+# Вес рейтинга, цены относительно медианы по специальности и согласия двух источников
+QUALITY_WEIGHTS = (0.6, 0.25, 0.15)
+
+# Разговорные названия -> префиксы специальностей из справочника
+SPECIALITY_SYNONYMS = {
+    'лор': ('оториноларинголог',),
+    'отоларинголог': ('оториноларинголог',),
+    'ухо горло нос': ('оториноларинголог',),
+    'окулист': ('офтальмолог',),
+    'глазной': ('офтальмолог',),
+    'глазной врач': ('офтальмолог',),
+    'кожник': ('дерматолог', 'дерматовенеролог'),
+    'венеролог': ('дерматовенеролог', 'венеролог'),
+    'зубной': ('стоматолог',),
+    'зубной врач': ('стоматолог',),
+    'женский врач': ('гинеколог', 'акушер-гинеколог'),
+    'женский доктор': ('гинеколог', 'акушер-гинеколог'),
+    'детский врач': ('педиатр',),
+    'невропатолог': ('невролог',),
+    'сердечник': ('кардиолог',),
+    'мануальщик': ('мануальный терапевт',),
+    'костоправ': ('мануальный терапевт', 'остеопат'),
+    'нутрициолог': ('диетолог', 'нутрициолог'),
+}
+
+METRO_COLUMNS = [
+    'clinic_1_metro_sber', 'clinic_2_metro_sber', 'clinic_3_metro_sber',
+    'clinic_1_metro_prod', 'clinic_2_metro_prod', 'clinic_3_metro_prod'
+]
+
+MISSING_VALUES = {'', 'no value', 'nan', 'none'}
+
+_SPECIALITY_SEPARATORS = re.compile(r'[,;|]')
+_WORD_STARTS = re.compile(r'(?:^|[\s-])(?=\w)')
+
+_STATION_SEPARATORS = re.compile(r'[,;/]')
+_STATION_PREFIX = re.compile(r'^(?:ст\.?\s*м\.?|ст\.?|станция\s+метро|станция|метро|мцк|мцд(?:[\s-]*\d+)?|м\.?)\s+', re.IGNORECASE)
+_STATION_DISTANCE = re.compile(r'[\d.,\s]*(?:к?м)?')
+_STATION_BRACKETS = re.compile(r'\(.*?\)|\[.*?\]')
+_STATION_SUFFIX = re.compile(
+    r'(?:\s+|-)(?:мцк|мцд(?:[\s-]*\d+)?|бкл|d\d+|\d+(?:[.,]\d+)?\s*к?м|[\w-]+\s+линия|линия\s+[\w-]+)$',
+    re.IGNORECASE
+)
+
+
+def normalize_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ''
+    return ' '.join(str(value).lower().replace('ё', 'е').split())
+
+
+def word_starts(text):
+    # Хвосты текста с начала каждого слова: "детский кардиолог" -> "детский кардиолог", "кардиолог"
+    return [text[start.end():] for start in _WORD_STARTS.finditer(text)]
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def typo_edits(word):
+    return 1 if len(word) < TYPO_LONG_WORD else 2
+
+
+def edit_distance(left, right, limit):
+    # Дамерау-Левенштейн (перестановка соседних букв - одна правка), всё, что больше limit, - limit + 1
+    if abs(len(left) - len(right)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(right) + 1))
+    for i, left_char in enumerate(left, 1):
+        current = [i] + [0] * len(right)
+        for j, right_char in enumerate(right, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (left_char != right_char))
+            if i > 1 and j > 1 and left_char == right[j - 2] and left[i - 2] == right_char:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+MarketAggregate = namedtuple('MarketAggregate', [
+    'specialities', 'count',
+    'price_count', 'price_sum', 'price_mean',
+    'rating_count', 'rating_sum', 'rating_mean',
+])
+
+
+def numeric_column(df, column):
+    if column not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+
+
+def _mean(total, count):
+    return total / count if count else np.nan
+
+
+def parse_specialities(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        items = list(value)
+    elif value is None or pd.isna(value):
+        return []
+    else:
+        text = str(value).strip()
+        items = None
+        # В csv список специальностей хранится строкой вида "['терапевт', 'кардиолог']"
+        if text.startswith('['):
+            try:
+                parsed = ast.literal_eval(text)
+                if isinstance(parsed, (list, tuple)):
+                    items = list(parsed)
+            except (ValueError, SyntaxError):
+                text = text.strip('[]').replace("'", '').replace('"', '')
+        if items is None:
+            items = _SPECIALITY_SEPARATORS.split(text)
+
+    tokens = []
+    for item in items:
+        token = normalize_text(item)
+        if token and token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def split_stations(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return []
+    return [part for part in _STATION_SEPARATORS.split(str(value)) if part.strip()]
+
+
+def clean_station(name):
+    name = _STATION_BRACKETS.sub(' ', str(name))
+    name = ' '.join(name.replace('«', ' ').replace('»', ' ').replace('"', ' ').split())
+    previous = None
+    while name != previous:
+        previous = name
+        name = _STATION_PREFIX.sub('', name).strip(' .,-')
+        name = _STATION_SUFFIX.sub('', name).strip(' .,-')
+    return name
+
+
+def canonical_station(name):
+    station = normalize_text(clean_station(name))
+    if station in MISSING_VALUES or _STATION_DISTANCE.fullmatch(station):
+        return ''
+    return station
+
+
+def union_postings(postings):
+    postings = [ids for ids in postings if len(ids)]
+    if not postings:
+        return EMPTY_IDS
+    if len(postings) == 1:
+        return postings[0]
+    return np.unique(np.concatenate(postings))
+
+
+class PostingLists:
+    # Ключи отсортированы, списки строк лежат подряд в одном массиве ids (CSR)
+    def __init__(self, keys, offsets, ids):
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+        self._slots = {key: slot for slot, key in enumerate(keys.tolist())}
+
+    @classmethod
+    def from_dict(cls, postings):
+        keys = sorted(postings)
+        lengths = np.fromiter((len(postings[key]) for key in keys), dtype=np.int64, count=len(keys))
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.empty(offsets[-1], dtype=np.int32)
+        for slot, key in enumerate(keys):
+            ids[offsets[slot]:offsets[slot + 1]] = postings[key]
+        return cls(np.array(keys, dtype=str), offsets, ids)
+
+    def slot(self, key):
+        return self._slots.get(key)
+
+    def get(self, key):
+        slot = self._slots.get(key)
+        if slot is None:
+            return EMPTY_IDS
+        return self.at(slot)
+
+    def at(self, slot):
+        return self.ids[self.offsets[slot]:self.offsets[slot + 1]]
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}.keys': self.keys, f'{prefix}.offsets': self.offsets, f'{prefix}.ids': self.ids}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(arrays[f'{prefix}.keys'], arrays[f'{prefix}.offsets'], arrays[f'{prefix}.ids'])
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+
+def intersect_postings(postings):
+    postings = sorted(postings, key=len)
+    if not postings or len(postings[0]) == 0:
+        return EMPTY_IDS
+    return reduce(lambda left, right: np.intersect1d(left, right, assume_unique=True), postings)
+
+
+class NameIndex:
+    def __init__(self, names, gram_counts, exact, grams):
+        self.names = names
+        self.gram_counts = gram_counts
+        self.exact = exact
+        self.trigrams = grams
+
+    @classmethod
+    def build(cls, names):
+        names = [normalize_text(name) for name in names]
+
+        exact = {}
+        grams = {}
+        gram_counts = np.zeros(len(names), dtype=np.int32)
+        for row_id, name in enumerate(names):
+            if not name:
+                continue
+            exact.setdefault(name, []).append(row_id)
+            name_grams = trigrams(f' {name} ')
+            gram_counts[row_id] = len(name_grams)
+            for gram in name_grams:
+                grams.setdefault(gram, []).append(row_id)
+
+        return cls(names, gram_counts, PostingLists.from_dict(exact), PostingLists.from_dict(grams))
+
+    def to_arrays(self):
+        return {
+            'names': np.array(self.names, dtype=str),
+            'gram_counts': self.gram_counts,
+            **self.exact.to_arrays('exact'),
+            **self.trigrams.to_arrays('trigrams'),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays['names'].tolist(), arrays['gram_counts'],
+            PostingLists.from_arrays(arrays, 'exact'), PostingLists.from_arrays(arrays, 'trigrams')
+        )
+
+    def find_exact(self, query):
+        return self.exact.get(normalize_text(query))
+
+    def find_partial(self, query):
+        query = normalize_text(query)
+        if not query:
+            return EMPTY_IDS
+
+        # Для коротких запросов триграмм нет - проверяем имена подряд
+        if len(query) < 3:
+            return np.array([row_id for row_id, name in enumerate(self.names) if query in name], dtype=np.int32)
+
+        candidates = intersect_postings([self.trigrams.get(gram) for gram in trigrams(query)])
+        # Все триграммы на месте ещё не значит, что они идут подряд
+        return np.array([row_id for row_id in candidates if query in self.names[row_id]], dtype=np.int32)
+
+    def find_similar(self, query, threshold=SIMILARITY_THRESHOLD, limit=SIMILAR_LIMIT):
+        query = normalize_text(query)
+        if len(query) < 3:
+            return EMPTY_IDS
+
+        query_grams = trigrams(f' {query} ')
+        postings = [self.trigrams.get(gram) for gram in query_grams]
+        postings = [ids for ids in postings if len(ids)]
+        if not postings:
+            return EMPTY_IDS
+
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        # Сначала имена, где каждое слово запроса совпало с точностью до опечатки, затем похожие по триграммам
+        typo_ids = self._find_typos(query, len(query_grams), counts, limit)
+        candidates = np.flatnonzero(counts >= threshold * len(query_grams))
+        candidates = candidates[~np.isin(candidates, typo_ids)]
+        if len(typo_ids) >= limit or not len(candidates):
+            return typo_ids
+
+        # Ранжируем по мере Жаккара, чтобы короткие близкие имена шли выше длинных
+        shared = counts[candidates]
+        jaccard = shared / (len(query_grams) + self.gram_counts[candidates] - shared)
+        rest = limit - len(typo_ids)
+        if len(candidates) > rest:
+            top = np.argpartition(-jaccard, rest - 1)[:rest]
+            candidates, jaccard = candidates[top], jaccard[top]
+        order = np.argsort(-jaccard, kind='stable')
+        return np.concatenate((typo_ids, candidates[order])).astype(np.int32)
+
+    def _find_typos(self, query, query_grams, counts, limit):
+        # Перестановка или замена буквы в коротком слове ломает до четырёх его триграмм из шести, и порог
+        # по доле общих триграмм такое имя отсекает или ставит ниже чужих. Поэтому берём имена, у которых
+        # общих триграмм не меньше, чем могло остаться после опечатки в одном слове, и проверяем каждое
+        # слово запроса расстоянием правки. Длинный запрос с несколькими опечатками находит мера Жаккара
+        words = query.split()
+        edits = [typo_edits(word) for word in words]
+        min_shared = max(query_grams - 4 * max(edits), 1)
+        candidates = np.flatnonzero(counts >= min_shared)
+        if len(candidates) > TYPO_CANDIDATES:
+            candidates = candidates[np.argpartition(-counts[candidates], TYPO_CANDIDATES - 1)[:TYPO_CANDIDATES]]
+
+        # Расстояния считаются один раз на слово, а не на каждое имя, где оно встретилось
+        candidates = candidates.tolist()
+        rows_words = [self.names[row_id].split() for row_id in candidates]
+        vocabulary = set().union(*rows_words)
+        close_words = []
+        for word, allowed in zip(words, edits):
+            distances = {name_word: edit_distance(word, name_word, allowed) for name_word in vocabulary}
+            close_words.append({name_word: distance for name_word, distance in distances.items() if distance <= allowed})
+
+        found, costs = [], []
+        for row_id, name_words in zip(candidates, rows_words):
+            cost = 0
+            for close in close_words:
+                best = min((close[name_word] for name_word in name_words if name_word in close), default=None)
+                if best is None:
+                    break
+                cost += best
+            else:
+                found.append(row_id)
+                costs.append(cost)
+        if not found:
+            return EMPTY_IDS
+
+        found = np.array(found, dtype=np.int32)
+        order = np.lexsort((-counts[found], costs))[:limit]
+        return found[order]
+
+
+class SpecialityIndex:
+    def __init__(self, postings, row_offsets, row_token_ids, prefix_keys, prefix_token_ids):
+        self.postings = postings
+        self.tokens = postings.keys
+        self._token_list = self.tokens.tolist()
+        # Специальности каждой строки: row_offsets[i]:row_offsets[i + 1] в row_token_ids
+        self.row_offsets = row_offsets
+        self.row_token_ids = row_token_ids
+        self._prefix_keys = prefix_keys
+        self._prefix_token_ids = prefix_token_ids
+
+    @classmethod
+    def build(cls, specialities):
+        rows_tokens = [parse_specialities(value) for value in specialities]
+
+        postings = {}
+        for row_id, tokens in enumerate(rows_tokens):
+            for token in tokens:
+                postings.setdefault(token, []).append(row_id)
+        postings = PostingLists.from_dict(postings)
+        token_list = postings.keys.tolist()
+
+        token_ids = {token: token_id for token_id, token in enumerate(token_list)}
+        lengths = np.fromiter((len(tokens) for tokens in rows_tokens), dtype=np.int64, count=len(rows_tokens))
+        row_offsets = np.zeros(len(rows_tokens) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=row_offsets[1:])
+        row_token_ids = np.fromiter(
+            (token_ids[token] for tokens in rows_tokens for token in tokens),
+            dtype=np.int32, count=row_offsets[-1]
+        )
+
+        # Ключи для поиска по префиксу: специальность целиком и с начала каждого её слова,
+        # чтобы "кардио" находил и "кардиолог", и "детский кардиолог"
+        prefix_keys = sorted(
+            (key, token_id)
+            for token_id, token in enumerate(token_list)
+            for key in word_starts(token)
+        )
+        return cls(
+            postings, row_offsets, row_token_ids,
+            [key for key, _ in prefix_keys], [token_id for _, token_id in prefix_keys]
+        )
+
+    def to_arrays(self):
+        return {
+            **self.postings.to_arrays('postings'),
+            'row_offsets': self.row_offsets,
+            'row_token_ids': self.row_token_ids,
+            'prefix_keys': np.array(self._prefix_keys, dtype=str),
+            'prefix_token_ids': np.array(self._prefix_token_ids, dtype=np.int32),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            PostingLists.from_arrays(arrays, 'postings'), arrays['row_offsets'], arrays['row_token_ids'],
+            arrays['prefix_keys'].tolist(), arrays['prefix_token_ids'].tolist()
+        )
+
+    def row_tokens(self, row_id):
+        return self.row_token_ids[self.row_offsets[row_id]:self.row_offsets[row_id + 1]]
+
+    def match_tokens(self, query):
+        query = normalize_text(query)
+        if not query:
+            return []
+
+        token_ids = set()
+        for prefix in SPECIALITY_SYNONYMS.get(query, (query,)):
+            position = bisect_left(self._prefix_keys, prefix)
+            while position < len(self._prefix_keys) and self._prefix_keys[position].startswith(prefix):
+                token_ids.add(self._prefix_token_ids[position])
+                position += 1
+
+        if not token_ids:
+            token_ids = {token_id for token_id, token in enumerate(self._token_list) if query in token}
+        return sorted(token_ids)
+
+    def find(self, query):
+        return union_postings([self.postings.at(token_id) for token_id in self.match_tokens(query)])
+
+
+class MetroIndex:
+    def __init__(self, postings, display):
+        self.postings = postings
+        self.stations = postings.keys
+        self._station_list = self.stations.tolist()
+        self.display = display
+
+    @classmethod
+    def build(cls, df):
+        postings = {}
+        display = {}
+        for column in METRO_COLUMNS:
+            if column not in df.columns:
+                continue
+            for row_id, value in enumerate(df[column].tolist()):
+                for raw in split_stations(value):
+                    station = canonical_station(raw)
+                    if not station:
+                        continue
+                    postings.setdefault(station, []).append(row_id)
+                    display.setdefault(station, clean_station(raw))
+
+        # В одной строке станция может встретиться в нескольких колонках
+        for station, rows in postings.items():
+            postings[station] = sorted(set(rows))
+
+        postings = PostingLists.from_dict(postings)
+        return cls(postings, [display[station] for station in postings.keys.tolist()])
+
+    def to_arrays(self):
+        return {**self.postings.to_arrays('postings'), 'display': np.array(self.display, dtype=str)}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(PostingLists.from_arrays(arrays, 'postings'), arrays['display'].tolist())
+
+    def match_stations(self, query):
+        station = canonical_station(query)
+        if not station:
+            return []
+        station_id = self.postings.slot(station)
+        if station_id is not None:
+            return [station_id]
+        return [station_id for station_id, name in enumerate(self._station_list) if station in name]
+
+    def find(self, query):
+        return union_postings([self.postings.at(station_id) for station_id in self.match_stations(query)])
+
+    def suggest(self, query):
+        station = canonical_station(query)
+        if not station or self.match_stations(query):
+            return None
+        matches = difflib.get_close_matches(station, self._station_list, n=1, cutoff=0.6)
+        if not matches:
+            return None
+        return self.display[self.postings.slot(matches[0])]
+
+
+class MarketStats:
+    # Средние цена и рейтинг среди врачей, у которых есть хотя бы одна общая специальность
+    _ARRAYS = ('price', 'rating', 'count', 'price_count', 'price_sum', 'rating_count', 'rating_sum')
+
+    def __init__(self, speciality_index, price, rating, count, price_count, price_sum, rating_count, rating_sum):
+        self.speciality_index = speciality_index
+        self.price = price
+        self.rating = rating
+        self.count = count
+        self.price_count = price_count
+        self.price_sum = price_sum
+        self.rating_count = rating_count
+        self.rating_sum = rating_sum
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.price_mean = price_sum / price_count
+            self.rating_mean = rating_sum / rating_count
+
+        self.overall = self._aggregate((), np.arange(len(price)))
+        self._combined = {}
+
+    @classmethod
+    def build(cls, df, speciality_index):
+        price = numeric_column(df, 'price')
+        rating = numeric_column(df, 'rating')
+
+        n_tokens = len(speciality_index.tokens)
+        rows = np.repeat(np.arange(len(df)), np.diff(speciality_index.row_offsets))
+        tokens = speciality_index.row_token_ids
+
+        count = np.bincount(tokens, minlength=n_tokens)
+        price_count, price_sum = cls._sums(tokens, price[rows], n_tokens)
+        rating_count, rating_sum = cls._sums(tokens, rating[rows], n_tokens)
+        return cls(speciality_index, price, rating, count, price_count, price_sum, rating_count, rating_sum)
+
+    def to_arrays(self):
+        return {name: getattr(self, name) for name in self._ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, speciality_index):
+        return cls(speciality_index, *(arrays[name] for name in cls._ARRAYS))
+
+    @staticmethod
+    def _sums(tokens, values, n_tokens):
+        present = ~np.isnan(values)
+        counts = np.bincount(tokens[present], minlength=n_tokens)
+        sums = np.bincount(tokens[present], weights=values[present], minlength=n_tokens)
+        return counts, sums
+
+    def _aggregate(self, specialities, row_ids):
+        price = self.price[row_ids]
+        rating = self.rating[row_ids]
+        price_count = int(np.count_nonzero(~np.isnan(price)))
+        rating_count = int(np.count_nonzero(~np.isnan(rating)))
+        price_sum = float(np.nansum(price))
+        rating_sum = float(np.nansum(rating))
+        return MarketAggregate(
+            specialities, len(row_ids),
+            price_count, price_sum, _mean(price_sum, price_count),
+            rating_count, rating_sum, _mean(rating_sum, rating_count),
+        )
+
+    def for_specialities(self, token_ids):
+        token_ids = tuple(sorted(token_ids))
+        if not token_ids:
+            return self.overall
+
+        if len(token_ids) == 1:
+            token_id = token_ids[0]
+            return MarketAggregate(
+                token_ids, int(self.count[token_id]),
+                int(self.price_count[token_id]), float(self.price_sum[token_id]), float(self.price_mean[token_id]),
+                int(self.rating_count[token_id]), float(self.rating_sum[token_id]), float(self.rating_mean[token_id]),
+            )
+
+        # У врача несколько специальностей: суммы по специальностям посчитали бы
+        # общих врачей дважды, поэтому один раз объединяем списки и запоминаем результат
+        aggregate = self._combined.get(token_ids)
+        if aggregate is None:
+            row_ids = union_postings([self.speciality_index.postings.at(token_id) for token_id in token_ids])
+            aggregate = self._aggregate(token_ids, row_ids)
+            self._combined[token_ids] = aggregate
+        return aggregate
+
+    def for_row(self, row_id):
+        return self.for_specialities(self.speciality_index.row_tokens(row_id).tolist())
+
+
+class QualityScores:
+    # Оценка "цена/качество" каждого врача в [0, 1], считается один раз при загрузке данных:
+    # - рейтинг, притянутый к среднему, пока отзывов мало;
+    # - цена относительно медианы по его специальностям (вдвое дешевле - максимум, вдвое дороже - ноль);
+    # - согласие рейтингов СберЗдоровья и ПроДокторов (один источник - половина).
+    # rank - место строки при сортировке по оценке, выдача упорядочивается по нему
+    def __init__(self, score, rank):
+        self.score = score
+        self.rank = rank
+
+    @classmethod
+    def build(cls, df, speciality_index):
+        rating = numeric_column(df, 'rating')
+        reviews = np.nan_to_num(numeric_column(df, 'review_count_sber')) + np.nan_to_num(numeric_column(df, 'review_count_prod'))
+        rated = ~np.isnan(rating)
+        prior = np.nanmean(rating) if rated.any() else MAX_RATING / 2
+        reviews = np.where(rated, reviews, 0)
+        confident_rating = (np.nan_to_num(rating) * reviews + prior * REVIEW_PRIOR) / (reviews + REVIEW_PRIOR)
+
+        price = numeric_column(df, 'price')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (np.clip(-np.log2(price / cls._median_prices(price, speciality_index)), -1, 1) + 1) / 2
+        value = np.nan_to_num(value, nan=0.5)
+
+        disagreement = np.abs(numeric_column(df, 'rating_sber') - numeric_column(df, 'rating_prod')) / MAX_RATING
+        agreement = np.nan_to_num(1 - np.clip(disagreement, 0, 1), nan=0.5)
+
+        weights = QUALITY_WEIGHTS
+        score = weights[0] * confident_rating / MAX_RATING + weights[1] * value + weights[2] * agreement
+        score = np.clip(score, 0, 1).astype(np.float32)
+
+        order = np.argsort(-score, kind='stable')
+        rank = np.empty(len(order), dtype=np.int32)
+        rank[order] = np.arange(len(order), dtype=np.int32)
+        return cls(score, rank)
+
+    @staticmethod
+    def _median_prices(price, speciality_index):
+        # Медиана цены по каждой специальности, для строки - среднее медиан её специальностей
+        n_rows = len(price)
+        rows = np.repeat(np.arange(n_rows), np.diff(speciality_index.row_offsets))
+        tokens = speciality_index.row_token_ids
+        prices = price[rows]
+        present = ~np.isnan(prices)
+        tokens, prices = tokens[present], prices[present]
+
+        n_tokens = len(speciality_index.tokens)
+        order = np.lexsort((prices, tokens))
+        prices = prices[order]
+        counts = np.bincount(tokens, minlength=n_tokens)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        medians = np.full(n_tokens, np.nan)
+        priced = counts > 0
+        low = starts[priced] + (counts[priced] - 1) // 2
+        high = starts[priced] + counts[priced] // 2
+        medians[priced] = (prices[low] + prices[high]) / 2
+
+        row_medians = medians[speciality_index.row_token_ids]
+        known = ~np.isnan(row_medians)
+        totals = np.bincount(rows[known], weights=row_medians[known], minlength=n_rows)
+        counts = np.bincount(rows[known], minlength=n_rows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return totals / counts
+
+    def to_arrays(self):
+        return {'score': self.score, 'rank': self.rank}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['score'], arrays['rank'])
+
+    def top(self, row_ids, k):
+        # Лучшие k строк по оценке в начале, по порядку; остальные за ними без сортировки
+        if len(row_ids) <= k:
+            return row_ids[np.argsort(self.rank[row_ids])]
+        ranks = self.rank[row_ids]
+        part = np.argpartition(ranks, k - 1)
+        head = part[:k][np.argsort(ranks[part[:k]])]
+        return np.concatenate((row_ids[head], row_ids[part[k:]]))
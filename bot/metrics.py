@@ -0,0 +1,234 @@
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+from webhook import serve_http
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 1000000)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in items) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Оценка по границам корзин - для лога, точные квантили считает Prometheus
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    # Счётчики, гистограммы и значения, снимаемые при выгрузке, в формате Prometheus.
+    # Наблюдения приходят из цикла событий и из потоков пула, поэтому под блокировкой.
+    # У каждого процесса webhook свой реестр: constant_labels (worker) отличают их ряды друг от друга
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._counter_callbacks = {}
+        self._help = {}
+        self.constant_labels = ()
+
+    def set_constant_labels(self, **labels):
+        self.constant_labels = _label_key(labels)
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, callback, **labels):
+        # Значение читается в момент выгрузки: размер хранилища сессий, запросы в работе
+        self._gauges.setdefault(name, {})[_label_key(labels)] = callback
+
+    def counter(self, name, callback, **labels):
+        # Как gauge, но значение только растёт (вытеснения, попадания в кэш): тип counter, чтобы работал rate()
+        self._counter_callbacks.setdefault(name, {})[_label_key(labels)] = callback
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+
+        const = self.constant_labels
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, 'counter')
+            for key, value in sorted(series.items()):
+                lines.append(f'{name}{_format_labels(const + key)} {_format_value(value)}')
+
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, 'histogram')
+            for key, (buckets, counts, total, count) in sorted(series.items()):
+                key = const + key
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = ('le', _format_value(float(bound)))
+                    lines.append(f'{name}_bucket{_format_labels(key, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(key)} {count}')
+
+        self._render_callbacks(lines, self._counter_callbacks, 'counter')
+        self._render_callbacks(lines, self._gauges, 'gauge')
+        return '\n'.join(lines) + '\n'
+
+    def _render_callbacks(self, lines, callbacks, kind):
+        for name, series in sorted(callbacks.items()):
+            self._header(lines, name, kind)
+            for key, callback in sorted(series.items()):
+                try:
+                    value = callback()
+                except Exception as e:
+                    print(f"Не удалось получить значение метрики {name}: {e}")
+                    continue
+                lines.append(f'{name}{_format_labels(self.constant_labels + key)} {_format_value(value)}')
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f'# HELP {name} {self._help[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    def summary(self):
+        # Короткая строка для периодического лога: запросы и p50/p99 по каждой гистограмме времени
+        parts = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                if not name.endswith('_seconds'):
+                    continue
+                for key, histogram in sorted(series.items()):
+                    label = ','.join(str(value) for _, value in key) or name
+                    p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+                    parts.append(f"{label}: {histogram.count} шт, p50<={p50 * 1000:g}мс p99<={p99 * 1000:g}мс")
+        for name, series in sorted({**self._counter_callbacks, **self._gauges}.items()):
+            for key, callback in sorted(series.items()):
+                try:
+                    parts.append(f"{name}{_format_labels(key)}={callback()}")
+                except Exception:
+                    pass
+        return '; '.join(parts)
+
+
+REGISTRY = Metrics()
+REGISTRY.describe('bot_handler_seconds', 'Время обработки обновления обработчиком')
+REGISTRY.describe('bot_search_seconds', 'Время поиска и отрисовки по типу запроса, включая ожидание пула')
+REGISTRY.describe('bot_job_seconds', 'Время выполнения задачи в пуле')
+REGISTRY.describe('bot_executor_wait_seconds', 'Ожидание свободного места в пуле')
+REGISTRY.describe('bot_result_size', 'Размер выдачи по типу поиска')
+REGISTRY.describe('bot_telegram_api_seconds', 'Время вызова Bot API по методу')
+REGISTRY.describe('bot_telegram_api_errors_total', 'Ошибки вызовов Bot API по методу')
+
+
+class TimedRequest(HTTPXRequest):
+    # Запросы к Bot API с замером времени по методу (sendMessage, sendPhoto, ...)
+    def __init__(self, metrics=REGISTRY, connection_pool_size=256, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            self.metrics.inc('bot_telegram_api_errors_total', method=api_method)
+            raise
+        finally:
+            self.metrics.observe('bot_telegram_api_seconds', time.perf_counter() - started, method=api_method)
+
+
+async def _serve_metrics(metrics):
+    return 200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render().encode('utf-8')
+
+
+def metrics_route(metrics=REGISTRY):
+    return lambda: _serve_metrics(metrics)
+
+
+async def serve_metrics(host, port, metrics=REGISTRY):
+    async def handle(method, path, headers, body):
+        if path != '/metrics' or method != 'GET':
+            return 404, 'text/plain', b''
+        return await _serve_metrics(metrics)
+
+    return await serve_http(handle, host, port)
+
+
+def timed_handler(name, metrics=REGISTRY):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with metrics.timer('bot_handler_seconds', handler=name):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def log_metrics_periodically(interval, metrics=REGISTRY):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"Метрики [{os.getpid()}]: {metrics.summary()}")
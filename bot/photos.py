@@ -0,0 +1,119 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from telegram.error import BadRequest
+
+DEFAULT_CACHE_FILE = 'photo_ids.json'
+
+
+class PhotoCache:
+    # Фото загружается в Telegram один раз, дальше отправляется по file_id.
+    # file_id привязан к токену бота, поэтому в файле кэша они лежат отдельно для каждого бота.
+    # Файл общий для процессов webhook: перед записью он перечитывается под блокировкой и изменения
+    # сливаются, иначе процесс, записавший последним, затёр бы file_id, сохранённые другими
+    def __init__(self, path=DEFAULT_CACHE_FILE):
+        self.path = path
+        self.uploads = 0
+        self.cached_sends = 0
+        self._lock = threading.Lock()
+        self._file_ids = self._read()
+        self._photos = {}
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as cache:
+                return json.load(cache)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Не удалось прочитать кэш фото {self.path}: {e}")
+            return {}
+
+    def _write(self):
+        cache_tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(cache_tmp, 'w', encoding='utf-8') as cache:
+                json.dump(self._file_ids, cache, ensure_ascii=False, indent=2)
+            os.replace(cache_tmp, self.path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш фото {self.path}: {e}")
+
+    @contextmanager
+    def _file_lock(self):
+        try:
+            lock = open(f'{self.path}.lock', 'a')
+        except OSError as e:
+            print(f"Не удалось заблокировать кэш фото {self.path}: {e}")
+            yield
+            return
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _update(self, change):
+        # change(file_ids) правит свежую копию файла; она же становится кэшем процесса
+        with self._lock:
+            if not self.path:
+                change(self._file_ids)
+                return
+            with self._file_lock():
+                file_ids = self._read()
+                changed = change(file_ids)
+                self._file_ids = file_ids
+                if changed:
+                    self._write()
+
+    def _photo_bytes(self, photo_path):
+        photo = self._photos.get(photo_path)
+        if photo is None:
+            with open(photo_path, 'rb') as photo_file:
+                photo = self._photos[photo_path] = photo_file.read()
+        return photo
+
+    def get(self, bot_id, photo_path):
+        return self._file_ids.get(str(bot_id), {}).get(photo_path)
+
+    def remember(self, bot_id, photo_path, file_id):
+        def change(file_ids):
+            file_ids.setdefault(str(bot_id), {})[photo_path] = file_id
+            return True
+        self._update(change)
+
+    def forget(self, bot_id, photo_path, file_id):
+        # Удаляем только не принятый Telegram file_id: другой процесс мог уже сохранить новый
+        def change(file_ids):
+            photos = file_ids.get(str(bot_id), {})
+            if photos.get(photo_path) != file_id:
+                return False
+            del photos[photo_path]
+            return True
+        self._update(change)
+
+    async def reply_photo(self, message, photo_path, **kwargs):
+        # FileNotFoundError пробрасывается: обработчик тогда отвечает текстом
+        bot_id = message.get_bot().id
+        file_id = self.get(bot_id, photo_path)
+        if file_id is not None:
+            try:
+                sent = await message.reply_photo(photo=file_id, **kwargs)
+                self.cached_sends += 1
+                return sent
+            except BadRequest as e:
+                print(f"Telegram не принял сохранённый file_id для {photo_path}: {e}")
+                self.forget(bot_id, photo_path, file_id)
+
+        sent = await message.reply_photo(photo=self._photo_bytes(photo_path), filename=os.path.basename(photo_path), **kwargs)
+        self.uploads += 1
+        if sent is not None and sent.photo:
+            # Telegram возвращает несколько размеров, самый большой - последний
+            self.remember(bot_id, photo_path, sent.photo[-1].file_id)
+        return sent
+
+
+def create_photo_cache():
+    return PhotoCache(os.getenv('PHOTO_CACHE', DEFAULT_CACHE_FILE))
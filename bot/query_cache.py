@@ -0,0 +1,80 @@
+import os
+import threading
+from collections import OrderedDict
+
+from sessions import as_row_ids
+
+DEFAULT_MAX_QUERIES = 4096
+
+
+def frozen_row_ids(row_ids):
+    # Один массив на запрос разделяется всеми сессиями, поэтому только для чтения.
+    # Запрещаем запись через view: сам массив может быть чужим (EMPTY_IDS, срез списка вхождений)
+    row_ids = as_row_ids(row_ids).view()
+    row_ids.flags.writeable = False
+    return row_ids
+
+
+class QueryCache:
+    # Результаты поиска по нормализованному запросу, общие для всех пользователей (LRU).
+    # Номера строк относятся к версии снимка: при обновлении данных кэш очищается,
+    # а результат, досчитанный на старом снимке, не сохраняется
+    def __init__(self, max_queries=DEFAULT_MAX_QUERIES):
+        self.max_queries = max_queries
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version == self.version:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, version, key, row_ids, *extra):
+        # Возвращает то, что надо отдать вызывающему: массив только для чтения (и extra, если есть)
+        value = (frozen_row_ids(row_ids), *extra) if extra else frozen_row_ids(row_ids)
+        if self.max_queries <= 0:
+            return value
+        with self._lock:
+            if self.version is None:
+                self.version = version
+            if version != self.version:
+                return value
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_queries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self, version=None):
+        with self._lock:
+            self._entries.clear()
+            self.version = version
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'size': len(self), 'max_queries': self.max_queries, 'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'hit_rate': round(self.hit_rate, 4),
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def create_query_cache():
+    return QueryCache(int(os.getenv('QUERY_CACHE_SIZE', DEFAULT_MAX_QUERIES)))
@@ -0,0 +1,301 @@
+import numpy as np
+import pandas as pd
+
+from indexes import METRO_COLUMNS, intersect_postings
+from reviews import doctor_reviews, review_index
+from typeahead import DOCTOR, SPECIALITY
+
+RESULTS_PER_PAGE = 5
+# Отзывы в карточке обрезаются, чтобы сообщение не упёрлось в лимит Telegram
+REVIEW_TEXT_LIMIT = 300
+
+
+def _speciality_text(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return ', '.join(map(str, value))
+    if not isinstance(value, str) and pd.isna(value):
+        return ''
+    if isinstance(value, str) and (',' in value or ';' in value):
+        return value.replace(';', ',').replace('|', ',')
+    return str(value)
+
+
+def _metro_text(*stations):
+    return ', '.join(dict.fromkeys(str(station) for station in stations if not pd.isna(station)))
+
+
+def _optional_line(df, column, template):
+    if column not in df.columns:
+        return pd.Series('', index=df.index)
+    values = df[column]
+    return values.astype(str).radd(template[0]).add(template[1]).where(values.notna(), '')
+
+
+class TextColumn:
+    # Строки в одном буфере UTF-8 со смещениями: компактно и загружается через mmap
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def build(cls, texts):
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def take(self, row_ids):
+        return [self[index] for index in row_ids]
+
+    def tolist(self):
+        # Все строки разом: один проход по буферу вместо среза mmap на каждую
+        data, offsets = self.data.tobytes(), self.offsets.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}.offsets': self.offsets, f'{prefix}.data': self.data}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(arrays[f'{prefix}.offsets'], arrays[f'{prefix}.data'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class ResultCards:
+    # Заранее собранные для каждого врача блок в списке результатов, станции метро,
+    # специальности и подпись кнопки "Подробнее": страница выдачи - это срез и склейка строк
+    _COLUMNS = ('summaries', 'metro', 'specialities', 'labels')
+
+    def __init__(self, summaries, metro, specialities, labels):
+        self.summaries = summaries
+        self.metro = metro
+        self.specialities = specialities
+        self.labels = labels
+
+    @classmethod
+    def build(cls, df):
+        if df.empty:
+            return cls(*(TextColumn.build([]) for _ in cls._COLUMNS))
+
+        names = df['name'].fillna('').astype(str)
+        # Значения повторяются, поэтому форматируем только уникальные
+        if 'speciality' in df.columns:
+            try:
+                codes, uniques = pd.factorize(df['speciality'])
+            except TypeError:
+                # Списки специальностей не хешируются - форматируем построчно
+                codes, uniques = np.arange(len(df)), df['speciality'].tolist()
+        else:
+            codes, uniques = np.full(len(df), -1), []
+        specialities = np.array([_speciality_text(value) for value in uniques] + [''], dtype=object)[codes]
+
+        metro_columns = [df[column].to_numpy(dtype=object) for column in METRO_COLUMNS if column in df.columns]
+        metro = []
+        metro_cache = {}
+        for stations in zip(*metro_columns):
+            text = metro_cache.get(stations)
+            if text is None:
+                text = metro_cache[stations] = _metro_text(*stations)
+            metro.append(text)
+        metro = pd.Series(metro, index=df.index)
+        specialities = pd.Series(specialities, index=df.index)
+
+        summaries = (
+            names + '\n'
+            + ('Специальность: ' + specialities.where(specialities != '', 'не указана') + '\n')
+            + _optional_line(df, 'experience', ('Опыт работы: ', ' лет\n'))
+            + _optional_line(df, 'price', ('Цена приёма: ', ' руб.\n'))
+            + _optional_line(df, 'rating', ('Рейтинг: ', '/5.0\n'))
+            + ('Метро: ' + metro.where(metro != '', 'нет данных') + '\n')
+        )
+        labels = names.str.split(n=1).str[0].fillna('')
+
+        return cls(
+            TextColumn.build(summaries),
+            TextColumn.build(metro),
+            TextColumn.build(specialities),
+            TextColumn.build(labels),
+        )
+
+    def to_arrays(self):
+        arrays = {}
+        for column in self._COLUMNS:
+            arrays.update(getattr(self, column).to_arrays(column))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(*(TextColumn.from_arrays(arrays, column) for column in cls._COLUMNS))
+
+
+def format_detailed_result(row, market, metro, speciality, quality=None, reviews=()):
+    result = "Подробная информация:\n\n"
+    result += f"ФИО: {row['name']}\n"
+
+    if metro:
+        result += f"Метро: {metro}\n"
+    else:
+        result += "Метро: Нет данных\n"
+
+    if speciality:
+        result += f"Специальность: {speciality}\n"
+    else:
+        result += "Специальность: Нет данных\n"
+
+    if 'experience' in row and pd.notna(row['experience']):
+        result += f"Опыт работы: {row['experience']} лет\n"
+    else:
+        result += "Опыт работы: Нет данных\n"
+
+    if 'rating' in row and pd.notna(row['rating']):
+        result += f"Взвешенный рейтинг: {row['rating']}/5.0 \n"
+
+    if quality is not None:
+        result += f"Оценка цена/качество: {quality * 10:.1f}/10\n"
+
+    result += "\n"
+
+    result += "СберЗдоровье:\n"
+    price_s = row['price_sber'] if 'price_sber' in row and pd.notna(row['price_sber']) else "нет данных"
+    rating_s = row['rating_sber'] if 'rating_sber' in row and pd.notna(row['rating_sber']) else "нет данных"
+
+    if 'link_sber' in row and pd.notna(row['link_sber']):
+        result += f"Цена: {price_s}\n"
+        result += f"Рейтинг: {rating_s}\n"
+        result += f"Ссылка: {row['link_sber']}\n"
+    else:
+        result += f"Цена: {price_s}\n"
+        result += f"Рейтинг: {rating_s}\n"
+    result += "\n"
+
+    result += "ПроДокторов:\n"
+    price_p = row['price_prod'] if 'price_prod' in row and pd.notna(row['price_prod']) else "нет данных"
+    rating_p = row['rating_prod'] if 'rating_prod' in row and pd.notna(row['rating_prod']) else "нет данных"
+
+    if 'link_prod' in row and pd.notna(row['link_prod']):
+        result += f"Цена: {price_p}\n"
+        result += f"Рейтинг: {rating_p}\n"
+        result += f"Ссылка: {row['link_prod']}\n"
+    else:
+        result += f"Цена: {price_p}\n"
+        result += f"Рейтинг: {rating_p}\n"
+    result += "\n"
+
+    result += "Сравнение с рынком:\n"
+
+    if pd.notna(row['price']): price_current = row['price']
+    else: price_current = None
+    if pd.notna(market.price_mean): price_market = market.price_mean
+    else: price_market = None
+
+    if price_current and price_market and market.count != 1:
+        if price_current > price_market:
+            result += f"💔 Цена выше рынка специалистов на {price_current - price_market:.1f} руб\n"
+        elif price_current < price_market:
+            result += f"💚 Цена ниже рынка специалистов на {price_market - price_current:.1f} руб\n"
+        else:
+            result += "Цена совпадает с средним значением по рынку специалистов\n"
+    else:
+        result += "Нет данных для сравнения цен\n"
+
+    if pd.notna(row['rating']): rating_current = row['rating']
+    else: rating_current = None
+    if pd.notna(market.rating_mean): rating_market = market.rating_mean
+    else: rating_market = None
+
+    if rating_current and rating_market and market.count != 1:
+        if rating_current > rating_market:
+            result += f"💚 Рейтинг выше рынка специалистов на {rating_current - rating_market:.1f}\n"
+        elif rating_current < rating_market:
+            result += f"💔 Рейтинг ниже рынка специалистов на {rating_market - rating_current:.1f}\n"
+        else:
+            result += "Рейтинг совпадает со средним значением по рынку специалистов\n"
+    else:
+        result += "Нет данных для сравнения рейтингов\n"
+
+    if market.specialities and market.count > 1:
+        result += f"\nСравнение с {market.count} врачами аналогичных специальностей\n"
+
+    for source, stats, latest in reviews:
+        result += f"\nОтзывы ({source}): {stats.count}"
+        if not np.isnan(stats.rate):
+            result += f", средняя оценка {stats.rate:.2f}, с учётом свежести {stats.recent_rate:.2f}"
+        result += "\n"
+        for review in latest:
+            result += f"{format_review(review)}\n"
+
+    return result
+
+
+def format_review(review):
+    comment = review['comment']
+    if len(comment) > REVIEW_TEXT_LIMIT:
+        comment = comment[:REVIEW_TEXT_LIMIT].rstrip() + "…"
+    rate = f"{review['rate']:g}/5" if review['rate'] is not None else "без оценки"
+    return f"- {review['date'] or 'дата неизвестна'}, {rate}: {comment}"
+
+
+def format_results_page(cards, page_ids, start, current_page, total_pages, total_results):
+    summaries = cards.summaries.take(page_ids)
+    return (
+        f"Найдено совпадений: {total_results}\n\n"
+        + "".join(f"{i}. {summary}\n" for i, summary in enumerate(summaries, start=start + 1))
+        + f"Страница {current_page + 1} из {total_pages}"
+    )
+
+
+def render_results_page(snapshot, page_ids, start, current_page, total_pages, total_results):
+    cards = snapshot.result_cards
+    message_text = format_results_page(cards, page_ids, start, current_page, total_pages, total_results)
+    doctor_buttons = [
+        (i, int(index), label)
+        for i, (index, label) in enumerate(zip(page_ids, cards.labels.take(page_ids)), start=start + 1)
+    ]
+    return message_text, doctor_buttons
+
+
+def render_detailed_result(snapshot, index):
+    cards = snapshot.result_cards
+    row = snapshot.df.iloc[index]
+    return format_detailed_result(
+        row, snapshot.market_stats.for_row(index), cards.metro[index], cards.specialities[index],
+        float(snapshot.quality_scores.score[index]), doctor_reviews(review_index(), row),
+    )
+
+
+def render_suggestions(snapshot, query):
+    # Варианты inline-подсказки: (id, заголовок, описание, текст сообщения, которое отправится при выборе).
+    # Сообщение - обычный запрос боту: "специальность," или "специальность, станция" (", станция" без
+    # специальности) либо ФИО
+    typeahead = snapshot.typeahead
+    speciality, entities = typeahead.complete(query)
+    # После запятой число врачей у станции - только указанной специальности, по нему и порядок;
+    # станции без таких врачей не предлагаем
+    speciality_ids = snapshot.speciality_index.find(speciality) if speciality else None
+    suggestions = []
+    for entity in entities.tolist():
+        kind, ref = int(typeahead.entity_kinds[entity]), int(typeahead.entity_refs[entity])
+        count = int(typeahead.entity_counts[entity])
+        if kind == DOCTOR:
+            rating = snapshot.market_stats.rating[ref]
+            rating = f", рейтинг {rating:g}" if not np.isnan(rating) else ""
+            name = str(snapshot.df['name'].iat[ref])
+            suggestions.append((f'd{ref}', name, snapshot.result_cards.specialities[ref] + rating, name))
+        elif kind == SPECIALITY:
+            token = str(snapshot.speciality_index.tokens[ref])
+            suggestions.append((f's{ref}', token.capitalize(), f"Специальность, врачей: {count}", f"{token},"))
+        else:
+            if speciality_ids is not None:
+                count = len(intersect_postings([speciality_ids, snapshot.metro_index.postings.at(ref)]))
+                if not count:
+                    continue
+            station = snapshot.metro_index.display[ref]
+            suggestions.append((f'm{ref}', station, f"Метро, врачей: {count}", f"{speciality or ''}, {station}", count))
+    if speciality_ids is not None:
+        suggestions.sort(key=lambda suggestion: -suggestion[-1])
+    return [suggestion[:4] for suggestion in suggestions]
@@ -0,0 +1,206 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+import snowballstemmer
+
+# Полнотекстовый поиск по комментариям отзывов: обратный индекс основ слов с ранжированием BM25.
+# Документ - все отзывы одного врача (блок в reviews.jsonl), номер документа совпадает с позицией врача
+# в индексе отзывов, поэтому списки вхождений сразу ссылаются на врачей. Индекс собирается вместе
+# с индексом отзывов (reviews.py build): вхождения копятся частями и сбрасываются на диск отсортированными
+# прогонами, в конце прогоны сливаются по диапазонам терминов - в памяти не больше одной части.
+
+SEARCH_PREFIX = 'search'
+RUN_POSTINGS = 2_000_000
+MERGE_TERMS = 50_000
+MAX_TF = np.iinfo(np.uint16).max
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORDS = re.compile(r'[а-яa-z]+')
+# Служебные слова, которые встречаются почти в каждом отзыве и только раздувают индекс.
+# "без" и "не" оставлены: "без боли" и "не больно" - осмысленные запросы
+STOP_WORDS = frozenset('''
+и в во на с со к ко по о об от до из за у а но же ли бы то что как так это этот эта эти мне меня мой моя
+мои мы нас нам вы вас вам он она оно они его ее их ему ей им я ты для при все всё уже очень еще ещё был
+была были было быть есть который которая которые когда где там тут только даже если или да
+'''.split())
+
+_local = threading.local()
+
+
+def _stemmer():
+    # Стеммер snowball хранит состояние разбора в объекте, поэтому у каждого потока свой
+    stemmer = getattr(_local, 'stemmer', None)
+    if stemmer is None:
+        stemmer = _local.stemmer = snowballstemmer.stemmer('russian')
+    return stemmer
+
+
+@lru_cache(maxsize=2 ** 18)
+def stem(word):
+    return _stemmer().stemWord(word)
+
+
+def words(text):
+    return [word for word in _WORDS.findall(text.lower().replace('ё', 'е')) if word not in STOP_WORDS]
+
+
+def stems(text):
+    return [stem(word) for word in words(text)]
+
+
+def term_counts(texts):
+    # Частоты основ по всем отзывам врача: стеммер вызывается один раз на словоформу, а не на вхождение
+    counts = Counter()
+    for word, count in Counter(word for text in texts for word in words(text)).items():
+        counts[stem(word)] += count
+    return counts
+
+
+class SearchIndexBuilder:
+    # Копит вхождения (термин, документ, частота) по документам в порядке номеров.
+    # Прогоны сортируются по номеру термина; документы внутри термина уже по возрастанию
+    def __init__(self, directory):
+        self.directory = directory
+        self.vocabulary = {}
+        self.lengths = []
+        self.runs = []
+        self._terms, self._docs, self._tfs = [], [], []
+        self._buffered = 0
+
+    def add(self, doc, texts):
+        counts = term_counts(texts)
+        if len(self.lengths) <= doc:
+            self.lengths.extend([0] * (doc + 1 - len(self.lengths)))
+        self.lengths[doc] = sum(counts.values())
+        if not counts:
+            return
+
+        vocabulary = self.vocabulary
+        term_ids = np.fromiter((vocabulary.setdefault(term, len(vocabulary)) for term in counts), np.int32, len(counts))
+        self._terms.append(term_ids)
+        self._docs.append(np.full(len(counts), doc, dtype=np.int32))
+        self._tfs.append(np.minimum(np.fromiter(counts.values(), np.int64, len(counts)), MAX_TF).astype(np.uint16))
+        self._buffered += len(counts)
+        if self._buffered >= RUN_POSTINGS:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        terms = np.concatenate(self._terms)
+        order = np.argsort(terms, kind='stable')
+        run = os.path.join(self.directory, f'run.{len(self.runs)}')
+        for name, values in (('terms', terms), ('docs', np.concatenate(self._docs)), ('tfs', np.concatenate(self._tfs))):
+            np.save(f'{run}.{name}.npy', values[order])
+        self.runs.append(run)
+        self._terms, self._docs, self._tfs = [], [], []
+        self._buffered = 0
+
+    def finish(self, output_dir, docs_count):
+        self._flush()
+        n_terms = len(self.vocabulary)
+        runs = [
+            {name: np.load(f'{run}.{name}.npy', mmap_mode='r') for name in ('terms', 'docs', 'tfs')}
+            for run in self.runs
+        ]
+        counts = np.zeros(n_terms, dtype=np.int64)
+        for run in runs:
+            counts += np.bincount(run['terms'], minlength=n_terms)
+        term_offsets = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_offsets[1:])
+
+        total = int(term_offsets[-1])
+        docs = np.lib.format.open_memmap(
+            os.path.join(output_dir, f'{SEARCH_PREFIX}.docs.npy'), mode='w+', dtype=np.int32, shape=(total,)
+        )
+        tfs = np.lib.format.open_memmap(
+            os.path.join(output_dir, f'{SEARCH_PREFIX}.tfs.npy'), mode='w+', dtype=np.uint16, shape=(total,)
+        )
+        # Слияние по диапазонам терминов: прогоны идут по возрастанию документов,
+        # так что после устойчивой сортировки по термину документы остаются упорядоченными
+        for low in range(0, n_terms, MERGE_TERMS):
+            high = min(low + MERGE_TERMS, n_terms)
+            slices = [
+                slice(*np.searchsorted(run['terms'], [low, high])) for run in runs
+            ]
+            terms = np.concatenate([run['terms'][part] for run, part in zip(runs, slices)])
+            order = np.argsort(terms, kind='stable')
+            start, end = term_offsets[low], term_offsets[high]
+            docs[start:end] = np.concatenate([run['docs'][part] for run, part in zip(runs, slices)])[order]
+            tfs[start:end] = np.concatenate([run['tfs'][part] for run, part in zip(runs, slices)])[order]
+        docs.flush()
+        tfs.flush()
+        del docs, tfs, runs
+
+        terms = np.array(list(self.vocabulary), dtype=str)
+        order = np.argsort(terms)
+        lengths = np.zeros(docs_count, dtype=np.int32)
+        lengths[:len(self.lengths)] = self.lengths[:docs_count]
+        arrays = {
+            'terms': terms[order],
+            'term_ids': order.astype(np.int32),
+            'term_offsets': term_offsets,
+            'lengths': lengths,
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(output_dir, f'{SEARCH_PREFIX}.{name}.npy'), array)
+        return {'terms': n_terms, 'postings': total, 'avg_length': float(lengths.mean()) if docs_count else 0.0}
+
+
+class ReviewSearch:
+    # terms - основы по алфавиту, term_ids - их номера; вхождения термина i - docs/tfs[term_offsets[i]:term_offsets[i + 1]]
+    _ARRAYS = ('terms', 'term_ids', 'term_offsets', 'docs', 'tfs', 'lengths')
+
+    def __init__(self, terms, term_ids, term_offsets, docs, tfs, lengths):
+        self.terms = terms
+        self.term_ids = term_ids
+        self.term_offsets = term_offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.avg_length = float(np.mean(lengths)) if len(lengths) else 0.0
+        # Нормировка длины документа в BM25 от запроса не зависит
+        self._norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(self.avg_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def open(cls, reviews_dir):
+        if not os.path.exists(os.path.join(reviews_dir, f'{SEARCH_PREFIX}.terms.npy')):
+            return None
+        arrays = {
+            name: np.load(os.path.join(reviews_dir, f'{SEARCH_PREFIX}.{name}.npy'), mmap_mode='r') for name in cls._ARRAYS
+        }
+        return cls(**arrays)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def postings(self, term):
+        position = int(np.searchsorted(self.terms, term))
+        if position >= len(self.terms) or self.terms[position] != term:
+            return None
+        term_id = int(self.term_ids[position])
+        start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        return self.docs[start:end], self.tfs[start:end]
+
+    def score(self, query):
+        # BM25 по всем документам; None - ни одной основы запроса нет в индексе
+        scores = None
+        for term in dict.fromkeys(stems(query)):
+            found = self.postings(term)
+            if found is None:
+                continue
+            docs, tfs = found
+            idf = math.log(1 + (len(self) - len(docs) + 0.5) / (len(docs) + 0.5))
+            tfs = tfs.astype(np.float32)
+            if scores is None:
+                scores = np.zeros(len(self), dtype=np.float32)
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + self._norm[docs])
+        return scores
+
@@ -0,0 +1,424 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from review_search import ReviewSearch, SearchIndexBuilder
+
+# Отзывы о врачах для карточки бота. Индекс собирается одним потоковым проходом по doctors_review.csv:
+#
+#   python reviews.py build ../eda/merge/doctors_review.csv reviews --stats ../eda/review_stat.csv
+#
+# Отзывы читаются частями и раскладываются по корзинам по хешу doctor_link, корзина - диапазон хешей,
+# так что все отзывы врача попадают в одну корзину. Корзины по очереди сортируются, по ним считается
+# статистика врачей, а сами отзывы дописываются в reviews.jsonl: отзывы одного врача идут подряд, от новых
+# к старым, врачи - по возрастанию хеша ссылки. Рядом лежат хеши и смещения блоков в файле (.npy),
+# бот открывает файл через mmap и читает последние отзывы врача одним срезом, не загружая корпус.
+# Тем же проходом собирается полнотекстовый индекс по комментариям (review_search.py).
+
+DEFAULT_REVIEWS_DIR = 'reviews'
+REVIEWS_FILE = 'reviews.jsonl'
+META_FILE = 'meta.json'
+REVIEWS_FORMAT = 2
+
+READ_CHUNK_ROWS = 100_000
+DEFAULT_BUCKETS = 16
+# docdoc работает с 2012 года, более ранние отзывы в EDA_reviews.ipynb признаны выбросами
+MIN_REVIEW_DATE = pd.Timestamp('2012-01-01')
+# Вес отзыва в рейтинге по свежести уменьшается вдвое за это число дней
+RECENCY_HALF_LIFE_DAYS = 365
+# Оценки 0..5, дробные (3.8 у продокторов) округляются до целых
+RATE_BINS = 6
+LATEST_REVIEWS = 3
+
+SOURCES = {'docdoc': 'sber', 'prodoctorov': 'prodoctorov'}
+
+ReviewStats = namedtuple('ReviewStats', ['count', 'rate', 'histogram', 'recent_rate', 'last_date'])
+
+
+def link_keys(links):
+    # 64-битный хеш ссылки: в индексе хранятся только хеши, а не строки ссылок
+    links = pd.Series(links, dtype=object).fillna('').astype(str).str.strip()
+    return pd.util.hash_pandas_object(links, index=False).to_numpy(dtype=np.uint64)
+
+
+def key_buckets(keys, buckets):
+    # Корзина - диапазон хешей, поэтому корзины по порядку дают файл, отсортированный по хешу
+    return ((keys >> np.uint64(32)) * np.uint64(buckets) >> np.uint64(32)).astype(np.int64)
+
+
+def clean_reviews(chunk):
+    # Та же чистка, что в EDA_reviews.ipynb: без пустых комментариев и отзывов старше docdoc.
+    # Дата из будущего - опечатка на сайте, такой отзыв остаётся, но без даты
+    chunk = chunk[chunk['comment'].notna() & chunk['doctor_link'].notna()]
+    dates = pd.to_datetime(chunk['date'], errors='coerce')
+    chunk = chunk[~(dates < MIN_REVIEW_DATE)]
+    dates = dates[chunk.index]
+    return pd.DataFrame({
+        'doctor_link': chunk['doctor_link'].astype(str).str.strip(),
+        'rate': pd.to_numeric(chunk['rate'], errors='coerce'),
+        'date': dates.where(dates <= pd.Timestamp.now()).dt.strftime('%Y-%m-%d'),
+        'comment': chunk['comment'].astype(str).str.strip(),
+        'clinic': chunk['clinic'] if 'clinic' in chunk.columns else None,
+    })
+
+
+def read_reviews(path):
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=READ_CHUNK_ROWS):
+            yield clean_reviews(batch.to_pandas())
+        return
+    for chunk in pd.read_csv(path, chunksize=READ_CHUNK_ROWS, dtype={'comment': 'string', 'clinic': 'string'}):
+        yield clean_reviews(chunk)
+
+
+def partition(path, directory, buckets):
+    parts = [os.path.join(directory, f'reviews.{i}.csv') for i in range(buckets)]
+    written = set()
+    rows = 0
+    for chunk in read_reviews(path):
+        for bucket, part_rows in chunk.groupby(key_buckets(link_keys(chunk['doctor_link']), buckets)):
+            part = parts[bucket]
+            part_rows.to_csv(part, mode='a', header=part not in written, index=False)
+            written.add(part)
+        rows += len(chunk)
+    return [part for part in parts if part in written], rows
+
+
+def bucket_stats(reviews, keys, starts):
+    # Статистика врачей одной корзины; reviews отсортированы по хешу, starts - начала блоков врачей
+    rate = reviews['rate'].to_numpy(dtype=float)
+    rated = ~np.isnan(rate)
+    doctor = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(reviews))))
+
+    count = np.diff(np.append(starts, len(reviews))).astype(np.int32)
+    rate_count = np.bincount(doctor[rated], minlength=len(starts))
+    rate_sum = np.bincount(doctor[rated], weights=rate[rated], minlength=len(starts))
+
+    bins = np.clip(np.rint(rate[rated]), 0, RATE_BINS - 1).astype(np.int64)
+    histogram = np.bincount(doctor[rated] * RATE_BINS + bins, minlength=len(starts) * RATE_BINS)
+    histogram = histogram.reshape(len(starts), RATE_BINS).astype(np.int32)
+
+    # Вес 2^(дни с MIN_REVIEW_DATE / полураспад): отношение сумм то же, что при отсчёте от сегодняшнего дня,
+    # поэтому рейтинг по свежести не зависит от даты сборки и считается по частям
+    dates = pd.to_datetime(reviews['date'], errors='coerce')
+    days = ((dates - MIN_REVIEW_DATE).dt.days).to_numpy(dtype=float)
+    weighted = rated & ~np.isnan(days)
+    weight = np.exp2(days[weighted] / RECENCY_HALF_LIFE_DAYS)
+    weight_sum = np.bincount(doctor[weighted], weights=weight, minlength=len(starts))
+    weighted_sum = np.bincount(doctor[weighted], weights=weight * rate[weighted], minlength=len(starts))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = rate_sum / rate_count
+        recent = np.where(weight_sum > 0, weighted_sum / weight_sum, mean)
+
+    # Отзывы внутри блока от новых к старым, первая дата блока - последний отзыв
+    last_date = dates.to_numpy(dtype='datetime64[D]')[starts]
+    return {
+        'keys': keys,
+        'count': count,
+        'rate': mean.astype(np.float32),
+        'histogram': histogram,
+        'recent_rate': recent.astype(np.float32),
+        'last_date': last_date,
+    }
+
+
+def review_lines(reviews):
+    records = reviews[['date', 'rate', 'comment', 'clinic']].astype(object)
+    records = records.where(records.notna(), None)
+    return [
+        (json.dumps(dict(zip(('date', 'rate', 'comment', 'clinic'), record)), ensure_ascii=False) + '\n').encode('utf-8')
+        for record in records.itertuples(index=False, name=None)
+    ]
+
+
+def stats_frame(links, stats):
+    sources = links.str.extract(r'https://([a-z]+)\.ru', expand=False).map(SOURCES)
+    frame = pd.DataFrame({
+        'doctor_link': links,
+        'rate': stats['rate'],
+        'comment': stats['count'],
+        'source': sources,
+    })
+    for rate in range(RATE_BINS):
+        frame[f'rate_{rate}'] = stats['histogram'][:, rate]
+    frame['recent_rate'] = stats['recent_rate']
+    frame['last_date'] = stats['last_date']
+    return frame
+
+
+def build_reviews(path, reviews_dir=DEFAULT_REVIEWS_DIR, stats_path=None, buckets=DEFAULT_BUCKETS):
+    parent = os.path.dirname(os.path.abspath(reviews_dir))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix='.build-', dir=parent)
+    try:
+        os.chmod(build_dir, 0o755)
+        with tempfile.TemporaryDirectory(prefix='reviews-') as directory:
+            parts, rows = partition(path, directory, max(buckets, 1))
+
+            search = SearchIndexBuilder(directory)
+            arrays = []
+            offsets = [np.zeros(1, dtype=np.int64)]
+            position = 0
+            doctors = 0
+            stats_written = False
+            with open(os.path.join(build_dir, REVIEWS_FILE), 'wb') as output:
+                for part in parts:
+                    reviews = pd.read_csv(part, dtype={'doctor_link': str, 'comment': str, 'clinic': str})
+                    reviews['key'] = link_keys(reviews['doctor_link'])
+                    reviews = reviews.sort_values(['key', 'date'], ascending=[True, False], na_position='last',
+                                                  kind='stable', ignore_index=True)
+
+                    keys = reviews['key'].to_numpy()
+                    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+                    stats = bucket_stats(reviews, keys[starts], starts)
+                    arrays.append(stats)
+
+                    lines = review_lines(reviews)
+                    ends = np.cumsum([len(line) for line in lines], dtype=np.int64)
+                    offsets.append(position + ends[np.append(starts[1:], len(reviews)) - 1])
+                    output.write(b''.join(lines))
+                    position += int(ends[-1])
+
+                    comments = reviews['comment'].tolist()
+                    bounds = np.append(starts, len(reviews))
+                    for doctor in range(len(starts)):
+                        search.add(doctors + doctor, comments[bounds[doctor]:bounds[doctor + 1]])
+                    doctors += len(starts)
+
+                    if stats_path:
+                        frame = stats_frame(reviews['doctor_link'].iloc[starts].reset_index(drop=True), stats)
+                        frame.to_csv(stats_path, mode='a' if stats_written else 'w', header=not stats_written, index=False)
+                        stats_written = True
+
+            search_stats = search.finish(build_dir, doctors)
+
+        index = ReviewIndex.empty_arrays()
+        if arrays:
+            index = {name: np.concatenate([stats[name] for stats in arrays]) for name in arrays[0]}
+            index['offsets'] = np.concatenate(offsets)
+        for name, array in index.items():
+            np.save(os.path.join(build_dir, f'{name}.npy'), array)
+
+        meta = {
+            'format': REVIEWS_FORMAT,
+            'version': f'{time.time_ns():x}',
+            'reviews': rows,
+            'doctors': len(index['keys']),
+            'source': os.path.abspath(path),
+            'half_life_days': RECENCY_HALF_LIFE_DAYS,
+            'search': search_stats,
+            'created': time.time(),
+        }
+        with open(os.path.join(build_dir, META_FILE), 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, ensure_ascii=False, indent=2)
+
+        # Подмена каталога целиком: открытые ботом через mmap файлы старой версии остаются доступны
+        old_dir = None
+        if os.path.exists(reviews_dir):
+            old_dir = tempfile.mkdtemp(prefix='.old-', dir=parent)
+            os.rename(reviews_dir, os.path.join(old_dir, 'reviews'))
+        os.rename(build_dir, reviews_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+class ReviewIndex:
+    # Хеши ссылок по возрастанию, смещения блоков отзывов (на один больше, чем врачей) и статистика врачей
+    _ARRAYS = ('keys', 'offsets', 'count', 'rate', 'histogram', 'recent_rate', 'last_date')
+
+    def __init__(self, keys, offsets, count, rate, histogram, recent_rate, last_date, data=b'', version=None,
+                 search=None):
+        self.keys = keys
+        self.offsets = offsets
+        self.count = count
+        self.rate = rate
+        self.histogram = histogram
+        self.recent_rate = recent_rate
+        self.last_date = last_date
+        self.data = data
+        self.version = version
+        self.search = search
+        self._row_positions = {}
+
+    @classmethod
+    def empty_arrays(cls):
+        return {
+            'keys': np.empty(0, dtype=np.uint64),
+            'offsets': np.zeros(1, dtype=np.int64),
+            'count': np.empty(0, dtype=np.int32),
+            'rate': np.empty(0, dtype=np.float32),
+            'histogram': np.empty((0, RATE_BINS), dtype=np.int32),
+            'recent_rate': np.empty(0, dtype=np.float32),
+            'last_date': np.empty(0, dtype='datetime64[D]'),
+        }
+
+    @classmethod
+    def open(cls, reviews_dir):
+        with open(os.path.join(reviews_dir, META_FILE), encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('format') != REVIEWS_FORMAT:
+            raise ValueError(f"Индекс отзывов {reviews_dir} другого формата, пересоберите его")
+
+        arrays = {name: np.load(os.path.join(reviews_dir, f'{name}.npy'), mmap_mode='r') for name in cls._ARRAYS}
+        data = b''
+        with open(os.path.join(reviews_dir, REVIEWS_FILE), 'rb') as reviews_file:
+            if os.fstat(reviews_file.fileno()).st_size:
+                # mmap остаётся открытым и после закрытия файла
+                data = mmap.mmap(reviews_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(**arrays, data=data, version=meta['version'], search=ReviewSearch.open(reviews_dir))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, link):
+        if not isinstance(link, str) or not link.strip():
+            return -1
+        key = link_keys([link])[0]
+        position = int(np.searchsorted(self.keys, key))
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return -1
+
+    def row_positions(self, snapshot):
+        # Позиции врачей строк снимка по ссылкам сбера и продокторов (-1 - нет отзывов), считаются раз на версию
+        positions = self._row_positions.get(snapshot.version)
+        if positions is None:
+            positions = np.full((len(snapshot.df), 2), -1, dtype=np.int32)
+            for i, column in enumerate(('link_sber', 'link_prod')):
+                if column not in snapshot.df.columns or not len(self.keys):
+                    continue
+                links = snapshot.df[column]
+                keys = link_keys(links)
+                found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+                matched = (self.keys[found] == keys) & links.notna().to_numpy()
+                positions[matched, i] = found[matched]
+            positions.flags.writeable = False
+            self._row_positions = {snapshot.version: positions}
+        return positions
+
+    def stats(self, link):
+        position = self.find(link)
+        if position < 0:
+            return None
+        last_date = self.last_date[position]
+        return ReviewStats(
+            int(self.count[position]),
+            float(self.rate[position]),
+            tuple(int(count) for count in self.histogram[position]),
+            float(self.recent_rate[position]),
+            None if np.isnat(last_date) else str(last_date),
+        )
+
+    def latest(self, link, n=LATEST_REVIEWS):
+        position = self.find(link)
+        if position < 0:
+            return []
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        # Отзывы в блоке уже от новых к старым: читаем только первые n строк
+        reviews = []
+        while start < end and len(reviews) < n:
+            line_end = self.data.find(b'\n', start, end)
+            if line_end < 0:
+                line_end = end
+            reviews.append(json.loads(self.data[start:line_end]))
+            start = line_end + 1
+        return reviews
+
+
+def reviews_dir():
+    return os.getenv('REVIEWS_DIR', DEFAULT_REVIEWS_DIR)
+
+
+# Индекс отзывов открывается один раз на процесс и переоткрывается, когда сборка подменила каталог
+_opened = {'stamp': None, 'index': None}
+_open_lock = threading.Lock()
+
+
+def review_index():
+    directory = reviews_dir()
+    try:
+        stat = os.stat(os.path.join(directory, META_FILE))
+    except FileNotFoundError:
+        return None
+    stamp = (directory, stat.st_ino, stat.st_mtime_ns)
+    if stamp == _opened['stamp']:
+        return _opened['index']
+
+    with _open_lock:
+        if stamp != _opened['stamp']:
+            try:
+                _opened['index'] = ReviewIndex.open(directory)
+            except (OSError, ValueError) as e:
+                print(f"Не удалось открыть индекс отзывов {directory}: {e}")
+                _opened['index'] = None
+            _opened['stamp'] = stamp
+    return _opened['index']
+
+
+def doctor_reviews(index, row, n=LATEST_REVIEWS):
+    # Статистика и последние отзывы врача по ссылкам обоих источников
+    if index is None:
+        return []
+    found = []
+    for label, column in (('СберЗдоровье', 'link_sber'), ('ПроДокторов', 'link_prod')):
+        link = row[column] if column in row else None
+        stats = index.stats(link) if isinstance(link, str) else None
+        if stats is not None:
+            found.append((label, stats, index.latest(link, n)))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Индекс отзывов о врачах для бота')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='собрать индекс из doctors_review.csv')
+    build.add_argument('reviews_file')
+    build.add_argument('reviews_dir', nargs='?', default=DEFAULT_REVIEWS_DIR)
+    build.add_argument('--stats', default=None, help='куда записать статистику врачей, например review_stat.csv')
+    build.add_argument('--buckets', type=int, default=DEFAULT_BUCKETS, help='на сколько корзин делить отзывы')
+
+    show = subparsers.add_parser('show', help='статистика и последние отзывы врача')
+    show.add_argument('doctor_link')
+    show.add_argument('reviews_dir', nargs='?', default=DEFAULT_REVIEWS_DIR)
+    show.add_argument('-n', type=int, default=LATEST_REVIEWS)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        started = time.perf_counter()
+        meta = build_reviews(args.reviews_file, args.reviews_dir, args.stats, args.buckets)
+        print(f"Индекс отзывов {args.reviews_dir}: {meta['reviews']} отзывов, {meta['doctors']} врачей, "
+              f"собран за {time.perf_counter() - started:.1f} с")
+    else:
+        index = ReviewIndex.open(args.reviews_dir)
+        started = time.perf_counter()
+        stats = index.stats(args.doctor_link)
+        latest = index.latest(args.doctor_link, args.n)
+        elapsed = (time.perf_counter() - started) * 1000
+        if stats is None:
+            print("Отзывов по этой ссылке нет")
+            return
+        print(stats)
+        for review in latest:
+            print(json.dumps(review, ensure_ascii=False))
+        print(f"{elapsed:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import numpy as np
+
+from indexes import EMPTY_IDS, canonical_station, intersect_postings, normalize_text
+from rendering import RESULTS_PER_PAGE
+from reviews import review_index
+
+# Сколько результатов упорядочивать заранее: первая страница и следующая.
+# Остальные упорядочиваются, когда пользователь до них долистает (rank_results)
+RANKED_AHEAD = RESULTS_PER_PAGE * 2
+
+NEARBY_RADIUS_KM = 3.0
+NEARBY_LIMIT = 50
+# Вес близости, остальное - оценка цена/качество
+NEARBY_DISTANCE_WEIGHT = 0.5
+
+
+def rank_results(snapshot, row_ids, ranked=0, upto=RANKED_AHEAD):
+    # Первые ranked строк уже по порядку; дотягиваем упорядоченную часть до upto частичной сортировкой
+    if upto <= ranked or ranked >= len(row_ids):
+        return row_ids
+    rest = snapshot.quality_scores.top(row_ids[ranked:], upto - ranked)
+    return np.concatenate((row_ids[:ranked], rest)) if ranked else rest
+
+
+def name_query_key(name):
+    # Поиск по ФИО видит только нормализованную строку: регистр, "ё" и пробелы не важны
+    return 'name', normalize_text(name)
+
+
+def speciality_query_key(speciality, metro=None):
+    # Ключ считается в обработчике, до пула, поэтому только по тексту запроса, без поиска по индексам:
+    # регистр, "ё" и пробелы не важны, у станции - "м.", скобки и т.п. "Кардиолог, м. Сокол" и "кардиолог, сокол" - один запрос
+    station = canonical_station(metro) if metro and metro.strip() else None
+    return 'speciality', normalize_text(speciality), station
+
+
+def find_by_name(snapshot, name):
+    if snapshot.empty:
+        return EMPTY_IDS, "empty_df"
+
+    exact_ids = snapshot.name_index.find_exact(name)
+    if len(exact_ids):
+        return exact_ids, "exact"
+
+    partial_ids = snapshot.name_index.find_partial(name)
+    if len(partial_ids):
+        return rank_results(snapshot, partial_ids), "partial"
+
+    similar_ids = snapshot.name_index.find_similar(name)
+    if len(similar_ids):
+        return similar_ids, "similar"
+
+    return EMPTY_IDS, "not_found"
+
+
+def find_by_speciality_and_metro(snapshot, speciality, metro=None):
+    if snapshot.empty:
+        return EMPTY_IDS
+
+    # Без специальности (", Сокол") ищутся все врачи у станции, как и раньше
+    if speciality and speciality.strip():
+        row_ids = snapshot.speciality_index.find(speciality)
+        if metro and metro.strip():
+            row_ids = intersect_postings([row_ids, snapshot.metro_index.find(metro)])
+    elif metro and metro.strip():
+        row_ids = snapshot.metro_index.find(metro)
+    else:
+        row_ids = snapshot.all_ids
+
+    return rank_results(snapshot, row_ids)
+
+
+def suggest_metro(snapshot, metro):
+    if not metro or not metro.strip():
+        return None
+    return snapshot.metro_index.suggest(metro)
+
+
+def find_nearby(snapshot, latitude, longitude, speciality=None, radius_km=NEARBY_RADIUS_KM, limit=NEARBY_LIMIT):
+    # Врачи с клиникой в радиусе: выше те, кто ближе и с лучшей оценкой цена/качество
+    row_ids, distances = snapshot.geo_index.rows_within(latitude, longitude, radius_km)
+
+    if speciality and speciality.strip() and len(row_ids):
+        matched = np.isin(row_ids, snapshot.speciality_index.find(speciality), assume_unique=True)
+        row_ids, distances = row_ids[matched], distances[matched]
+    if not len(row_ids):
+        return EMPTY_IDS, np.empty(0)
+
+    proximity = 1 - distances / max(radius_km, 1e-9)
+    quality = snapshot.quality_scores.score[row_ids]
+    scores = NEARBY_DISTANCE_WEIGHT * proximity + (1 - NEARBY_DISTANCE_WEIGHT) * quality
+    if len(scores) > limit:
+        top = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.lexsort((distances[top], -scores[top]))]
+    return row_ids[top], distances[top]
+
+
+def find_by_reviews(snapshot, speciality, query):
+    # Врачи специальности по соответствию отзывов запросу (BM25); у врача с отзывами на обоих сайтах
+    # берётся лучший из двух. None - индекс отзывов не собран
+    index = review_index()
+    if index is None or index.search is None:
+        return None
+    if snapshot.empty:
+        return EMPTY_IDS
+
+    scores = index.search.score(query)
+    if scores is None:
+        return EMPTY_IDS
+    row_ids = snapshot.speciality_index.find(speciality) if speciality else snapshot.all_ids
+    positions = index.row_positions(snapshot)[row_ids]
+    row_scores = np.where(positions >= 0, scores[np.maximum(positions, 0)], 0).max(axis=1)
+
+    matched = row_scores > 0
+    row_ids, row_scores = row_ids[matched], row_scores[matched]
+    order = np.lexsort((-snapshot.quality_scores.score[row_ids], -row_scores))
+    return row_ids[order]
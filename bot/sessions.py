@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MAX_USERS = 10000
+DEFAULT_TTL = 60 * 60
+
+
+class Session:
+    __slots__ = ('row_ids', 'current_page', 'updated', 'version', 'ranked')
+
+    def __init__(self, row_ids, current_page=0, updated=None, version=None, ranked=None):
+        self.row_ids = row_ids
+        self.current_page = current_page
+        self.updated = time.time() if updated is None else updated
+        self.version = version
+        # Сколько первых строк уже упорядочено, дальше порядок досчитывается при листании
+        self.ranked = len(row_ids) if ranked is None else ranked
+
+    def __len__(self):
+        return len(self.row_ids)
+
+
+def as_row_ids(row_ids):
+    # Для готового int32-массива копия не делается, так что общий массив (например, "все врачи")
+    # разделяется между сессиями
+    return np.ascontiguousarray(row_ids, dtype=np.int32)
+
+
+class SessionStore:
+    # Последние результаты поиска пользователей: только номера строк и текущая страница.
+    # Вытесняются давно не использованные (LRU) и устаревшие (TTL) сессии
+    def __init__(self, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, user_id, row_ids, version=None, ranked=None):
+        now = time.time()
+        with self._lock:
+            self._sessions[user_id] = Session(as_row_ids(row_ids), 0, now, version, ranked)
+            self._sessions.move_to_end(user_id)
+            self._evict(now)
+
+    def get(self, user_id):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None:
+                return None
+            if now - session.updated > self.ttl:
+                del self._sessions[user_id]
+                self.evictions += 1
+                return None
+            session.updated = now
+            self._sessions.move_to_end(user_id)
+            return session
+
+    def set_page(self, user_id, page):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                session.current_page = page
+
+    def set_ranking(self, user_id, row_ids, ranked):
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None and len(session.row_ids) == len(row_ids):
+                session.row_ids = as_row_ids(row_ids)
+                session.ranked = ranked
+
+    def _evict(self, now):
+        # Сессии упорядочены по времени последнего обращения - старые всегда в начале
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_users and now - session.updated <= self.ttl:
+                break
+            del self._sessions[user_id]
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SqliteSessionStore:
+    # Тот же интерфейс, но сессии лежат в SQLite: переживают перезапуск
+    # и доступны нескольким процессам бота одновременно
+    def __init__(self, path, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_users = max_users
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'user_id INTEGER PRIMARY KEY, row_ids BLOB NOT NULL, current_page INTEGER NOT NULL, updated REAL NOT NULL, '
+            'version TEXT, ranked INTEGER)'
+        )
+        columns = {row[1] for row in self._connection.execute('PRAGMA table_info(sessions)')}
+        if 'version' not in columns:
+            self._connection.execute('ALTER TABLE sessions ADD COLUMN version TEXT')
+        if 'ranked' not in columns:
+            self._connection.execute('ALTER TABLE sessions ADD COLUMN ranked INTEGER')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)')
+
+    @property
+    def connection(self):
+        # Соединение SQLite нельзя использовать после fork: процесс webhook-бота открывает своё
+        if self._pid != os.getpid():
+            self._connect()
+        return self._connection
+
+    def save(self, user_id, row_ids, version=None, ranked=None):
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO sessions (user_id, row_ids, current_page, updated, version, ranked) '
+                'VALUES (?, ?, 0, ?, ?, ?)',
+                (user_id, as_row_ids(row_ids).tobytes(), now, version, ranked)
+            )
+            self._evict(now)
+
+    def get(self, user_id):
+        now = time.time()
+        with self._lock:
+            found = self.connection.execute(
+                'SELECT row_ids, current_page, updated, version, ranked FROM sessions WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if found is None:
+                return None
+            row_ids, current_page, updated, version, ranked = found
+            if now - updated > self.ttl:
+                self.connection.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+                self.evictions += 1
+                return None
+            self.connection.execute('UPDATE sessions SET updated = ? WHERE user_id = ?', (now, user_id))
+        return Session(np.frombuffer(row_ids, dtype=np.int32), current_page, now, version, ranked)
+
+    def set_page(self, user_id, page):
+        with self._lock:
+            self.connection.execute('UPDATE sessions SET current_page = ? WHERE user_id = ?', (page, user_id))
+
+    def set_ranking(self, user_id, row_ids, ranked):
+        with self._lock:
+            self.connection.execute(
+                'UPDATE sessions SET row_ids = ?, ranked = ? WHERE user_id = ? AND length(row_ids) = ?',
+                (as_row_ids(row_ids).tobytes(), ranked, user_id, len(row_ids) * 4)
+            )
+
+    def _evict(self, now):
+        expired = self.connection.execute('DELETE FROM sessions WHERE updated < ?', (now - self.ttl,)).rowcount
+        overflow = self.connection.execute(
+            'DELETE FROM sessions WHERE user_id IN '
+            '(SELECT user_id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)', (self.max_users,)
+        ).rowcount
+        self.evictions += expired + overflow
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def create_session_store():
+    max_users = int(os.getenv('SESSION_MAX_USERS', DEFAULT_MAX_USERS))
+    ttl = float(os.getenv('SESSION_TTL', DEFAULT_TTL))
+    path = os.getenv('SESSION_DB')
+    if path:
+        return SqliteSessionStore(path, max_users, ttl)
+    return SessionStore(max_users, ttl)
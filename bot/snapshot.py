@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from geo import GeoIndex, coordinates_file, read_coordinates
+from indexes import NameIndex, SpecialityIndex, MetroIndex, MarketStats, QualityScores
+from rendering import ResultCards, TextColumn
+from typeahead import TypeaheadIndex
+
+SNAPSHOT_FORMAT = 7
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+KEEP_VERSIONS = 2
+EMPTY_VERSION = 'empty'
+
+INDEXES = (
+    'name_index', 'speciality_index', 'metro_index', 'market_stats', 'quality_scores', 'result_cards', 'geo_index',
+    'typeahead',
+)
+
+
+class Snapshot:
+    # Данные бота одной версии: таблица врачей и все построенные по ней индексы.
+    # Бот подменяет снимок целиком одной ссылкой, поэтому запрос всегда видит согласованные данные
+    def __init__(self, df, name_index, speciality_index, metro_index, market_stats, quality_scores, result_cards,
+                 geo_index, typeahead, version):
+        self.df = df
+        self.name_index = name_index
+        self.speciality_index = speciality_index
+        self.metro_index = metro_index
+        self.market_stats = market_stats
+        self.quality_scores = quality_scores
+        self.result_cards = result_cards
+        self.geo_index = geo_index
+        self.typeahead = typeahead
+        self.version = version
+        self.all_ids = np.arange(len(df), dtype=np.int32)
+        self.all_ids.flags.writeable = False
+
+    @classmethod
+    def build(cls, df, version=EMPTY_VERSION, coordinates=None):
+        df = df.reset_index(drop=True)
+        speciality_index = SpecialityIndex.build(df['speciality'] if 'speciality' in df.columns else [])
+        name_index = NameIndex.build(df['name'] if 'name' in df.columns else [])
+        metro_index = MetroIndex.build(df)
+        quality_scores = QualityScores.build(df, speciality_index)
+        return cls(
+            df,
+            name_index,
+            speciality_index,
+            metro_index,
+            MarketStats.build(df, speciality_index),
+            quality_scores,
+            ResultCards.build(df),
+            GeoIndex.build(df, coordinates),
+            TypeaheadIndex.build(df, name_index, speciality_index, metro_index, quality_scores),
+            version,
+        )
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+
+def source_version(path, coordinates_path=None):
+    # Координаты клиник входят в версию: новый файл геокодинга - новый снимок
+    digest = hashlib.sha1()
+    for file_path in (path, coordinates_path):
+        if not file_path or not os.path.exists(file_path):
+            continue
+        with open(file_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def source_stamp(path, coordinates_path=None):
+    stat = os.stat(path)
+    stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'coordinates': None}
+    if coordinates_path and os.path.exists(coordinates_path):
+        stat = os.stat(coordinates_path)
+        stamp['coordinates'] = {'path': os.path.abspath(coordinates_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return stamp
+
+
+def _json_text(value):
+    # Значения, которые не строки и не числа: списки специальностей из parquet (массивы numpy),
+    # флаги с пропусками. Пропуск - None, он кодируется как -1
+    if isinstance(value, (np.ndarray, np.generic)):
+        value = value.tolist()
+    elif not isinstance(value, (list, tuple, dict, str)) and pd.isna(value):
+        return None
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def _save_codes(directory, position, values):
+    # Значения кодируются словарём (адреса, клиники и метро сильно повторяются),
+    # сам словарь - строки UTF-8 одним буфером со смещениями, как в ResultCards
+    codes, categories = pd.factorize(values)
+    np.save(os.path.join(directory, f'column.{position}.codes.npy'), codes.astype(np.int32))
+    for key, array in TextColumn.build(categories.tolist()).to_arrays('values').items():
+        np.save(os.path.join(directory, f'column.{position}.{key}.npy'), array)
+
+
+def _save_column(directory, position, series):
+    values = series.to_numpy()
+    if values.dtype.kind in 'biuf':
+        np.save(os.path.join(directory, f'column.{position}.npy'), values)
+        return 'numeric'
+
+    if all(isinstance(value, str) for value in series.dropna()):
+        _save_codes(directory, position, series)
+        return 'string'
+
+    _save_codes(directory, position, pd.Series([_json_text(value) for value in values], dtype=object))
+    return 'json'
+
+
+def _load_column(directory, position, kind):
+    if kind == 'numeric':
+        # Остаётся отображением файла: DataFrame собирается без копирования (copy=False)
+        return np.load(os.path.join(directory, f'column.{position}.npy'), mmap_mode='r')
+
+    codes = np.load(os.path.join(directory, f'column.{position}.codes.npy'), mmap_mode='r')
+    arrays = {
+        f'values.{key}': np.load(os.path.join(directory, f'column.{position}.values.{key}.npy'), mmap_mode='r')
+        for key in ('offsets', 'data')
+    }
+    categories = TextColumn.from_arrays(arrays, 'values').tolist()
+    values = np.empty(len(categories) + 1, dtype=object)
+    if kind == 'string':
+        values[:-1] = categories
+    else:
+        # Поэлементно: список в массив object целиком numpy разложил бы по измерениям
+        for code, text in enumerate(categories):
+            values[code] = json.loads(text)
+    values[-1] = np.nan
+    return values[codes]
+
+
+def read_meta(snapshot_dir, version=None):
+    try:
+        if version is None:
+            with open(os.path.join(snapshot_dir, CURRENT_FILE), encoding='utf-8') as current:
+                version = current.read().strip()
+        with open(os.path.join(snapshot_dir, version, META_FILE), encoding='utf-8') as meta:
+            meta = json.load(meta)
+    except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+        return None
+    return meta if meta.get('format') == SNAPSHOT_FORMAT else None
+
+
+def write_snapshot(snapshot, snapshot_dir, source=None):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    target = os.path.join(snapshot_dir, snapshot.version)
+
+    if read_meta(snapshot_dir, snapshot.version) is None:
+        # Собираем во временном каталоге и переименовываем: читатель не увидит снимок наполовину
+        build_dir = tempfile.mkdtemp(prefix='.build-', dir=snapshot_dir)
+        try:
+            columns = [
+                {'name': column, 'kind': _save_column(build_dir, position, snapshot.df[column])}
+                for position, column in enumerate(snapshot.df.columns)
+            ]
+            for index_name in INDEXES:
+                for key, array in getattr(snapshot, index_name).to_arrays().items():
+                    np.save(os.path.join(build_dir, f'{index_name}.{key}.npy'), np.asarray(array))
+
+            meta = {
+                'format': SNAPSHOT_FORMAT,
+                'version': snapshot.version,
+                'rows': len(snapshot.df),
+                'columns': columns,
+                'source': source,
+                'created': time.time(),
+            }
+            with open(os.path.join(build_dir, META_FILE), 'w', encoding='utf-8') as meta_file:
+                json.dump(meta, meta_file, ensure_ascii=False, indent=2)
+
+            if os.path.isdir(target) and read_meta(snapshot_dir, snapshot.version) is None:
+                # Снимок той же версии в старом формате: открытые через mmap файлы останутся доступны
+                shutil.rmtree(target, ignore_errors=True)
+            os.rename(build_dir, target)
+        except OSError:
+            # Тот же снимок мог собрать параллельно другой процесс бота
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if read_meta(snapshot_dir, snapshot.version) is None:
+                raise
+        except Exception:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+    elif source is not None:
+        _update_source(snapshot_dir, snapshot.version, source)
+
+    current_tmp = os.path.join(snapshot_dir, f'.{CURRENT_FILE}.{os.getpid()}')
+    with open(current_tmp, 'w', encoding='utf-8') as current:
+        current.write(snapshot.version)
+    os.replace(current_tmp, os.path.join(snapshot_dir, CURRENT_FILE))
+
+    _remove_old_versions(snapshot_dir, snapshot.version)
+
+
+def _update_source(snapshot_dir, version, source):
+    meta = read_meta(snapshot_dir, version)
+    meta['source'] = source
+    meta_tmp = os.path.join(snapshot_dir, version, f'.{META_FILE}.{os.getpid()}')
+    with open(meta_tmp, 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file, ensure_ascii=False, indent=2)
+    os.replace(meta_tmp, os.path.join(snapshot_dir, version, META_FILE))
+
+
+def _remove_old_versions(snapshot_dir, current_version):
+    versions = [
+        entry for entry in os.scandir(snapshot_dir)
+        if entry.is_dir() and not entry.name.startswith('.') and entry.name != current_version
+    ]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    # Уже открытые через mmap файлы остаются доступны процессам и после удаления
+    for entry in versions[KEEP_VERSIONS - 1:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_snapshot(snapshot_dir, version=None):
+    meta = read_meta(snapshot_dir, version)
+    if meta is None:
+        raise FileNotFoundError(f"Снимок данных в {snapshot_dir} не найден")
+
+    directory = os.path.join(snapshot_dir, meta['version'])
+    df = pd.DataFrame({
+        column['name']: _load_column(directory, position, column['kind'])
+        for position, column in enumerate(meta['columns'])
+    }, columns=[column['name'] for column in meta['columns']], copy=False)
+
+    arrays = {index_name: {} for index_name in INDEXES}
+    for file_name in os.listdir(directory):
+        index_name, _, key = file_name[:-len('.npy')].partition('.')
+        if index_name in arrays and file_name.endswith('.npy'):
+            arrays[index_name][key] = np.load(os.path.join(directory, file_name), mmap_mode='r')
+
+    speciality_index = SpecialityIndex.from_arrays(arrays['speciality_index'])
+    return Snapshot(
+        df,
+        NameIndex.from_arrays(arrays['name_index']),
+        speciality_index,
+        MetroIndex.from_arrays(arrays['metro_index']),
+        MarketStats.from_arrays(arrays['market_stats'], speciality_index),
+        QualityScores.from_arrays(arrays['quality_scores']),
+        ResultCards.from_arrays(arrays['result_cards']),
+        GeoIndex.from_arrays(arrays['geo_index']),
+        TypeaheadIndex.from_arrays(arrays['typeahead']),
+        meta['version'],
+    )
+
+
+def read_data(data_file):
+    # data.parquet из eda/merge/merge_datasets.py хранит speciality списком, csv - строкой "['...']"
+    if data_file.endswith('.parquet'):
+        return pd.read_parquet(data_file)
+    return pd.read_csv(data_file)
+
+
+def build_snapshot(data_file, snapshot_dir=None, coordinates_path=None):
+    coordinates_path = coordinates_path or coordinates_file()
+    stamp = source_stamp(data_file, coordinates_path)
+    snapshot = Snapshot.build(
+        read_data(data_file), source_version(data_file, coordinates_path), read_coordinates(coordinates_path)
+    )
+    if snapshot_dir:
+        write_snapshot(snapshot, snapshot_dir, source={'path': os.path.abspath(data_file), **stamp})
+    return snapshot
+
+
+def load_or_build_snapshot(data_file, snapshot_dir=None, coordinates_path=None):
+    coordinates_path = coordinates_path or coordinates_file()
+    if not snapshot_dir:
+        return build_snapshot(data_file, coordinates_path=coordinates_path)
+
+    meta = read_meta(snapshot_dir)
+    if meta is not None:
+        if not os.path.exists(data_file):
+            return load_snapshot(snapshot_dir)
+
+        # Быстрая проверка по размеру и времени изменения, хеш считаем только если они разошлись
+        source = meta.get('source') or {}
+        stamp = source_stamp(data_file, coordinates_path)
+        if all(source.get(key) == stamp[key] for key in ('size', 'mtime_ns', 'coordinates')):
+            return load_snapshot(snapshot_dir)
+        if meta['version'] == source_version(data_file, coordinates_path):
+            _update_source(snapshot_dir, meta['version'], {'path': os.path.abspath(data_file), **stamp})
+            return load_snapshot(snapshot_dir)
+
+    build_snapshot(data_file, snapshot_dir, coordinates_path)
+    return load_snapshot(snapshot_dir)
+
+
+class SnapshotWatcher(threading.Thread):
+    # Следит за исходным csv и указателем на текущий снимок, при изменении перезагружает данные бота.
+    # Запросы, начатые на старом снимке, дорабатывают на нём же
+    def __init__(self, bot, interval):
+        super().__init__(name='snapshot-watcher', daemon=True)
+        self.bot = bot
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def _stamp(self):
+        paths = [self.bot.data_file, coordinates_file()]
+        if self.bot.snapshot_dir:
+            paths.append(os.path.join(self.bot.snapshot_dir, CURRENT_FILE))
+        stamps = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def run(self):
+        applied = self._stamp()
+        pending = None
+        while not self._stop_event.wait(self.interval):
+            stamp = self._stamp()
+            if stamp == applied:
+                pending = None
+                continue
+            # Ждём ещё один интервал без изменений, чтобы не читать недописанный файл
+            if stamp != pending:
+                pending = stamp
+                continue
+            self.bot.reload_data()
+            applied = stamp
+            pending = None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка снимка данных для бота')
+    parser.add_argument('data_file', nargs='?', default='data.csv')
+    parser.add_argument('snapshot_dir', nargs='?', default='snapshot')
+    parser.add_argument('--coordinates', default=None, help='координаты клиник, по умолчанию GEO_ADDRESSES')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    snapshot = build_snapshot(args.data_file, args.snapshot_dir, args.coordinates)
+    print(f"Снимок {snapshot.version} ({len(snapshot.df)} строк, {len(snapshot.geo_index)} точек клиник) "
+          f"собран за {time.perf_counter() - started:.2f} с")
+
+    started = time.perf_counter()
+    load_snapshot(args.snapshot_dir)
+    print(f"Загрузка снимка: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import numpy as np
+
+from indexes import EMPTY_IDS, clean_station, normalize_text, numeric_column, word_starts
+
+# Подсказки для inline-режима: ФИО врачей и специальности до запятой, станции метро после неё.
+# Ключи отсортированы, подходящие под префикс - непрерывный отрезок (searchsorted). Для коротких
+# префиксов отрезок большой, поэтому для каждого префикса, под который подходит больше PRECOMPUTE_ABOVE
+# ключей, лучшие TOP_K вариантов посчитаны заранее; для остальных отрезок короткий и выбирается на лету
+
+TOP_K = 10
+PRECOMPUTE_ABOVE = 64
+
+SPECIALITY, STATION, DOCTOR = 0, 1, 2
+
+_LAST_CHAR = '\U0010ffff'
+
+
+class PrefixIndex:
+    # keys[i] -> вариант key_entries[i]; у варианта может быть несколько ключей ("детский кардиолог" и "кардиолог").
+    # entity_rank - место варианта в выдаче, prefixes/prefix_offsets/prefix_entries - заранее посчитанные ответы
+    _ARRAYS = ('keys', 'key_entries', 'entity_rank', 'prefixes', 'prefix_offsets', 'prefix_entries')
+
+    def __init__(self, keys, key_entries, entity_rank, prefixes, prefix_offsets, prefix_entries):
+        self.keys = keys
+        self.key_entries = key_entries
+        self.entity_rank = entity_rank
+        self.prefixes = prefixes
+        self.prefix_offsets = prefix_offsets
+        self.prefix_entries = prefix_entries
+        self._prefix_slots = {prefix: slot for slot, prefix in enumerate(prefixes.tolist())}
+
+    @classmethod
+    def build(cls, keys, key_entries, entity_rank, k=TOP_K, threshold=PRECOMPUTE_ABOVE):
+        keys = np.array(keys, dtype=str)
+        key_entries = np.asarray(key_entries, dtype=np.int32)
+        order = np.argsort(keys, kind='stable')
+        keys, key_entries = keys[order], key_entries[order]
+        entity_rank = np.asarray(entity_rank, dtype=np.int32)
+
+        prefixes, lists = [], []
+        lengths = np.char.str_len(keys) if len(keys) else np.empty(0, dtype=np.int64)
+        active = np.arange(len(keys))
+        length = 0
+        # Префиксы по возрастанию длины: у большого отрезка все более короткие префиксы тоже большие,
+        # так что на следующей длине достаточно смотреть только ключи из больших отрезков
+        while len(active) > threshold:
+            active = active[lengths[active] >= length]
+            group_keys = np.array([key[:length] for key in keys[active].tolist()], dtype=str)
+            starts = np.flatnonzero(np.r_[True, group_keys[1:] != group_keys[:-1]]) if len(active) else active
+            sizes = np.diff(np.append(starts, len(active)))
+            large = sizes > threshold
+            if not large.any():
+                break
+
+            group = np.repeat(np.arange(len(starts)), sizes)
+            keep = large[group]
+            active, group = active[keep], group[keep]
+            entries = key_entries[active]
+            # Лучшие варианты в каждом большом отрезке: сортировка по (отрезок, место), без повторов варианта
+            by_rank = np.lexsort((entries, entity_rank[entries], group))
+            pairs = np.stack((group[by_rank], entries[by_rank]))
+            distinct = np.r_[True, (pairs[:, 1:] != pairs[:, :-1]).any(axis=0)]
+            group_sorted, entries_sorted = pairs[0, distinct], pairs[1, distinct]
+            first = np.searchsorted(group_sorted, group_sorted)
+            top = np.arange(len(group_sorted)) - first < k
+            group_ids = np.unique(group_sorted)
+            top_groups, top_entries = group_sorted[top], entries_sorted[top]
+            for group_id, entries in zip(group_ids, np.split(top_entries, np.searchsorted(top_groups, group_ids)[1:])):
+                prefixes.append(group_keys[starts[group_id]])
+                lists.append(entries)
+            length += 1
+
+        prefixes = np.array(prefixes, dtype=str)
+        order = np.argsort(prefixes, kind='stable')
+        lists = [lists[i] for i in order]
+        prefix_offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(entries) for entries in lists], out=prefix_offsets[1:])
+        prefix_entries = np.concatenate(lists).astype(np.int32) if lists else EMPTY_IDS
+        return cls(keys, key_entries, entity_rank, prefixes[order], prefix_offsets, prefix_entries)
+
+    def to_arrays(self, prefix):
+        return {f'{prefix}.{name}': getattr(self, name) for name in self._ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(*(arrays[f'{prefix}.{name}'] for name in cls._ARRAYS))
+
+    def complete(self, query, k=TOP_K):
+        prefix = normalize_text(query)
+        slot = self._prefix_slots.get(prefix)
+        if slot is not None:
+            return self.prefix_entries[self.prefix_offsets[slot]:self.prefix_offsets[slot + 1]][:k]
+
+        start, end = np.searchsorted(self.keys, [prefix, prefix + _LAST_CHAR])
+        if start == end:
+            return EMPTY_IDS
+        entries = np.unique(self.key_entries[start:end])
+        ranks = self.entity_rank[entries]
+        if len(entries) > k:
+            top = np.argpartition(ranks, k - 1)[:k]
+            entries, ranks = entries[top], ranks[top]
+        return entries[np.argsort(ranks, kind='stable')]
+
+
+class TypeaheadIndex:
+    # Варианты до запятой: сначала специальности (больше врачей - выше), потом врачи по рейтингу.
+    # entity_kinds/entity_refs: что это за вариант и его номер (специальность, станция или строка таблицы)
+    def __init__(self, names, stations, entity_kinds, entity_refs, entity_counts):
+        self.names = names
+        self.stations = stations
+        self.entity_kinds = entity_kinds
+        self.entity_refs = entity_refs
+        self.entity_counts = entity_counts
+
+    @classmethod
+    def build(cls, df, name_index, speciality_index, metro_index, quality_scores):
+        tokens = speciality_index.tokens.tolist()
+        stations = metro_index.stations.tolist()
+        n_rows = len(df)
+
+        speciality_counts = np.diff(speciality_index.postings.offsets)
+        station_counts = np.diff(metro_index.postings.offsets)
+        entity_kinds = np.concatenate((
+            np.full(len(tokens), SPECIALITY), np.full(len(stations), STATION), np.full(n_rows, DOCTOR)
+        )).astype(np.int8)
+        entity_refs = np.concatenate((
+            np.arange(len(tokens)), np.arange(len(stations)), np.arange(n_rows)
+        )).astype(np.int32)
+        entity_counts = np.concatenate((speciality_counts, station_counts, np.zeros(n_rows, dtype=np.int64)))
+
+        # Место в выдаче: специальности и станции по числу врачей, врачи по рейтингу, при равном - по цена/качество
+        rating = numeric_column(df, 'rating')
+        doctor_order = np.lexsort((quality_scores.rank, np.isnan(rating), -np.nan_to_num(rating)))
+        order = np.concatenate((
+            np.argsort(-speciality_counts, kind='stable'),
+            len(tokens) + np.argsort(-station_counts, kind='stable'),
+            len(tokens) + len(stations) + doctor_order,
+        ))
+        entity_rank = np.empty(len(order), dtype=np.int32)
+        entity_rank[order] = np.arange(len(order), dtype=np.int32)
+
+        name_keys, name_entries = [], []
+        for token_id, token in enumerate(tokens):
+            for key in word_starts(token):
+                name_keys.append(key)
+                name_entries.append(token_id)
+        offset = len(tokens) + len(stations)
+        for row_id, name in enumerate(name_index.names):
+            if name:
+                name_keys.append(name)
+                name_entries.append(offset + row_id)
+
+        return cls(
+            PrefixIndex.build(name_keys, name_entries, entity_rank),
+            PrefixIndex.build(stations, len(tokens) + np.arange(len(stations)), entity_rank),
+            entity_kinds, entity_refs, entity_counts,
+        )
+
+    def to_arrays(self):
+        return {
+            **self.names.to_arrays('names'),
+            **self.stations.to_arrays('stations'),
+            'entity_kinds': self.entity_kinds,
+            'entity_refs': self.entity_refs,
+            'entity_counts': self.entity_counts,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            PrefixIndex.from_arrays(arrays, 'names'), PrefixIndex.from_arrays(arrays, 'stations'),
+            arrays['entity_kinds'], arrays['entity_refs'], arrays['entity_counts'],
+        )
+
+    def complete(self, query, k=TOP_K):
+        # "кардио" -> специальности и врачи; "кардиолог, нов" -> станции, специальность остаётся как есть
+        # (пустая для ", нов": тогда ищутся все врачи у станции)
+        speciality, comma, station = query.partition(',')
+        if comma:
+            # Станции в индексе хранятся как у MetroIndex: без "м.", "ст." и т.п.
+            return speciality.strip(), self.stations.complete(clean_station(station), k)
+        return None, self.names.complete(speciality, k)
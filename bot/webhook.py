@@ -0,0 +1,203 @@
+import asyncio
+import hmac
+import json
+import os
+import signal
+import socket
+
+from telegram import Update
+
+MAX_BODY_SIZE = 1 << 20
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+}
+
+
+async def _serve_connection(handler, reader, writer):
+    # Минимальный HTTP/1.1 с keep-alive: Telegram и стенд шлют только POST с Content-Length
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length') or 0)
+            if length > MAX_BODY_SIZE:
+                status, content_type, body = 413, 'text/plain', b''
+                keep_alive = False
+            else:
+                request_body = await reader.readexactly(length) if length else b''
+                try:
+                    status, content_type, body = await handler(method, path.split('?', 1)[0], headers, request_body)
+                except Exception as e:
+                    print(f"Ошибка при обработке запроса {method} {path}: {e}")
+                    status, content_type, body = 500, 'text/plain', b''
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+        # Клиент отключился или сервер останавливается с открытыми keep-alive соединениями
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(handler, host, port, reuse_port=False):
+    # handler(method, path, headers, body) -> (status, content_type, body)
+    return await asyncio.start_server(
+        lambda reader, writer: _serve_connection(handler, reader, writer),
+        host, port, reuse_port=reuse_port, backlog=1024,
+    )
+
+
+class WebhookServer:
+    # Принимает обновления от Telegram и кладёт их в очередь приложения,
+    # ответ 200 уходит сразу, обработка идёт в обработчиках бота
+    def __init__(self, application, url_path='/webhook', secret_token=None, record_file=None):
+        self.application = application
+        self.url_path = '/' + url_path.strip('/')
+        self.secret_token = secret_token
+        self.record_file = record_file
+        self.received = 0
+        self.routes = {}
+
+    async def handle(self, method, path, headers, body):
+        if path in self.routes and method == 'GET':
+            return await self.routes[path]()
+        if path != self.url_path:
+            return 404, 'text/plain', b''
+        if method != 'POST':
+            return 405, 'text/plain', b''
+        if self.secret_token and not hmac.compare_digest(
+            headers.get('x-telegram-bot-api-secret-token', ''), self.secret_token
+        ):
+            return 403, 'text/plain', b''
+
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"Некорректное обновление: {e}")
+            return 400, 'text/plain', b''
+        if update is None:
+            return 400, 'text/plain', b''
+
+        if self.record_file is not None:
+            self.record_file.write(json.dumps(data, ensure_ascii=False) + '\n')
+            self.record_file.flush()
+        self.received += 1
+        await self.application.update_queue.put(update)
+        return 200, 'text/plain', b''
+
+
+async def _run_worker(application, host, port, url_path, secret_token, reuse_port, on_server=None):
+    record_path = os.getenv('WEBHOOK_RECORD')
+    record_file = open(record_path, 'a', encoding='utf-8') if record_path else None
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        webhook_server = WebhookServer(application, url_path, secret_token, record_file)
+        if on_server is not None:
+            on_server(webhook_server)
+        server = await serve_http(webhook_server.handle, host, port, reuse_port)
+        print(f"Процесс {os.getpid()} принимает обновления на {host}:{port}{webhook_server.url_path}")
+
+        await stop_event.wait()
+
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        if record_file is not None:
+            record_file.close()
+
+
+async def _set_webhook(application, webhook_url, secret_token):
+    async with application.bot:
+        await application.bot.set_webhook(webhook_url, secret_token=secret_token, max_connections=100)
+
+
+def run_webhook(build_application, host='0.0.0.0', port=8443, url_path='/webhook', secret_token=None,
+                webhook_url=None, workers=1, before_worker=None, on_server=None):
+    # Несколько процессов слушают один порт (SO_REUSEPORT), ядро распределяет между ними соединения.
+    # build_application вызывается уже в процессе-обработчике; before_worker - для ресурсов,
+    # которые нельзя наследовать через fork (соединения с базой, потоки); ему передаётся номер процесса
+    # (None, если процесс один)
+    if webhook_url:
+        asyncio.run(_set_webhook(build_application(), webhook_url, secret_token))
+        print(f"Webhook установлен: {webhook_url}")
+
+    def worker(index=None):
+        if before_worker is not None:
+            before_worker(index)
+        asyncio.run(_run_worker(build_application(), host, port, url_path, secret_token, workers > 1, on_server))
+
+    if workers <= 1:
+        worker()
+        return
+
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError("Несколько процессов на одном порту требуют SO_REUSEPORT")
+
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                worker(index)
+            except BaseException as e:
+                print(f"Процесс {os.getpid()} завершился с ошибкой: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import itertools
+import json
+import re
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qs
+
+import httpx
+import numpy as np
+
+from webhook import serve_http
+
+# Локальный стенд для webhook-режима без Telegram.
+# 1. Поддельный Bot API: бот запускается с TELEGRAM_API_URL=http://127.0.0.1:<api-port>/bot
+#    и отправляет ответы сюда, а не в api.telegram.org
+# 2. Воспроизведение: записанные обновления (по одному JSON в строке, см. WEBHOOK_RECORD)
+#    отправляются POST-запросами на webhook, задержка считается до первого ответа бота в тот же чат
+#
+#   python webhook_replay.py updates.jsonl --api-port 8081 --webhook-url http://127.0.0.1:8443/webhook
+
+CHAT_METHODS = {'sendmessage', 'sendphoto', 'editmessagetext', 'editmessagecaption', 'senddocument'}
+_MULTIPART_FIELD = re.compile(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', re.DOTALL)
+_API_PATH = re.compile(r'^/bot[^/]*/(\w+)$')
+
+
+def _request_fields(headers, body):
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        return {
+            name.decode(): value.decode('utf-8', 'replace')
+            for name, value in _MULTIPART_FIELD.findall(body)
+            if not value.startswith(b'\xff\xd8')
+        }
+    if content_type.startswith('application/json'):
+        return {key: str(value) for key, value in json.loads(body or b'{}').items()}
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+class FakeBotApi:
+    # Отвечает на методы Bot API правдоподобными объектами и запоминает, когда пришёл ответ в каждый чат
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.waiters = defaultdict(deque)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    def expect_reply(self, key):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[key].append(future)
+        return future
+
+    def _message(self, fields, method):
+        chat_id = int(fields.get('chat_id', 0))
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'replay_bot'},
+        }
+        if method == 'sendphoto':
+            # Если бот прислал file_id, отдаём его же, иначе выдаём новый, как после загрузки
+            file_id = fields.get('photo') or f'replay-photo-{next(self._file_ids)}'
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320}]
+            message['caption'] = fields.get('caption', '')
+        else:
+            message['text'] = fields.get('text', '')
+        return message
+
+    def _replied(self, key):
+        waiters = self.waiters.get(key)
+        if waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(time.perf_counter())
+
+    async def handle(self, method, path, headers, body):
+        match = _API_PATH.match(path)
+        if match is None:
+            return 404, 'application/json', b'{"ok": false, "error_code": 404, "description": "Not Found"}'
+
+        api_method = match.group(1).lower()
+        self.calls[api_method] += 1
+        fields = _request_fields(headers, body)
+
+        if api_method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'replay_bot'}
+        elif api_method in CHAT_METHODS:
+            result = self._message(fields, api_method)
+            self._replied(result['chat']['id'])
+        elif api_method == 'answerinlinequery':
+            # Ответ на inline-запрос приходит не в чат: ждём его по id запроса
+            result = True
+            self._replied(('inline', str(fields.get('inline_query_id'))))
+        else:
+            result = True
+        return 200, 'application/json', json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def read_updates(path):
+    with open(path, encoding='utf-8') as updates:
+        return [json.loads(line) for line in updates if line.strip()]
+
+
+def update_chat_id(update):
+    for key in ('message', 'edited_message'):
+        if key in update:
+            return update[key]['chat']['id']
+    if 'callback_query' in update:
+        message = update['callback_query'].get('message')
+        return message['chat']['id'] if message else update['callback_query']['from']['id']
+    if 'inline_query' in update:
+        return update['inline_query']['from']['id']
+    return None
+
+
+def update_reply_key(update, chat_id):
+    # Куда придёт ответ бота: в чат или, для inline-запроса, в answerInlineQuery с его id
+    if 'inline_query' in update:
+        return ('inline', str(update['inline_query']['id']))
+    return chat_id
+
+
+async def replay(updates, webhook_url, api, secret_token=None, concurrency=50, reply_timeout=5.0):
+    # Обновления одного чата идут по очереди (листание зависит от предыдущего поиска), разные чаты - параллельно
+    by_chat = defaultdict(list)
+    for update in updates:
+        by_chat[update_chat_id(update)].append(update)
+
+    latencies = []
+    errors = 0
+    no_reply = 0
+    slots = asyncio.Semaphore(concurrency)
+    headers = {'Content-Type': 'application/json'}
+    if secret_token:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def run_chat(chat_id, chat_updates):
+            nonlocal errors, no_reply
+            async with slots:
+                for update in chat_updates:
+                    reply = api.expect_reply(update_reply_key(update, chat_id))
+                    started = time.perf_counter()
+                    response = await client.post(webhook_url, content=json.dumps(update), headers=headers)
+                    if response.status_code != 200:
+                        errors += 1
+                        reply.cancel()
+                        continue
+                    try:
+                        replied = await asyncio.wait_for(asyncio.shield(reply), reply_timeout)
+                        latencies.append(replied - started)
+                    except asyncio.TimeoutError:
+                        no_reply += 1
+                        reply.cancel()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_chat(chat_id, chat_updates) for chat_id, chat_updates in by_chat.items()))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'updates': len(updates),
+        'chats': len(by_chat),
+        'elapsed': elapsed,
+        'throughput': len(updates) / elapsed if elapsed else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        'p90_ms': float(np.percentile(latencies, 90) * 1000) if latencies else None,
+        'p99_ms': float(np.percentile(latencies, 99) * 1000) if latencies else None,
+        'no_reply': no_reply,
+        'errors': errors,
+    }
+
+
+async def run(args):
+    api = FakeBotApi()
+    server = await serve_http(api.handle, args.api_host, args.api_port)
+    print(f"Поддельный Bot API: http://{args.api_host}:{args.api_port}/bot")
+
+    if args.updates is None:
+        print("Файл обновлений не указан, стенд только отвечает боту. Ctrl+C для выхода")
+        async with server:
+            await server.serve_forever()
+        return
+
+    if args.wait:
+        print(f"Ждём {args.wait} с, пока бот запустится...")
+        await asyncio.sleep(args.wait)
+
+    updates = read_updates(args.updates) * args.repeat
+    stats = await replay(updates, args.webhook_url, api, args.secret, args.concurrency, args.timeout)
+    server.close()
+
+    print(f"Обновлений: {stats['updates']} в {stats['chats']} чатах за {stats['elapsed']:.2f} с "
+          f"({stats['throughput']:.1f} в секунду)")
+    if stats['p50_ms'] is not None:
+        print(f"Задержка до ответа: p50 {stats['p50_ms']:.1f} мс, p90 {stats['p90_ms']:.1f} мс, p99 {stats['p99_ms']:.1f} мс")
+    print(f"Без ответа: {stats['no_reply']}, ошибок webhook: {stats['errors']}")
+    print(f"Вызовы Bot API: {dict(api.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанных обновлений через webhook без Telegram')
+    parser.add_argument('updates', nargs='?', help='файл с обновлениями, по одному JSON в строке')
+    parser.add_argument('--webhook-url', default='http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret', default=None, help='WEBHOOK_SECRET бота')
+    parser.add_argument('--api-host', default='127.0.0.1')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--concurrency', type=int, default=50, help='сколько чатов отправляют обновления одновременно')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=5.0, help='сколько ждать ответа бота, с')
+    parser.add_argument('--wait', type=float, default=0.0, help='пауза перед отправкой, с')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
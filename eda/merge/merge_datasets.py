@@ -0,0 +1,237 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Объединение датасетов СберЗдоровья и ПроДокторов (то же, что merge_datasets.ipynb), как этап пайплайна:
+#
+#   python merge_datasets.py --output doctors.parquet --reviews-output doctors_review.parquet --chunks 16
+#
+# Входы читаются частями и раскладываются по --chunks файлам по хешу ФИО: все врачи с одним ФИО
+# (и тёзки, и пары сбер/продокторов) оказываются в одной части, поэтому каждая часть объединяется
+# независимо и в памяти держится только она. Результат - parquet с типизированными колонками,
+# speciality в нём - список строк, а не строка "['терапевт', ...]".
+
+PREPARED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preparation-to-merge')
+SBER_FILE = os.path.join(PREPARED_DIR, 'sber_clean.csv')
+SBER_REVIEWS_FILE = os.path.join(PREPARED_DIR, 'sber_reviews_clean.csv')
+PROD_FILE = os.path.join(PREPARED_DIR, 'prodoctorov_clean.csv')
+PROD_REVIEWS_FILE = os.path.join(PREPARED_DIR, 'prodoctorov_reviews_clean.csv')
+
+SOURCES = ('sber', 'prod')
+READ_CHUNK_ROWS = 100_000
+# Разница в стаже больше этой - уже не один и тот же врач
+MAX_EXPERIENCE_DELTA = 10
+
+INTEGER_COLUMNS = ('experience', 'review_count', 'clinics_count')
+FLOAT_COLUMNS = ('price', 'rating')
+BOOLEAN_COLUMNS = ('is_kids', 'is_adults')
+_BOOLEANS = {True: True, False: False, 'True': True, 'False': False, 'true': True, 'false': False}
+
+
+def _base_name(column):
+    for source in SOURCES:
+        if column.endswith(f'_{source}'):
+            return column[:-len(source) - 1]
+    return column
+
+
+def split_specialities(values):
+    # Специальности строкой: "['терапевт', 'кардиолог']" (сбер, список в csv) или "терапевт, кардиолог"
+    # (продокторов) -> по специальности на элемент, индекс - строка исходной таблицы
+    text = values.astype('string')
+    listed = text.str.startswith('[', na=False)
+    quoted = text[listed].str.extractall(r"'(?P<single>[^']*)'|\"(?P<double>[^\"]*)\"")
+    items = pd.concat([
+        quoted['single'].fillna(quoted['double']).droplevel('match'),
+        text[~listed].str.split(',').explode(),
+    ])
+    items = items.astype('string').str.strip().str.lower()
+    return items[items.notna() & (items != '')]
+
+
+def combine_specialities(sber, prod):
+    # Объединение специальностей из обоих источников без повторов (сначала сбер), пусто - None
+    items = pd.concat([split_specialities(sber), split_specialities(prod)])
+    positions = pd.Series(items.index, dtype=np.int64)
+    unique = pd.DataFrame({'row': positions.to_numpy(), 'speciality': items.to_numpy()}).drop_duplicates()
+    lists = unique.groupby('row', sort=False)['speciality'].agg(list).reindex(sber.index)
+    return lists.astype(object).where(lists.notna(), None)
+
+
+def as_boolean(values):
+    return values.map(_BOOLEANS).astype('boolean')
+
+
+def combine_bool(sber, prod):
+    # Как объединение множеств: True, если True хотя бы в одном; известное значение важнее пропуска
+    sber, prod = as_boolean(sber), as_boolean(prod)
+    return sber.fillna(prod) | prod.fillna(sber)
+
+
+def _prepared(chunk):
+    if 'experience' in chunk.columns:
+        chunk['experience'] = pd.to_numeric(chunk['experience'], errors='coerce').astype('Int64')
+    return chunk
+
+
+def read_source(path):
+    # Подготовленный csv (с индексом в первой колонке) частями; speciality остаётся строкой до объединения
+    for chunk in pd.read_csv(path, index_col=0, chunksize=READ_CHUNK_ROWS, dtype={'speciality': 'string'}):
+        yield _prepared(chunk)
+
+
+def empty_source(path):
+    # Пустая таблица с колонками источника - для части, в которую не попал ни один его врач
+    return _prepared(pd.read_csv(path, index_col=0, nrows=0, dtype={'speciality': 'string'}))
+
+
+def name_buckets(names, chunks):
+    return (pd.util.hash_pandas_object(names.fillna(''), index=False).to_numpy() % chunks).astype(np.int64)
+
+
+def partition(paths, directory, chunks):
+    # Раскладывает входы по частям (csv на часть и источник), возвращает список [(sber, prod), ...]
+    parts = [{source: os.path.join(directory, f'{source}.{i}.csv') for source in SOURCES} for i in range(chunks)]
+    for source, path in paths.items():
+        written = set()
+        for chunk in read_source(path):
+            for bucket, rows in chunk.groupby(name_buckets(chunk['name'], chunks)):
+                part = parts[bucket][source]
+                rows.to_csv(part, mode='a', header=part not in written)
+                written.add(part)
+    return parts
+
+
+def merge_sources(sber, prod):
+    # Полные тёзки объединяются по ФИО и стажу, остальные - по ФИО
+    sber_dups = sber['name'].duplicated(keep=False)
+    prod_dups = prod['name'].duplicated(keep=False)
+
+    merged_unique = pd.merge(sber[~sber_dups], prod[~prod_dups], how='outer', on='name', suffixes=('_sber', '_prod'))
+    delta = (merged_unique['experience_sber'] - merged_unique['experience_prod']).abs()
+    merged_unique = merged_unique[delta.isna() | (delta <= MAX_EXPERIENCE_DELTA)].copy()
+    merged_unique['experience'] = pd.Series(np.fmax(
+        merged_unique['experience_sber'].to_numpy(dtype=float, na_value=np.nan),
+        merged_unique['experience_prod'].to_numpy(dtype=float, na_value=np.nan),
+    ), index=merged_unique.index).astype('Int64')
+    merged_unique = merged_unique.drop(columns=['experience_sber', 'experience_prod'])
+
+    merged_dups = pd.merge(
+        sber[sber_dups], prod[prod_dups], how='outer', on=['name', 'experience'], suffixes=('_sber', '_prod')
+    )
+    merged = pd.concat([merged_dups, merged_unique], ignore_index=True)
+
+    merged['speciality'] = combine_specialities(merged['speciality_sber'], merged['speciality_prod'])
+    for column in BOOLEAN_COLUMNS:
+        merged[column] = combine_bool(merged[f'{column}_sber'], merged[f'{column}_prod'])
+    return merged.drop(columns=[
+        'speciality_sber', 'speciality_prod', *(f'{column}_{source}' for column in BOOLEAN_COLUMNS for source in SOURCES)
+    ])
+
+
+def column_type(column):
+    base = _base_name(column)
+    if column == 'speciality':
+        return pa.list_(pa.string())
+    if base in INTEGER_COLUMNS:
+        return pa.int64()
+    if base in FLOAT_COLUMNS:
+        return pa.float64()
+    if base in BOOLEAN_COLUMNS:
+        return pa.bool_()
+    return pa.string()
+
+
+def typed(merged, columns):
+    # Одинаковые типы во всех частях: пропуски в части не превращают int в float, а строки в null
+    merged = merged.reindex(columns=columns)
+    for column in columns:
+        kind = column_type(column)
+        if kind == pa.int64():
+            merged[column] = pd.to_numeric(merged[column], errors='coerce').round().astype('Int64')
+        elif kind == pa.float64():
+            merged[column] = pd.to_numeric(merged[column], errors='coerce').astype('Float64')
+        elif kind == pa.bool_():
+            merged[column] = as_boolean(merged[column])
+        elif kind == pa.string():
+            merged[column] = merged[column].astype('string')
+    return merged
+
+
+def merge_doctors(sber_path, prod_path, output, chunks=1):
+    schema = columns = None
+    rows = 0
+    templates = {'sber': empty_source(sber_path), 'prod': empty_source(prod_path)}
+    with tempfile.TemporaryDirectory(prefix='merge-') as directory:
+        if chunks > 1:
+            parts = partition({'sber': sber_path, 'prod': prod_path}, directory, chunks)
+        else:
+            parts = [{'sber': sber_path, 'prod': prod_path}]
+
+        writer = None
+        try:
+            for part in parts:
+                frames = {
+                    source: pd.concat(read_source(path), ignore_index=True) if os.path.exists(path) else templates[source]
+                    for source, path in part.items()
+                }
+                if not any(len(frame) for frame in frames.values()):
+                    continue
+                merged = merge_sources(frames['sber'], frames['prod'])
+
+                if schema is None:
+                    columns = list(merged.columns)
+                    schema = pa.schema([(column, column_type(column)) for column in columns])
+                    writer = pq.ParquetWriter(output, schema)
+                writer.write_table(pa.Table.from_pandas(typed(merged, columns), schema=schema, preserve_index=False))
+                rows += len(merged)
+        finally:
+            if writer is not None:
+                writer.close()
+    return rows
+
+
+def merge_reviews(paths, output):
+    # Отзывы обоих источников подряд, частями
+    writer = None
+    rows = 0
+    try:
+        for path in paths:
+            for chunk in pd.read_csv(path, index_col=0, chunksize=READ_CHUNK_ROWS):
+                chunk = chunk.astype({column: 'string' for column in chunk.columns if chunk[column].dtype == object})
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table.cast(writer.schema))
+                rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Объединение датасетов СберЗдоровья и ПроДокторов')
+    parser.add_argument('--sber', default=SBER_FILE)
+    parser.add_argument('--prod', default=PROD_FILE)
+    parser.add_argument('--sber-reviews', default=SBER_REVIEWS_FILE)
+    parser.add_argument('--prod-reviews', default=PROD_REVIEWS_FILE)
+    parser.add_argument('--output', default='doctors.parquet')
+    parser.add_argument('--reviews-output', default=None, help='например doctors_review.parquet')
+    parser.add_argument('--chunks', type=int, default=1, help='на сколько частей по ФИО делить входы')
+    args = parser.parse_args()
+
+    rows = merge_doctors(args.sber, args.prod, args.output, max(args.chunks, 1))
+    print(f"{args.output}: {rows} врачей")
+    if args.reviews_output:
+        rows = merge_reviews([args.prod_reviews, args.sber_reviews], args.reviews_output)
+        print(f"{args.reviews_output}: {rows} отзывов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+import argparse
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Параллельный обход профилей врачей: N обработчиков (Chrome или обычные HTTP-запросы) берут ссылки
+# из общей очереди, запросы к каждому сайту идут не чаще заданной частоты (token bucket),
+# каждый обработанный адрес дописывается в checkpoint - после остановки обход продолжается с того же места.
+#
+#   from crawler import CrawlPool, SeleniumFetcher, Checkpoint
+#   with Checkpoint('doctor_data.checkpoint.jsonl') as checkpoint:
+#       pool = CrawlPool(parse_doctor, 'doctor_data.jsonl', checkpoint,
+#                        fetcher_factory=lambda: SeleniumFetcher(setup_driver), workers=4, rates={'docdoc.ru': 2})
+#       pool.run(doctor_links)
+#
+# Для проверки без сайтов: python crawler.py serve pages/ --port 8000 отдаёт сохранённые страницы
+# (их пишет crawl --pages-dir), а обход запускается по ссылкам на http://127.0.0.1:8000/...
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Запросов в секунду на сайт: СберЗдоровье отдаёт страницы только браузеру и чаще банит
+DEFAULT_RATES = {'docdoc.ru': 1.0, 'prodoctorov.ru': 2.0}
+DEFAULT_RATE = 5.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def setup_logger(name='Crawler'):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def site_of(url):
+    host = urlsplit(url).hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+class TokenBucket:
+    # rate запросов в секунду, до burst подряд без ожидания. Общий для всех потоков одного сайта
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            # Время простоя копит не больше burst запросов
+            start = max(self._next, now - (self.burst - 1) * self.interval)
+            self._next = start + self.interval
+        wait = start - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    def __init__(self, rates=None, default_rate=DEFAULT_RATE, burst=1):
+        self.rates = {**DEFAULT_RATES, **(rates or {})}
+        self.default_rate = default_rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        site = site_of(url)
+        with self._lock:
+            bucket = self._buckets.get(site)
+            if bucket is None:
+                bucket = self._buckets[site] = TokenBucket(self.rates.get(site, self.default_rate), self.burst)
+        return bucket
+
+    def acquire(self, url):
+        self.bucket(url).acquire()
+
+
+class RetryLater(Exception):
+    pass
+
+
+class HttpFetcher:
+    # Для страниц, которые отдаются без JavaScript (ПроДокторов, локальный стенд)
+    def __init__(self, timeout=30, headers=None):
+        self.timeout = timeout
+        self.headers = {'User-Agent': USER_AGENT, 'Accept-Language': 'ru-RU,ru;q=0.9', **(headers or {})}
+
+    def get(self, url):
+        request = urllib.request.Request(url, headers=self.headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or 'utf-8'
+                return response.read().decode(charset, errors='replace')
+        except urllib.error.HTTPError as e:
+            if e.code in RETRY_STATUSES:
+                raise RetryLater(f"HTTP {e.code}") from e
+            raise
+
+    def close(self):
+        pass
+
+
+class SeleniumFetcher:
+    # Свой Chrome на каждый поток; setup_driver - функция из ноутбука парсера
+    def __init__(self, setup_driver, wait=1.0):
+        self.driver = setup_driver()
+        self.wait = wait
+
+    def get(self, url):
+        self.driver.get(url)
+        # Даём странице дорисоваться скриптами
+        if self.wait:
+            time.sleep(self.wait)
+        return self.driver.page_source
+
+    def close(self):
+        self.driver.quit()
+
+
+class Checkpoint:
+    # Журнал обработанных адресов, только дописывается: {"url": ..., "status": "done" | "failed", ...}.
+    # При повторном запуске done пропускаются, failed пробуются снова.
+    # Закрывает его тот, кто открыл (with Checkpoint(...) as checkpoint), а не CrawlPool: один checkpoint
+    # можно передать в несколько запусков
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Последняя строка могла не дописаться при аварийной остановке
+                        continue
+                    if entry.get('status') == 'done':
+                        self.done.add(entry['url'])
+                        self.failed.pop(entry['url'], None)
+                    else:
+                        self.failed[entry['url']] = entry.get('error')
+        self._file = open(path, 'a', encoding='utf-8') if path else None
+
+    def mark(self, url, status='done', **extra):
+        with self._lock:
+            if status == 'done':
+                self.done.add(url)
+                self.failed.pop(url, None)
+            else:
+                self.failed[url] = extra.get('error')
+            if self._file is not None:
+                self._file.write(json.dumps({'url': url, 'status': status, 'time': time.time(), **extra}, ensure_ascii=False) + '\n')
+                self._file.flush()
+
+    def pending(self, urls):
+        return [url for url in dict.fromkeys(urls) if url not in self.done]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def page_path(pages_dir, url):
+    # http://host/doctor/Ivanov?x=1 -> pages_dir/doctor/Ivanov.html (host не нужен: стенд отдаёт один сайт)
+    path = urlsplit(url).path.strip('/') or 'index'
+    path = re.sub(r'[^\w./-]', '_', path)
+    return os.path.join(pages_dir, path if path.endswith('.html') else path + '.html')
+
+
+def save_page(pages_dir, url, html):
+    path = page_path(pages_dir, url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as page:
+        page.write(html)
+
+
+class CrawlPool:
+    # parse(html, url) -> dict записи (или None, если страница пустая); записи дописываются в output (jsonl)
+    def __init__(self, parse, output, checkpoint, fetcher_factory=HttpFetcher, workers=4, rates=None,
+                 default_rate=DEFAULT_RATE, retries=3, backoff=2.0, pages_dir=None, logger=None):
+        self.parse = parse
+        self.output = output
+        self.checkpoint = checkpoint
+        self.fetcher_factory = fetcher_factory
+        self.workers = workers
+        self.limiter = RateLimiter(rates, default_rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.pages_dir = pages_dir
+        self.logger = logger or setup_logger()
+        self.stats = {'done': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _fetch(self, fetcher, url):
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(url)
+            try:
+                return fetcher.get(url)
+            except urllib.error.HTTPError:
+                # 404 и подобные не исправятся повтором; 429 и 5xx приходят как RetryLater
+                raise
+            except Exception as e:
+                if attempt == self.retries or self._stop.is_set():
+                    raise
+                self._count('retries')
+                delay = self.backoff * 2 ** attempt
+                self.logger.warning(f"Повтор {attempt + 1}/{self.retries} для {url} через {delay:.0f} с: {e}")
+                time.sleep(delay)
+
+    def _write(self, record):
+        with self._output_lock:
+            with open(self.output, 'a', encoding='utf-8') as output:
+                output.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def _worker(self):
+        try:
+            fetcher = self.fetcher_factory()
+        except Exception as e:
+            self.logger.error(f"Не удалось запустить обработчик: {e}")
+            return
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    url = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if url is None:
+                    break
+                try:
+                    html = self._fetch(fetcher, url)
+                    if self.pages_dir:
+                        save_page(self.pages_dir, url, html)
+                    record = self.parse(html, url)
+                    if record is not None:
+                        self._write(record)
+                    self.checkpoint.mark(url)
+                    self._count('done')
+                except Exception as e:
+                    self.logger.error(f"Ошибка при обработке {url}: {e}")
+                    self.checkpoint.mark(url, 'failed', error=str(e))
+                    self._count('failed')
+                finally:
+                    self._queue.task_done()
+        finally:
+            fetcher.close()
+
+    def run(self, urls):
+        # Пул можно запускать повторно: очередь, флаг остановки и счётчики - свои у каждого запуска
+        self._queue = queue.Queue()
+        self._stop.clear()
+        self.stats = {'done': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+        pending = self.checkpoint.pending(urls)
+        self.stats['skipped'] = len(set(urls)) - len(pending)
+        self.logger.info(f"В очереди {len(pending)} адресов, уже обработано {self.stats['skipped']}, обработчиков {self.workers}")
+        if not pending:
+            return self.stats
+
+        for url in pending:
+            self._queue.put(url)
+        threads = [
+            threading.Thread(target=self._worker, name=f'crawler-{i}', daemon=True)
+            for i in range(min(self.workers, len(pending)))
+        ]
+        for _ in threads:
+            self._queue.put(None)
+
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1.0)
+        except KeyboardInterrupt:
+            # Обработанное уже в checkpoint, повторный запуск продолжит с оставшихся
+            self.logger.info("Остановка по Ctrl+C, ждём текущие запросы...")
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        elapsed = time.monotonic() - started
+        self.logger.info(
+            f"Обработано {self.stats['done']}, ошибок {self.stats['failed']}, повторов {self.stats['retries']} "
+            f"за {elapsed:.1f} с ({self.stats['done'] / elapsed if elapsed else 0:.2f} в секунду)"
+        )
+        return self.stats
+
+
+def raw_page(html, url):
+    # Парсер по умолчанию для командной строки: только факт загрузки, сами страницы - в --pages-dir
+    title = re.search(r'<title[^>]*>(.*?)</title>', html, re.IGNORECASE | re.DOTALL)
+    return {'link': url, 'title': title.group(1).strip() if title else None, 'size': len(html)}
+
+
+def load_function(spec):
+    # "module:function", модуль ищется в текущем каталоге
+    module_name, _, function_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class SavedPageHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        # Адрес ищется так же, как его сохранил crawl --pages-dir
+        self.path = '/' + os.path.relpath(page_path(self.directory, self.path), self.directory)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_pages(pages_dir, host='127.0.0.1', port=8000):
+    server = ThreadingHTTPServer((host, port), partial(SavedPageHandler, directory=pages_dir))
+    thread = threading.Thread(target=server.serve_forever, name='saved-pages', daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Параллельный обход страниц врачей с ограничением частоты запросов')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    crawl = commands.add_parser('crawl', help='обойти ссылки из файла (по одной в строке или через запятую)')
+    crawl.add_argument('urls')
+    crawl.add_argument('--output', default='doctor_data.jsonl')
+    crawl.add_argument('--checkpoint', default=None, help='по умолчанию <output>.checkpoint')
+    crawl.add_argument('--workers', type=int, default=4)
+    crawl.add_argument('--rate', action='append', default=[], metavar='SITE=RPS', help='например docdoc.ru=1')
+    crawl.add_argument('--default-rate', type=float, default=DEFAULT_RATE)
+    crawl.add_argument('--parser', default=None, help='module:function, parse(html, url) -> dict')
+    crawl.add_argument('--browser', action='store_true', help='Chrome через Selenium вместо HTTP-запросов')
+    crawl.add_argument('--pages-dir', default=None, help='сохранять загруженные страницы для стенда')
+
+    serve = commands.add_parser('serve', help='отдавать сохранённые страницы по HTTP')
+    serve.add_argument('pages_dir')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+
+    args = parser.parse_args()
+    logger = setup_logger()
+
+    if args.command == 'serve':
+        server = serve_pages(args.pages_dir, args.host, args.port)
+        logger.info(f"Сохранённые страницы из {args.pages_dir}: http://{args.host}:{args.port}/")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    with open(args.urls, encoding='utf-8') as urls_file:
+        urls = [url.strip() for url in re.split(r'[,\n]', urls_file.read()) if url.strip()]
+
+    fetcher_factory = HttpFetcher
+    if args.browser:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        def setup_driver():
+            options = Options()
+            for argument in ('--headless', '--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu', f'--user-agent={USER_AGENT}'):
+                options.add_argument(argument)
+            return webdriver.Chrome(options=options)
+
+        fetcher_factory = partial(SeleniumFetcher, setup_driver)
+
+    rates = {}
+    for rate in args.rate:
+        site, _, value = rate.partition('=')
+        rates[site] = float(value)
+
+    with Checkpoint(args.checkpoint or f'{args.output}.checkpoint') as checkpoint:
+        pool = CrawlPool(
+            load_function(args.parser) if args.parser else raw_page,
+            args.output,
+            checkpoint,
+            fetcher_factory=fetcher_factory,
+            workers=args.workers,
+            rates=rates,
+            default_rate=args.default_rate,
+            pages_dir=args.pages_dir,
+            logger=logger,
+        )
+        pool.run(urls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import pandas as pd
+
+# Нормализация адресов одна на геокодер и бота: бот ищет координаты по тем же ключам
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+from addresses import normalize_address, normalize_addresses  # noqa: E402
+
+# Геокодинг адресов клиник через API Яндекс Карт: прямой (адрес -> координаты) и обратный
+# (координаты -> район и округ). Все ответы, в том числе "не найдено", дописываются в кеш (jsonl):
+# он же checkpoint, так что повторный запуск по обновлённому doctors.csv запрашивает только новые адреса.
+# Запросы идут параллельно по всем ключам, у каждого ключа своя частота и свой дневной лимит.
+#
+#   YANDEX_GEOCODER_KEYS=key1,key2 python geocoder.py geocode doctors.csv --output api_addresses.csv
+#
+# Для проверки без API: python geocoder.py mock --port 8100 и --url http://127.0.0.1:8100/1.x/
+# После изменений в normalize_address (bot/addresses.py): pytest test_geocoder.py или python geocoder.py check-normalizer
+# (корпус api_yandex_geocoder/normalize_corpus.csv)
+
+GEOCODER_URL = 'https://geocode-maps.yandex.ru/1.x/'
+DEFAULT_CACHE_FILE = 'geocode_cache.jsonl'
+DEFAULT_CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_yandex_geocoder', 'normalize_corpus.csv')
+
+# Сколько запросов безопасно делать на один ключ за запуск и как часто
+KEY_REQUEST_LIMIT = 300
+KEY_RATE = 2.0
+RETRIES = 3
+BACKOFF = 5.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Ключ исчерпал лимит или заблокирован - дальше его не используем
+KEY_DISABLED_STATUSES = {401, 403}
+
+ADDRESS_COLUMNS = [
+    f'clinic_{i}_address_{source}' for source in ('sber', 'prod') for i in (1, 2, 3)
+]
+
+# Московский регион с запасом: широта 55.0–56.3, долгота 36.4–38.3
+MOSCOW_BOUNDS = (55.0, 56.3, 36.4, 38.3)
+
+
+def check_normalizer(corpus_path=DEFAULT_CORPUS_FILE):
+    # Регрессия: адреса корпуса должны нормализоваться так же, как записано в нём
+    corpus = pd.read_csv(corpus_path, dtype=str, keep_default_na=False)
+    normalized = normalize_addresses(corpus['address'])
+    differ = normalized != corpus['address_norm']
+    return corpus[differ].assign(actual=normalized[differ])
+
+
+def build_corpus(addresses_path, size=500, seed=0, corpus_path=DEFAULT_CORPUS_FILE):
+    # Корпус из api_addresses.csv: случайные уникальные адреса и address_norm, записанный в файле при геокодинге.
+    # Ожидаемое значение не считается текущей normalize_address - иначе проверка сравнивала бы её саму с собой.
+    # Строки существующего корпуса (в том числе проверенные вручную, expected_from=manual) остаются как есть
+    addresses = pd.read_csv(addresses_path, dtype=str, keep_default_na=False)
+    if 'address_norm' not in addresses.columns:
+        raise ValueError(f"В {addresses_path} нет колонки address_norm, ожидаемые значения взять неоткуда")
+    sample = addresses[addresses['address'] != ''].drop_duplicates('address')
+    sample = sample.sample(min(size, len(sample)), random_state=seed)[['address', 'address_norm']]
+    sample = sample.assign(expected_from='baseline')
+    if corpus_path and os.path.exists(corpus_path):
+        existing = pd.read_csv(corpus_path, dtype=str, keep_default_na=False)
+        sample = pd.concat([existing, sample], ignore_index=True).drop_duplicates('address')
+    corpus = sample.sort_values('address').reset_index(drop=True)
+
+    changed = (normalize_addresses(corpus['address']) != corpus['address_norm']).sum()
+    print(f"Текущая нормализация расходится с корпусом у {changed} из {len(corpus)} адресов - их нужно проверить вручную")
+    return corpus
+
+
+def point_key(longitude, latitude):
+    # Ключ обратного геокодинга: координаты с точностью до ~10 см
+    return f'{float(longitude):.6f},{float(latitude):.6f}'
+
+
+def is_in_moscow_area(longitude, latitude):
+    south, north, west, east = MOSCOW_BOUNDS
+    return west <= longitude <= east and south <= latitude <= north
+
+
+def doctor_addresses(df):
+    # Уникальные адреса клиник из doctors.csv / data.csv -> таблица address, address_norm
+    columns = [column for column in ADDRESS_COLUMNS if column in df.columns]
+    addresses = pd.unique(pd.concat([df[column] for column in columns], ignore_index=True).dropna()) if columns else []
+    result = pd.DataFrame({'address': addresses})
+    result['address_norm'] = normalize_addresses(result['address'])
+    return result[result['address_norm'] != ''].reset_index(drop=True)
+
+
+class GeocodeCache:
+    # Append-only журнал ответов: {"kind": "direct", "key": address_norm, "latitude", "longitude"}
+    # и {"kind": "reverse", "key": "lon,lat", "district", "area"}. Последняя запись по ключу главная
+    def __init__(self, path):
+        self.path = path
+        self.entries = {'direct': {}, 'reverse': {}}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Оборванная последняя строка после остановки
+                        continue
+                    self.entries[entry['kind']][entry['key']] = entry
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def get(self, kind, key):
+        return self.entries[kind].get(key)
+
+    def put(self, kind, key, **values):
+        entry = {'kind': kind, 'key': key, 'time': time.time(), **values}
+        self.entries[kind][key] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        return entry
+
+    def missing(self, kind, keys):
+        return [key for key in dict.fromkeys(keys) if key not in self.entries[kind]]
+
+    def close(self):
+        self._file.close()
+
+
+class KeyBudget:
+    # Частота и лимит запросов одного ключа; занимается только обработчиками этого ключа
+    def __init__(self, key, rate=KEY_RATE, limit=KEY_REQUEST_LIMIT):
+        self.key = key
+        self.interval = 1.0 / rate
+        self.limit = limit
+        self.used = 0
+        self.disabled = False
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def available(self):
+        return not self.disabled and self.used < self.limit
+
+    async def acquire(self):
+        async with self._lock:
+            if not self.available:
+                return False
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+            self.used += 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+class KeysExhausted(Exception):
+    pass
+
+
+def parse_direct(response):
+    members = response['response']['GeoObjectCollection']['featureMember']
+    if not members:
+        return {'latitude': None, 'longitude': None}
+    longitude, latitude = map(float, members[0]['GeoObject']['Point']['pos'].split())
+    # Адреса вне Москвы - скорее всего геокодер понял адрес неправильно
+    if not is_in_moscow_area(longitude, latitude):
+        return {'latitude': None, 'longitude': None}
+    return {'latitude': latitude, 'longitude': longitude}
+
+
+def parse_reverse(response):
+    # Район и округ приходят с одним kind='district', различаются по названию
+    members = response['response']['GeoObjectCollection']['featureMember']
+    district = area = None
+    if members:
+        components = members[0]['GeoObject']['metaDataProperty']['GeocoderMetaData']['Address']['Components']
+        for component in components:
+            if component['kind'] != 'district':
+                continue
+            name = component['name'].lower()
+            if district is None and 'район' in name:
+                district = component['name']
+            elif area is None and 'округ' in name:
+                area = component['name']
+    return {'district': district, 'area': area}
+
+
+class Geocoder:
+    def __init__(self, keys, cache, url=GEOCODER_URL, rate=KEY_RATE, limit=KEY_REQUEST_LIMIT,
+                 workers_per_key=1, retries=RETRIES, backoff=BACKOFF, timeout=10, logger=None):
+        if not keys:
+            raise ValueError("Нужен хотя бы один API-ключ (YANDEX_GEOCODER_KEYS)")
+        self.cache = cache
+        self.url = url
+        self.budgets = [KeyBudget(key, rate, limit) for key in keys]
+        self.workers_per_key = workers_per_key
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.logger = logger or setup_logger()
+        self.stats = {'cached': 0, 'requests': 0, 'done': 0, 'failed': 0, 'retries': 0}
+
+    async def _request(self, client, budget, params):
+        for attempt in range(self.retries + 1):
+            if not await budget.acquire():
+                raise KeysExhausted(budget.key)
+            self.stats['requests'] += 1
+            response = await client.get(self.url, params={'apikey': budget.key, 'format': 'json', 'results': 1, **params})
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code in KEY_DISABLED_STATUSES:
+                budget.disabled = True
+                self.logger.warning(f"Ключ ...{budget.key[-4:]} отключён: ответ {response.status_code}")
+                raise KeysExhausted(budget.key)
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                response.raise_for_status()
+            self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def _worker(self, client, budget, queue, kind, handle):
+        while budget.available:
+            try:
+                key = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                response = await self._request(client, budget, self._params(kind, key))
+                self.cache.put(kind, key, **handle(response))
+                self.stats['done'] += 1
+            except KeysExhausted:
+                # Адрес забирает обработчик другого ключа
+                queue.put_nowait(key)
+                return
+            except Exception as e:
+                # Ошибки в кеш не пишутся - адрес запросится при следующем запуске
+                self.logger.error(f"Ошибка при обработке '{key}': {e}")
+                self.stats['failed'] += 1
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    def _params(kind, key):
+        if kind == 'direct':
+            return {'geocode': key}
+        return {'geocode': key, 'kind': 'district'}
+
+    async def _run(self, kind, keys, handle):
+        pending = self.cache.missing(kind, keys)
+        self.stats['cached'] += len(set(keys)) - len(pending)
+        self.logger.info(f"{kind}: новых запросов {len(pending)}, из кеша {len(set(keys)) - len(pending)}")
+        if not pending:
+            return
+
+        queue = asyncio.Queue()
+        for key in pending:
+            queue.put_nowait(key)
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            # Адрес, возвращённый в очередь обработчиком исчерпанного ключа, мог остаться после выхода остальных
+            while not queue.empty() and any(budget.available for budget in self.budgets):
+                await asyncio.gather(*(
+                    self._worker(client, budget, queue, kind, handle)
+                    for budget in self.budgets if budget.available for _ in range(self.workers_per_key)
+                ))
+        if not queue.empty():
+            self.logger.warning(f"Лимиты всех ключей исчерпаны, осталось {queue.qsize()} - продолжит следующий запуск")
+
+    async def geocode(self, addresses):
+        # Нормализованные адреса -> {address_norm: (широта, долгота) или None}
+        keys = [address for address in dict.fromkeys(addresses) if address]
+        await self._run('direct', keys, parse_direct)
+        return {key: self._point(key) for key in keys}
+
+    async def reverse(self, points):
+        # [(долгота, широта), ...] -> {"lon,lat": {"district", "area"}}
+        keys = [point_key(longitude, latitude) for longitude, latitude in points]
+        await self._run('reverse', keys, parse_reverse)
+        return {key: self.cache.get('reverse', key) for key in keys}
+
+    def _point(self, key):
+        entry = self.cache.get('direct', key)
+        if entry is None or entry['latitude'] is None:
+            return None
+        return entry['latitude'], entry['longitude']
+
+
+def geocode_addresses(addresses, keys, cache_path=DEFAULT_CACHE_FILE, **options):
+    # Таблица address, address_norm -> + latitude, longitude, district, area (как api_addresses.csv)
+    cache = GeocodeCache(cache_path)
+    geocoder = Geocoder(keys, cache, **options)
+    try:
+        points = asyncio.run(geocoder.geocode(addresses['address_norm']))
+        located = {key: point for key, point in points.items() if point is not None}
+        districts = asyncio.run(geocoder.reverse([(lon, lat) for lat, lon in located.values()]))
+    finally:
+        cache.close()
+
+    result = addresses.copy()
+    found = result['address_norm'].map(located)
+    result['latitude'] = found.map(lambda point: point[0] if isinstance(point, tuple) else None)
+    result['longitude'] = found.map(lambda point: point[1] if isinstance(point, tuple) else None)
+    reverse = found.map(lambda point: districts.get(point_key(point[1], point[0])) if isinstance(point, tuple) else None)
+    result['district'] = reverse.map(lambda entry: entry['district'] if entry else None)
+    result['area'] = reverse.map(lambda entry: entry['area'] if entry else None)
+    geocoder.logger.info(
+        f"Геокодинг: из кеша {geocoder.stats['cached']}, запросов {geocoder.stats['requests']}, "
+        f"ошибок {geocoder.stats['failed']}, найдены координаты у {result['latitude'].notna().sum()}/{len(result)}"
+    )
+    return result
+
+
+class MockGeocoderHandler(BaseHTTPRequestHandler):
+    # Ответы в формате Яндекса: координаты детерминированно выводятся из адреса, район - из координат.
+    # key_limit > 0 - после стольких запросов по ключу отвечает 403, как при исчерпанном лимите
+    key_limit = 0
+    requests = {}
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        key = query.get('apikey', [''])[0]
+        geocode = query.get('geocode', [''])[0]
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if not key or (self.key_limit and self.requests[key] > self.key_limit):
+            self.send_error(403)
+            return
+
+        members = []
+        if 'kind' in query:
+            longitude, latitude = map(float, geocode.split(','))
+            number = int(hashlib.md5(geocode.encode()).hexdigest(), 16)
+            components = [
+                {'kind': 'district', 'name': f'Округ {number % 12}'},
+                {'kind': 'district', 'name': f'Район {number % 125}'},
+            ]
+            members.append({'GeoObject': {
+                'Point': {'pos': f'{longitude} {latitude}'},
+                'metaDataProperty': {'GeocoderMetaData': {'Address': {'Components': components}}},
+            }})
+        elif 'москва' in geocode.lower():
+            number = int(hashlib.md5(geocode.encode()).hexdigest(), 16)
+            latitude = 55.55 + (number % 10000) / 25000
+            longitude = 37.35 + (number // 10000 % 10000) / 18000
+            members.append({'GeoObject': {'Point': {'pos': f'{longitude:.6f} {latitude:.6f}'}}})
+
+        body = json.dumps({'response': {'GeoObjectCollection': {'featureMember': members}}}, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_mock(host='127.0.0.1', port=8100, key_limit=0):
+    MockGeocoderHandler.key_limit = key_limit
+    server = ThreadingHTTPServer((host, port), MockGeocoderHandler)
+    print(f"Тестовый геокодер на http://{host}:{port}/1.x/")
+    server.serve_forever()
+
+
+def api_keys(path=None):
+    if path:
+        with open(path, encoding='utf-8') as keys:
+            return [key.strip() for key in keys if key.strip()]
+    return [key.strip() for key in os.getenv('YANDEX_GEOCODER_KEYS', '').split(',') if key.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Геокодинг адресов клиник с кешем ответов')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    geocode = commands.add_parser('geocode')
+    geocode.add_argument('data_file', help='doctors.csv или data.csv')
+    geocode.add_argument('--output', default='api_addresses.csv')
+    geocode.add_argument('--cache', default=DEFAULT_CACHE_FILE)
+    geocode.add_argument('--keys-file', default=None, help='по ключу на строку; по умолчанию YANDEX_GEOCODER_KEYS')
+    geocode.add_argument('--url', default=GEOCODER_URL)
+    geocode.add_argument('--rate', type=float, default=KEY_RATE, help='запросов в секунду на ключ')
+    geocode.add_argument('--limit', type=int, default=KEY_REQUEST_LIMIT, help='запросов на ключ за запуск')
+    geocode.add_argument('--workers-per-key', type=int, default=1)
+
+    mock = commands.add_parser('mock')
+    mock.add_argument('--port', type=int, default=8100)
+    mock.add_argument('--key-limit', type=int, default=0)
+
+    check = commands.add_parser('check-normalizer')
+    check.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS_FILE)
+
+    corpus = commands.add_parser('corpus')
+    corpus.add_argument('addresses_file', help='api_addresses.csv')
+    corpus.add_argument('--output', default=DEFAULT_CORPUS_FILE)
+    corpus.add_argument('--size', type=int, default=500)
+
+    args = parser.parse_args()
+    if args.command == 'mock':
+        serve_mock(port=args.port, key_limit=args.key_limit)
+        return
+    if args.command == 'check-normalizer':
+        differ = check_normalizer(args.corpus)
+        for row in differ.itertuples():
+            print(f"{row.address!r}\n  ожидалось: {row.address_norm!r}\n  получено:  {row.actual!r}")
+        print(f"Расхождений: {len(differ)}")
+        raise SystemExit(1 if len(differ) else 0)
+    if args.command == 'corpus':
+        build_corpus(args.addresses_file, args.size, corpus_path=args.output).to_csv(args.output, index=False, encoding='utf-8')
+        return
+
+    addresses = doctor_addresses(pd.read_csv(args.data_file))
+    result = geocode_addresses(
+        addresses, api_keys(args.keys_file), args.cache, url=args.url,
+        rate=args.rate, limit=args.limit, workers_per_key=args.workers_per_key,
+    )
+    output_tmp = f'{args.output}.tmp'
+    result.to_csv(output_tmp, index=False, encoding='utf-8')
+    os.replace(output_tmp, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import urljoin
+
+import numpy as np
+import pandas as pd
+
+from crawler import CrawlPool, Checkpoint, HttpFetcher, setup_logger
+
+# Инкрементальное обновление: сначала заново обходятся только страницы списков (их в десятки раз меньше,
+# чем профилей), по карточке каждого врача на них считается хеш. Профиль загружается и разбирается
+# полностью (parse_doctor, parse_reviews) только для новых врачей и тех, у кого карточка изменилась:
+# цена, рейтинг, число отзывов, клиники. Результат - файл изменений (delta), который накладывается
+# на doctors.csv / data.csv командой apply, без повторного обхода и объединения всего каталога.
+#
+#   python recrawl.py apply data.csv prod_delta.jsonl --source prod --output data.csv
+#
+# Файл изменений - jsonl: {"op": "upsert", "link": ..., "record": {...}} или {"op": "delete", "link": ...};
+# {"op": "skip", "link": ...} - профиль загружен, но парсер не нашёл в нём врача: apply его пропускает,
+# а состояние запоминает, чтобы не загружать его снова, пока не изменится карточка
+
+# Профиль, который давно не разбирался полностью, загружается даже без изменений в карточке:
+# часть полей (отзывы, опыт) в карточку не попадает
+DEFAULT_REFRESH_DAYS = 30
+
+CLINICS_PER_DOCTOR = 3
+SOURCE_FIELDS = ('price', 'rating', 'review_count', 'clinics_count')
+MISSING = {'No value', 'no value', '', 'нет оценки'}
+
+
+def fingerprint(text):
+    return hashlib.sha1(' '.join(str(text).split()).encode('utf-8')).hexdigest()[:16]
+
+
+def listing_cards(html, page_url, is_doctor_link):
+    # Карточка врача - самый крупный блок вокруг ссылки на него, в котором нет ссылок на других врачей
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    cards = {}
+    for a in soup.find_all('a', href=True):
+        link = urljoin(page_url, a['href']).split('#')[0].split('?')[0]
+        if link in cards or not is_doctor_link(link):
+            continue
+        card = a
+        for parent in a.parents:
+            if parent.name in ('body', 'html', '[document]'):
+                break
+            links = {
+                urljoin(page_url, other['href']).split('#')[0].split('?')[0]
+                for other in parent.find_all('a', href=True)
+            }
+            if any(other != link and is_doctor_link(other) for other in links):
+                break
+            card = parent
+        cards[link] = fingerprint(card.get_text(' '))
+    return cards
+
+
+class CrawlState:
+    # Для каждого профиля: хеш карточки, когда видели в списке и когда разбирали полностью.
+    # Журнал только дописывается (последняя запись по адресу главная, {"url", "seen"} лишь обновляет время),
+    # compact() переписывает его начисто один раз в конце обхода
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    url = entry['url']
+                    if entry.get('deleted'):
+                        self.entries.pop(url, None)
+                    elif 'hash' in entry:
+                        self.entries[url] = entry
+                    elif url in self.entries:
+                        self.entries[url].update(entry)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def classify(self, url, card_hash, now, refresh_after):
+        entry = self.entries.get(url)
+        if entry is None:
+            return 'new'
+        if entry['hash'] != card_hash:
+            return 'changed'
+        if now - entry.get('parsed', 0) > refresh_after:
+            return 'stale'
+        return 'same'
+
+    def seen(self, url, now):
+        self.entries[url]['seen'] = now
+        self._append({'url': url, 'seen': now})
+
+    def parsed(self, url, card_hash, now):
+        entry = self.entries.get(url) or {'url': url, 'first_seen': now}
+        entry.update(hash=card_hash, seen=now, parsed=now)
+        self.entries[url] = entry
+        self._append(entry)
+
+    def delete(self, url):
+        self.entries.pop(url, None)
+        self._append({'url': url, 'deleted': True})
+
+    def compact(self):
+        self._file.close()
+        state_tmp = f'{self.path}.tmp'
+        with open(state_tmp, 'w', encoding='utf-8') as journal:
+            for entry in self.entries.values():
+                journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(state_tmp, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._file.close()
+
+
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as lines:
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+def incremental_crawl(listing_urls, parse_listing, parse, state_path, delta_path, fetcher_factory=HttpFetcher,
+                      workers=4, rates=None, refresh_days=DEFAULT_REFRESH_DAYS, logger=None):
+    # parse_listing(html, url) -> {ссылка на врача: хеш карточки} (обычно через listing_cards),
+    # parse(html, url) -> запись о враче, как в полном обходе
+    logger = logger or setup_logger('Recrawl')
+    listing_output = f'{delta_path}.listing.jsonl'
+    run_files = (listing_output, f'{delta_path}.listing.checkpoint', f'{delta_path}.checkpoint')
+    # delta без checkpoint - результат прошлого, завершённого запуска. Дописывать в него нельзя (в written
+    # попали бы чужие профили), а затирать - значит потерять изменения, если их ещё не применили через apply
+    if os.path.exists(delta_path) and not any(os.path.exists(path) for path in run_files):
+        raise FileExistsError(f"{delta_path} остался от прошлого запуска: примените его (apply) и удалите")
+
+    state = CrawlState(state_path)
+    now = time.time()
+
+    # 1. Страницы списков. Checkpoint только на этот запуск: после остановки он продолжит с того же места,
+    # после успешного завершения удаляется вместе с результатами списков
+    with Checkpoint(run_files[1]) as listing_checkpoint:
+        CrawlPool(
+            lambda html, url: {'page': url, 'cards': parse_listing(html, url)},
+            listing_output, listing_checkpoint, fetcher_factory=fetcher_factory, workers=workers, rates=rates,
+            logger=logger,
+        ).run(listing_urls)
+
+    cards = {}
+    for page in _read_jsonl(listing_output):
+        cards.update(page['cards'])
+    # Если часть списков не загрузилась, отсутствие врача ещё не значит, что он удалён с сайта
+    listings_complete = not listing_checkpoint.failed and listing_checkpoint.pending(listing_urls) == []
+
+    stats = {'new': 0, 'changed': 0, 'stale': 0, 'same': 0}
+    to_fetch = {}
+    for url, card_hash in cards.items():
+        status = state.classify(url, card_hash, now, refresh_days * 86400)
+        stats[status] += 1
+        if status == 'same':
+            state.seen(url, now)
+        else:
+            to_fetch[url] = card_hash
+    logger.info(
+        f"В списках {len(cards)} врачей: новых {stats['new']}, изменились {stats['changed']}, "
+        f"давно не обновлялись {stats['stale']}, без изменений {stats['same']}"
+    )
+
+    # 2. Полный разбор только новых и изменившихся профилей
+    def parse_changed(html, url):
+        record = parse(html, url)
+        if record is None:
+            return {'op': 'skip', 'link': url, 'hash': to_fetch[url], 'time': now}
+        return {'op': 'upsert', 'link': url, 'hash': to_fetch[url], 'time': now, 'record': record}
+
+    with Checkpoint(run_files[2]) as checkpoint:
+        CrawlPool(
+            parse_changed, delta_path, checkpoint,
+            fetcher_factory=fetcher_factory, workers=workers, rates=rates, logger=logger,
+        ).run(list(to_fetch))
+
+    # Состояние обновляем только по тому, что действительно попало в delta - упавшие профили придут в следующий раз
+    processed = {entry['link']: entry['op'] for entry in _read_jsonl(delta_path) if entry['op'] in ('upsert', 'skip')}
+    for url in processed.keys() & to_fetch.keys():
+        state.parsed(url, to_fetch[url], now)
+    written = [url for url, op in processed.items() if op == 'upsert']
+    skipped = len(processed) - len(written)
+
+    removed = []
+    if listings_complete:
+        removed = [url for url in state.entries if url not in cards]
+        with open(delta_path, 'a', encoding='utf-8') as delta:
+            for url in removed:
+                delta.write(json.dumps({'op': 'delete', 'link': url, 'time': now}, ensure_ascii=False) + '\n')
+                state.delete(url)
+    else:
+        logger.warning("Не все страницы списков загружены, удаление врачей пропущено")
+
+    state.compact()
+    state.close()
+    for path in run_files:
+        if os.path.exists(path):
+            os.remove(path)
+    stats.update(fetched=len(written), skipped=skipped, removed=len(removed))
+    logger.info(
+        f"Изменения записаны в {delta_path}: обновлено {len(written)}, без данных о враче {skipped}, удалено {len(removed)}"
+    )
+    return stats
+
+
+def read_delta(path):
+    # Последняя операция по ссылке главная
+    upserts, deletes = {}, set()
+    for entry in _read_jsonl(path):
+        link = entry['link']
+        if entry['op'] == 'skip':
+            continue
+        if entry['op'] == 'delete':
+            upserts.pop(link, None)
+            deletes.add(link)
+        else:
+            deletes.discard(link)
+            upserts[link] = entry['record']
+    return upserts, deletes
+
+
+def _number(value, kind=float):
+    if value is None or (not isinstance(value, str) and pd.isna(value)) or str(value).strip() in MISSING:
+        return np.nan
+    if isinstance(value, (int, float)):
+        return kind(value)
+    # "2 500 ₽", "Стаж 12 лет", "4,8"
+    match = re.search(r'\d+(?:[.,]\d+)?', str(value).replace('\xa0', '').replace(' ', ''))
+    return kind(float(match.group().replace(',', '.'))) if match else np.nan
+
+
+def delta_rows(records, source):
+    # Записи парсера -> строки в колонках объединённого датасета (price_sber, clinic_1_address_prod, ...)
+    rows = []
+    for link, record in records.items():
+        clinics = record.get('clinics')
+        clinics = clinics if isinstance(clinics, list) else []
+        row = {
+            f'link_{source}': link.split('?')[0],
+            'name': record.get('name'),
+            f'price_{source}': _number(record.get('price')),
+            f'rating_{source}': _number(record.get('rating')),
+            f'review_count_{source}': _number(record.get('review_count')),
+            f'clinics_count_{source}': len(clinics),
+            'experience': _number(record.get('experience')),
+        }
+        for i in range(CLINICS_PER_DOCTOR):
+            clinic = clinics[i] if i < len(clinics) else {}
+            for field in ('name', 'address', 'metro'):
+                value = clinic.get(field)
+                row[f'clinic_{i + 1}_{field}_{source}'] = None if value in MISSING else value
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def derive_price(data, changed):
+    # Общая цена - среднее по источникам (EDA_Doctors). Общий рейтинг считается calc_rating из EDA
+    # и передаётся в apply_delta своей функцией derive
+    price_columns = [column for column in ('price_sber', 'price_prod') if column in data.columns]
+    if price_columns:
+        data.loc[changed, 'price'] = data.loc[changed, price_columns].mean(axis=1, skipna=True)
+
+
+def apply_delta(data, delta_path, source, derive=derive_price):
+    # Обновляет колонки источника у найденных по link_<source> врачей, удалённым очищает их,
+    # новых добавляет строками без данных второго источника. Общие колонки (name, experience)
+    # обновляются, только если в delta есть значение: пустое не затирает данные второго источника
+    upserts, deletes = read_delta(delta_path)
+    data = data.copy()
+    link_column = f'link_{source}'
+    links = data[link_column].astype('string').str.split('?').str[0]
+
+    updates = delta_rows(upserts, source)
+    changed = pd.Series(False, index=data.index)
+    if not updates.empty:
+        updates = updates.set_index(link_column)
+        position = pd.Series(data.index, index=links).dropna()
+        position = position[~position.index.duplicated()]
+        existing = updates.index.intersection(position.index)
+
+        source_columns = [column for column in updates.columns if column.endswith(f'_{source}') and column in data.columns]
+        target = position[existing].to_numpy()
+        data.loc[target, source_columns] = updates.loc[existing, source_columns].to_numpy()
+        for column in updates.columns:
+            if column in source_columns or column not in data.columns:
+                continue
+            values = updates.loc[existing, column]
+            present = values.notna().to_numpy()
+            data.loc[target[present], column] = values[present].to_numpy()
+        changed.loc[target] = True
+
+        added = updates.loc[updates.index.difference(position.index)].reset_index()
+        if not added.empty:
+            added = added[[column for column in added.columns if column in data.columns]]
+            data = pd.concat([data, added], ignore_index=True)
+            changed = changed.reindex(data.index, fill_value=True)
+
+    if deletes:
+        gone = links.isin(deletes).reindex(data.index, fill_value=False)
+        source_columns = [column for column in data.columns if column.endswith(f'_{source}')]
+        data.loc[gone, source_columns] = np.nan
+        # Врач остался только на удалённом источнике - строка больше не нужна
+        other = 'prod' if source == 'sber' else 'sber'
+        orphan = gone & data[f'link_{other}'].isna() if f'link_{other}' in data.columns else gone
+        data = data.loc[~orphan]
+        changed = changed.loc[data.index] | gone.loc[data.index]
+
+    if derive is not None and changed.any():
+        derive(data, changed)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Наложение файла изменений инкрементального обхода на датасет')
+    commands = parser.add_subparsers(dest='command', required=True)
+    apply = commands.add_parser('apply')
+    apply.add_argument('data_file', help='doctors.csv или data.csv')
+    apply.add_argument('delta_file')
+    apply.add_argument('--source', choices=('sber', 'prod'), required=True)
+    apply.add_argument('--output', default=None, help='по умолчанию перезаписывается data_file')
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data_file)
+    updated = apply_delta(data, args.delta_file, args.source)
+    output = args.output or args.data_file
+    output_tmp = f'{output}.tmp'
+    updated.to_csv(output_tmp, index=False)
+    os.replace(output_tmp, output)
+    upserts, deletes = read_delta(args.delta_file)
+    print(f"{output}: {len(updated)} строк (было {len(data)}), обновлений {len(upserts)}, удалений {len(deletes)}")
+
+
+if __name__ == '__main__':
+    main()
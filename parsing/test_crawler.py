@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from crawler import Checkpoint, CrawlPool, serve_pages
+
+DOCTORS = {'doctor/ivanov': 'Иванов', 'doctor/petrov': 'Петров', 'doctor/sidorov': 'Сидоров'}
+
+
+def parse_title(html, url):
+    start = html.index('<title>') + len('<title>')
+    return {'link': url, 'name': html[start:html.index('</title>')]}
+
+
+@pytest.fixture
+def site(tmp_path):
+    pages = tmp_path / 'pages'
+    (pages / 'doctor').mkdir(parents=True)
+    for path, name in DOCTORS.items():
+        (pages / f'{path}.html').write_text(f'<html><title>{name}</title></html>', encoding='utf-8')
+    server = serve_pages(str(pages), port=0)
+    host, port = server.server_address
+    yield f'http://{host}:{port}/'
+    server.shutdown()
+    server.server_close()
+
+
+def crawl(urls, output, checkpoint):
+    pool = CrawlPool(parse_title, str(output), checkpoint, workers=2, rates={'127.0.0.1': 1000}, retries=0)
+    return pool.run(urls)
+
+
+def read_rows(output):
+    with open(output, encoding='utf-8') as rows:
+        return [json.loads(line) for line in rows]
+
+
+def test_crawl_saved_pages(site, tmp_path):
+    urls = [site + path for path in DOCTORS]
+    output = tmp_path / 'doctors.jsonl'
+    with Checkpoint(str(tmp_path / 'doctors.checkpoint')) as checkpoint:
+        stats = crawl(urls + [site + 'doctor/missing'], output, checkpoint)
+
+    assert stats['done'] == 3 and stats['failed'] == 1
+    rows = {row['link']: row['name'] for row in read_rows(output)}
+    assert rows == {site + path: name for path, name in DOCTORS.items()}
+
+
+def test_resume_from_checkpoint(site, tmp_path):
+    urls = [site + path for path in DOCTORS]
+    output = tmp_path / 'doctors.jsonl'
+    checkpoint_path = str(tmp_path / 'doctors.checkpoint')
+
+    # Один checkpoint на два запуска: после первого он остаётся открытым
+    with Checkpoint(checkpoint_path) as checkpoint:
+        crawl(urls[:1], output, checkpoint)
+        stats = crawl(urls[:2], output, checkpoint)
+    assert stats['done'] == 1 and stats['skipped'] == 1
+
+    # Новый запуск по тому же файлу продолжает с необработанных
+    with Checkpoint(checkpoint_path) as checkpoint:
+        assert checkpoint.pending(urls) == urls[2:]
+        stats = crawl(urls, output, checkpoint)
+    assert stats['done'] == 1 and stats['skipped'] == 2
+    assert sorted(row['link'] for row in read_rows(output)) == sorted(urls)
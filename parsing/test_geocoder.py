@@ -0,0 +1,17 @@
+import os
+import sys
+
+import geocoder
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+import geo  # noqa: E402
+
+
+def test_normalizer_matches_corpus():
+    differ = geocoder.check_normalizer()
+    assert differ.empty, differ[['address', 'address_norm', 'actual']].to_string()
+
+
+def test_bot_and_geocoder_share_normalizer():
+    # Бот находит координаты по ключам, которые записал геокодер
+    assert geo.normalize_address is geocoder.normalize_address